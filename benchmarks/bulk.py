@@ -0,0 +1,94 @@
+# Virtualbricks - a vde/qemu gui written in python and GTK/Glade.
+# Copyright (C) 2018 Virtualbricks team
+
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+"""Benchmark for the bulk creation of bricks.
+
+Run it from the root of the source tree:
+
+    $ python -m benchmarks.bulk
+
+It creates a testbed of 10k bricks, one switch every ten virtual machines,
+with L{BrickFactory.new_bricks} and with a loop of L{BrickFactory.new_brick}.
+The target for the bulk creation is less than a second.
+"""
+
+import gettext
+import sys
+import timeit
+
+gettext.install("virtualbricks")
+
+from twisted.internet import defer
+
+from virtualbricks import brickfactory
+
+
+SIZE = 10000
+TARGET = 1.0
+
+
+def specs(size):
+    specs, links = [], []
+    for i in range(size):
+        if i % 10 == 0:
+            switch = "sw{0}".format(i)
+            specs.append(("switch", switch))
+        else:
+            name = "vm{0}".format(i)
+            specs.append(("vm", name))
+            links.append((name, switch))
+    return specs, links
+
+
+def bench_bulk(size):
+    bricks, links = specs(size)
+
+    def create():
+        factory = brickfactory.BrickFactory(defer.Deferred())
+        factory.new_bricks(bricks, links)
+
+    return min(timeit.repeat(create, number=1, repeat=3))
+
+
+def bench_loop(size):
+    bricks, links = specs(size)
+
+    def create():
+        factory = brickfactory.BrickFactory(defer.Deferred())
+        for type, name in bricks:
+            factory.new_brick(type, name)
+        for name, endpoint in links:
+            factory.get_brick_by_name(name).connect(
+                factory.get_brick_by_name(endpoint).socks[0])
+
+    return min(timeit.repeat(create, number=1, repeat=3))
+
+
+def main():
+    bulk = bench_bulk(SIZE)
+    loop = bench_loop(SIZE)
+    print("{0} bricks".format(SIZE))
+    print("new_bricks: {0:8.3f}s".format(bulk))
+    print("new_brick:  {0:8.3f}s".format(loop))
+    if bulk > TARGET:
+        print("new_bricks is over the target of {0}s".format(TARGET))
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,97 @@
+# Virtualbricks - a vde/qemu gui written in python and GTK/Glade.
+# Copyright (C) 2018 Virtualbricks team
+
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+"""Microbenchmark of the brick configuration.
+
+Run it from the root of the source tree:
+
+    $ python -m benchmarks.config
+
+For every brick type it prints the cost of building the configuration, of
+building the whole brick, of restoring the brick from a saved section and of
+reading all the parameters as strings. The restore includes the
+construction of the brick.
+"""
+
+import gettext
+import io
+import sys
+import timeit
+
+gettext.install("virtualbricks")
+
+from twisted.internet import defer
+
+from virtualbricks import brickfactory, configfile, _configparser
+
+
+TYPES = ("switch", "tap", "wire", "netemu", "vm")
+NUMBER = 2000
+
+
+def saved_section(factory, typ):
+    """Return the saved section of a brick with all the parameters set."""
+
+    brick = factory.new_brick(typ, "saved_" + typ)
+    # Save also the default values, the restore must convert all of them
+    params = [(name, param.to_string_brick(brick.config[name], brick))
+              for name, param in sorted(brick.config.parameters.items())]
+    out = io.StringIO()
+    out.write(u"[{0}:{1}]\n".format(brick.get_type(), brick.name))
+    for name, value in params:
+        out.write(u"{0}={1}\n".format(name, value))
+    for section in _configparser.Parser(io.StringIO(out.getvalue())):
+        return list(section)
+
+
+def bench(func):
+    return min(timeit.repeat(func, number=NUMBER, repeat=3)) / NUMBER
+
+
+def main():
+    factory = brickfactory.BrickFactory(defer.Deferred())
+    print("{0:>8} {1:>7} {2:>12} {3:>12} {4:>12} {5:>12}".format(
+        "type", "params", "config (us)", "brick (us)", "restore (us)",
+        "get all (us)"))
+    for typ in TYPES:
+        section = saved_section(factory, typ)
+        brick = factory.new_brick(typ, "bench_" + typ)
+        config_factory = brick.config_factory
+        names = list(brick.config.parameters)
+        klass = type(brick)
+
+        def build_brick():
+            klass(factory, "b")
+
+        def restore():
+            new = klass(factory, "r")
+            with configfile.freeze_notify(new):
+                new.load_from(section)
+
+        def get_all():
+            get = brick.config.get
+            for name in names:
+                get(name)
+
+        print("{0:>8} {1:>7} {2:>12.2f} {3:>12.2f} {4:>12.2f} {5:>12.2f}"
+              .format(typ, len(names), bench(config_factory) * 1e6,
+                      bench(build_brick) * 1e6, bench(restore) * 1e6,
+                      bench(get_all) * 1e6))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,102 @@
+# Virtualbricks - a vde/qemu gui written in python and GTK/Glade.
+# Copyright (C) 2018 Virtualbricks team
+
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+"""Benchmark for the creation of the private COW images.
+
+Run it from the root of the source tree:
+
+    $ python -m benchmarks.cow [count] [max_parallel]
+
+It compares the old way of creating the images, qemu-img followed by the
+sync(1) command that flushes all the dirty pages of the host, with the new
+one, qemu-img followed by the fsync of the new image and of its directory.
+The stub qemu-img in virtualbricks/tests/data is used in place of the real
+one, so the benchmark measures the cost of the flushes and of the process
+management. Run it on a busy host to see the difference.
+"""
+
+import gettext
+import os
+import shutil
+import sys
+import tempfile
+
+gettext.install("virtualbricks")
+
+from twisted.internet import defer, task, threads, utils
+
+from virtualbricks import settings, tools
+from virtualbricks._spawn import getQemuOutputAndValue
+
+
+COUNT = 100
+MAX_PARALLEL = 8
+DATA = os.path.join(os.path.dirname(tools.__file__), "tests", "data")
+
+
+def qemu_img(cowname):
+    # The stub qemu-img uses its last argument as exit code
+    args = ["create", "-b", "base", "-f", "qcow2", "0"]
+    d = getQemuOutputAndValue("qemu-img", args, os.environ)
+
+    def created(ret):
+        # Simulate the new image
+        with open(cowname, "w") as fp:
+            fp.write("\0" * 4096)
+    return d.addCallback(created)
+
+
+def with_sync(cowname):
+    d = qemu_img(cowname)
+    d.addCallback(lambda _: utils.getProcessOutputAndValue(
+        "sync", env=os.environ))
+    return d
+
+
+def with_fsync(cowname):
+    d = qemu_img(cowname)
+    d.addCallback(lambda _: threads.deferToThread(tools.fsync, cowname))
+    return d
+
+
+@defer.inlineCallbacks
+def bench(reactor, create, count, max_parallel):
+    tmpdir = tempfile.mkdtemp()
+    try:
+        semaphore = defer.DeferredSemaphore(max_parallel)
+        started = reactor.seconds()
+        yield defer.gatherResults([
+            semaphore.run(create, os.path.join(tmpdir, "vm{0}.cow".format(i)))
+            for i in range(count)])
+        defer.returnValue(reactor.seconds() - started)
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+@defer.inlineCallbacks
+def main(reactor, count=COUNT, max_parallel=MAX_PARALLEL):
+    settings.set("qemupath", DATA)
+    count, max_parallel = int(count), int(max_parallel)
+    print("{0} images, {1} in parallel".format(count, max_parallel))
+    for name, create in ("sync", with_sync), ("fsync", with_fsync):
+        elapsed = yield bench(reactor, create, count, max_parallel)
+        print("{0:>6}: {1:8.3f}s {2:8.1f} images/s".format(
+            name, elapsed, count / elapsed))
+
+
+if __name__ == "__main__":
+    task.react(main, sys.argv[1:])
@@ -0,0 +1,100 @@
+# Virtualbricks - a vde/qemu gui written in python and GTK/Glade.
+# Copyright (C) 2018 Virtualbricks team
+
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+"""Scaling benchmark for the factory name lookups and the project restore.
+
+Run it from the root of the source tree:
+
+    $ python -m benchmarks.factory
+
+For each project size it prints the mean cost of a lookup and the cost of
+restoring the whole project, per brick. Both should stay flat as the project
+grows.
+"""
+
+import gettext
+import io
+import sys
+import timeit
+
+gettext.install("virtualbricks")
+
+from twisted.internet import defer
+
+from virtualbricks import brickfactory, configfile
+
+
+SIZES = (250, 500, 1000, 2000, 3000)
+LOOKUPS = 2000
+
+
+def populate(factory, size):
+    """Build a testbed of C{size} bricks: one switch every ten machines."""
+
+    switch = None
+    for i in range(size):
+        if i % 10 == 0:
+            switch = factory.new_brick("switch", "sw{0}".format(i))
+        else:
+            vm = factory.new_brick("vm", "vm{0}".format(i))
+            vm.connect(switch.socks[0])
+        if i % 100 == 0:
+            factory.new_event("ev{0}".format(i))
+
+
+def bench_lookups(factory, size):
+    names = ["vm{0}".format(i) for i in range(1, size, 10)]
+    socks = ["sw{0}_port".format(i) for i in range(0, size, 10)]
+
+    def lookup():
+        for name in names:
+            factory.get_brick_by_name(name)
+            factory.is_in_use(name)
+        for nick in socks:
+            factory.get_sock_by_name(nick)
+
+    n = len(names) * 2 + len(socks)
+    return min(timeit.repeat(lookup, number=LOOKUPS // n + 1, repeat=3)) / \
+        ((LOOKUPS // n + 1) * n)
+
+
+def bench_restore(size):
+    factory = brickfactory.BrickFactory(defer.Deferred())
+    populate(factory, size)
+    out = io.StringIO()
+    configfile.ConfigFile().save_to(factory, out)
+    dump = out.getvalue()
+
+    def restore():
+        new = brickfactory.BrickFactory(defer.Deferred())
+        configfile.ConfigFile().restore_from(new, io.StringIO(dump))
+
+    return factory, min(timeit.repeat(restore, number=1, repeat=3)) / size
+
+
+def main():
+    print("{0:>6} {1:>14} {2:>16}".format("bricks", "lookup (us)",
+                                          "restore (us/brick)"))
+    for size in SIZES:
+        factory, restore = bench_restore(size)
+        lookup = bench_lookups(factory, size)
+        print("{0:>6} {1:>14.3f} {2:>16.1f}".format(size, lookup * 1e6,
+                                                    restore * 1e6))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
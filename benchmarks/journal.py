@@ -0,0 +1,99 @@
+# Virtualbricks - a vde/qemu gui written in python and GTK/Glade.
+# Copyright (C) 2018 Virtualbricks team
+
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+"""Incremental saves with the journal.
+
+Run it from the root of the source tree:
+
+    $ python -m benchmarks.journal
+
+It saves the testbed of L{benchmarks.bulk}, 10k bricks, then changes one
+virtual machine at a time and makes every change durable: with a full save
+of the project file, as the autosave did, and with a commit of the journal.
+For both it prints the best time out of three. At last it prints the time
+to restore the project with the journal of all the changes.
+"""
+
+import gettext
+import os
+import shutil
+import sys
+import tempfile
+import timeit
+
+gettext.install("virtualbricks")
+
+from twisted.internet import defer, task
+from twisted.python import filepath
+
+from virtualbricks import brickfactory, configfile, journal, snapshot
+from benchmarks import project
+
+
+SIZE = 10000
+CHANGES = 100
+
+
+def sync(function, *args):
+    return defer.maybeDeferred(function, *args)
+
+
+def main():
+    factory = project.testbed(SIZE)
+    vms = [brick for brick in factory.bricks
+           if brick.get_type() == "Qemu"][:CHANGES]
+    ram = iter(range(128, sys.maxsize))
+    tmp = tempfile.mkdtemp()
+    try:
+        fp = filepath.FilePath(os.path.join(tmp, ".project"))
+        config = configfile.ConfigFile()
+        config.save(factory, fp)
+
+        def full_save():
+            for vm in vms:
+                vm.set({"ram": next(ram)})
+                config.write(fp, snapshot.state(factory))
+
+        elapsed = min(timeit.repeat(full_save, number=1, repeat=3))
+        print("{0} changes, full save:      {1:.3f}s".format(CHANGES,
+                                                             elapsed))
+        clock = task.Clock()
+        journal.Journal(factory, journal.filename(fp.path), clock=clock,
+                        defer_to_thread=sync).open()
+
+        def commit():
+            for vm in vms:
+                vm.set({"ram": next(ram)})
+                factory.journal.commit()
+
+        elapsed = min(timeit.repeat(commit, number=1, repeat=3))
+        print("{0} changes, journal commit: {1:.3f}s ({2} KiB)".format(
+            CHANGES, elapsed, factory.journal.size >> 10))
+
+        def restore():
+            configfile.ConfigFile().restore(
+                brickfactory.BrickFactory(defer.Deferred()), fp)
+
+        elapsed = min(timeit.repeat(restore, number=1, repeat=3))
+        print("restore with the journal:   {0:.3f}s".format(elapsed))
+    finally:
+        shutil.rmtree(tmp)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,84 @@
+# Virtualbricks - a vde/qemu gui written in python and GTK/Glade.
+# Copyright (C) 2018 Virtualbricks team
+
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+"""Memory used by the bricks.
+
+Run it from the root of the source tree:
+
+    $ python -m benchmarks.memory
+
+For every brick type it prints the bytes allocated for every brick, measured
+with tracemalloc while building C{COUNT} bricks in a factory. Virtual
+machines are measured alone and with one network card connected to a
+switch, that is with their plug, sock and link.
+"""
+
+import gc
+import gettext
+import sys
+import tracemalloc
+
+gettext.install("virtualbricks")
+
+from twisted.internet import defer
+
+from virtualbricks import brickfactory
+
+
+COUNT = 2000
+TYPES = ("switch", "tap", "wire", "netemu", "vm")
+
+
+def measure(build):
+    factory = brickfactory.BrickFactory(defer.Deferred())
+    # Warm up the caches (class schemas, interned strings)
+    build(factory, -1)
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    for i in range(COUNT):
+        build(factory, i)
+    gc.collect()
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return (after - before) / COUNT
+
+
+def brick_builder(typ):
+    def build(factory, i):
+        factory.new_brick(typ, "{0}{1}".format(typ, i + 1))
+    return build
+
+
+def connected_vm(factory, i):
+    switch = factory.get_brick_by_name("bench_switch")
+    if switch is None:
+        switch = factory.new_brick("switch", "bench_switch")
+        switch.config["numports"] = COUNT + 1
+    vm = factory.new_brick("vm", "vm{0}".format(i + 1))
+    vm.connect(switch.socks[0])
+
+
+def main():
+    print("{0:>12} {1:>14}".format("type", "bytes/brick"))
+    for typ in TYPES:
+        print("{0:>12} {1:>14.0f}".format(typ, measure(brick_builder(typ))))
+    print("{0:>12} {1:>14.0f}".format("vm+link", measure(connected_vm)))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,174 @@
+# Virtualbricks - a vde/qemu gui written in python and GTK/Glade.
+# Copyright (C) 2018 Virtualbricks team
+
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+"""Parsing of the project files.
+
+Run it from the root of the source tree:
+
+    $ python -m benchmarks.project
+
+It saves the testbed of L{benchmarks.bulk}, 10k bricks, and parses it with
+the old parser, that read the file line by line and seeked back at the end
+of every section, and with the single pass parser. For both it prints the
+best time out of three and the peak of the memory allocated, measured with
+tracemalloc. At last it prints the time to restore the whole project from
+the project file and from the binary snapshot.
+"""
+
+import gettext
+import io
+import os
+import re
+import shutil
+import sys
+import tempfile
+import timeit
+import tracemalloc
+
+gettext.install("virtualbricks")
+
+from twisted.internet import defer
+
+from virtualbricks import brickfactory, configfile, snapshot, _configparser
+from benchmarks import bulk
+
+
+SIZE = 10000
+
+
+class _OldSection:
+
+    EMPTY = re.compile(r"^\s*$")
+    CONFIG_LINE = re.compile(r"^(\w+)\s*=\s*(.*)$")
+
+    def __init__(self, type, name, fileobj):
+        self.type = type
+        self.name = name
+        self.fileobj = fileobj
+
+    def __iter__(self):
+        curpos = self.fileobj.tell()
+        line = self.fileobj.readline()
+        while line:
+            if line.startswith("#") or self.EMPTY.match(line):
+                curpos = self.fileobj.tell()
+                line = self.fileobj.readline()
+                continue
+            match = self.CONFIG_LINE.match(line)
+            if match:
+                yield match.groups()
+                curpos = self.fileobj.tell()
+                line = self.fileobj.readline()
+            else:
+                self.fileobj.seek(curpos)
+                return
+
+
+class _OldParser:
+    """The parser before the single pass one, for comparison."""
+
+    EMPTY = re.compile(r"^\s*$")
+    SECTION_HEADER = _configparser.Parser.SECTION_HEADER
+    LINK = _configparser.Parser.LINK
+
+    def __init__(self, fileobj):
+        self.fileobj = fileobj
+
+    def __iter__(self):
+        line = self.fileobj.readline()
+        while line:
+            if line.startswith("#") or self.EMPTY.match(line):
+                line = self.fileobj.readline()
+                continue
+            match = self.SECTION_HEADER.match(line)
+            if match:
+                yield _OldSection(match.group(1), match.group(2),
+                                  self.fileobj)
+            else:
+                match = self.LINK.match(line)
+                if match:
+                    yield _configparser.Link._make(match.groups())
+            line = self.fileobj.readline()
+
+
+def testbed(size):
+    bricks, links = bulk.specs(size)
+    factory = brickfactory.BrickFactory(defer.Deferred())
+    factory.new_bricks(bricks, links)
+    return factory
+
+
+def project(size):
+    fileobj = io.StringIO()
+    configfile.ConfigFile().save_to(testbed(size), fileobj)
+    return fileobj.getvalue()
+
+
+def consume(parser):
+    # The builders iterate over the options of the sections
+    for item in parser:
+        if isinstance(item, tuple):
+            continue
+        for option in item:
+            pass
+
+
+def bench(parser_class, content):
+    def parse():
+        consume(parser_class(io.StringIO(content)))
+
+    elapsed = min(timeit.repeat(parse, number=1, repeat=3))
+    tracemalloc.start()
+    parse()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return elapsed, peak
+
+
+def bench_restore(filename):
+    def restore():
+        factory = brickfactory.BrickFactory(defer.Deferred())
+        configfile.ConfigFile().restore(factory, filename)
+
+    return min(timeit.repeat(restore, number=1, repeat=3))
+
+
+def main():
+    content = project(SIZE)
+    print("{0} bricks, {1} lines, {2} KiB".format(
+        SIZE, content.count("\n"), len(content) >> 10))
+    print("{0:>8} {1:>10} {2:>12}".format("", "time (s)", "peak (KiB)"))
+    for name, parser_class in (("old", _OldParser),
+                               ("new", _configparser.Parser)):
+        elapsed, peak = bench(parser_class, content)
+        print("{0:>8} {1:>10.3f} {2:>12}".format(name, elapsed, peak >> 10))
+    tmp = tempfile.mkdtemp()
+    try:
+        filename = os.path.join(tmp, ".project")
+        configfile.ConfigFile().save(testbed(SIZE), filename)
+        print("snapshot: {0} KiB".format(
+            os.path.getsize(snapshot.filename(filename)) >> 10))
+        print("restore (snapshot): {0:.3f}s".format(bench_restore(filename)))
+        os.remove(snapshot.filename(filename))
+        print("restore (text):     {0:.3f}s".format(bench_restore(filename)))
+    finally:
+        shutil.rmtree(tmp)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,101 @@
+# Virtualbricks - a vde/qemu gui written in python and GTK/Glade.
+# Copyright (C) 2018 Virtualbricks team
+
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+"""Spawn latency, from the reactor and from the spawn server.
+
+Run it from the root of the source tree:
+
+    $ python -m benchmarks.spawn [BALLAST_MB]
+
+It starts C{COUNT} times C{/bin/true}, one after the other, and prints the
+time spent in the call to C{spawnProcess}, that blocks the reactor, and the
+time until the process has ended. The main process of Virtualbricks holds
+GTK and the engine: C{BALLAST_MB} megabytes are allocated before the
+measures to make this process as large.
+"""
+
+import gettext
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+gettext.install("virtualbricks")
+
+from twisted.internet import defer, protocol, reactor, task
+
+from virtualbricks import _spawn
+
+
+COUNT = 200
+
+
+class _Protocol(protocol.ProcessProtocol):
+
+    def __init__(self):
+        self.ended = defer.Deferred()
+
+    def processEnded(self, reason):
+        self.ended.callback(None)
+
+
+@defer.inlineCallbacks
+def measure(spawn):
+    call = total = 0.0
+    for _ in range(COUNT):
+        proto = _Protocol()
+        start = time.perf_counter()
+        spawn(proto, "/bin/true", ["true"], os.environ)
+        call += time.perf_counter() - start
+        yield proto.ended
+        total += time.perf_counter() - start
+    defer.returnValue((call / COUNT, total / COUNT))
+
+
+def report(name, result):
+    call, total = result
+    print("{0:>10} {1:>10.3f} {2:>10.3f}".format(name, call * 1e3,
+                                                 total * 1e3))
+
+
+@defer.inlineCallbacks
+def main(ballast_mb):
+    # Touch every page, as a real process would
+    ballast = bytearray(b"\x01" * (ballast_mb << 20))
+    tmp = tempfile.mkdtemp()
+    server = _spawn.SpawnServer(reactor)
+    try:
+        server.start(os.path.join(tmp, "spawn.sock"))
+        while not os.path.exists(server.path):
+            yield task.deferLater(reactor, 0.01, lambda: None)
+        print("ballast {0} MB, {1} processes".format(ballast_mb, COUNT))
+        print("{0:>10} {1:>10} {2:>10}".format("", "call (ms)",
+                                               "ended (ms)"))
+        report("reactor", (yield measure(reactor.spawnProcess)))
+        report("server", (yield measure(server.spawnProcess)))
+    finally:
+        server.stop()
+        shutil.rmtree(tmp)
+        del ballast
+        reactor.stop()
+
+
+if __name__ == "__main__":
+    reactor.callWhenRunning(main, int(sys.argv[1]) if len(sys.argv) > 1
+                            else 0)
+    sys.exit(reactor.run())
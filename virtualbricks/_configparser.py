@@ -16,57 +16,66 @@
 # with this program; if not, write to the Free Software Foundation, Inc.,
 # 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
 
+"""The parser of the project files.
+
+A project file is read in a single pass: every line is looked at only once
+and the parser never seeks back. L{Parser} yields the sections (bricks,
+events and images) when they are complete, followed by their C{name=value}
+options, and the C{link|} and C{sock|} records. The lines that are not
+understood are skipped and logged with their line number.
+"""
+
 import re
 import collections
 
+from virtualbricks import log
+
 __metaclass__ = type
 
+logger = log.Logger()
+line_skipped = log.Event("Line {lineno} not understood, skipping: {line}")
 
-class Section:
 
-    EMPTY = re.compile(r"^\s*$")
-    CONFIG_LINE = re.compile(r"^(\w+)\s*=\s*(.*)$")
+class Section:
+    """A section of the project file, it iterates over its options."""
 
-    def __init__(self, type, name, fileobj):
+    def __init__(self, type, name, options=None, lineno=None):
         self.type = type
         self.name = name
-        self.fileobj = fileobj
+        if options is None:
+            options = []
+        self.options = options
+        self.lineno = lineno
 
     def __iter__(self):
-        curpos = self.fileobj.tell()
-        line = self.fileobj.readline()
-        while line:
-            if line.startswith("#") or self.EMPTY.match(line):
-                curpos = self.fileobj.tell()
-                line = self.fileobj.readline()
-                continue
-            match = self.CONFIG_LINE.match(line)
-            if match:
-                name, value = match.groups()
-                if value is None:
-                    # value is None when the parameter is not set
-                    value = ""
-                yield name, value
-                curpos = self.fileobj.tell()
-                line = self.fileobj.readline()
-            else:
-                self.fileobj.seek(curpos)
-                return
+        return iter(self.options)
+
+    def __repr__(self):
+        return "<Section {0}:{1} at line {2}>".format(self.type, self.name,
+                                                      self.lineno)
 
 
 Link = collections.namedtuple("Link", ["type", "owner", "sockname", "model",
                                        "mac"])
 
 
+def _is_word(name):
+    # Same as the regex \w+, without a regex
+    return name.replace("_", "a").isalnum()
+
+
 class Parser:
+    """Parse a project.
+
+    @param fileobj: a file object or the content of the project.
+    """
 
-    EMPTY = re.compile(r"^\s*$")
     SECTION_HEADER = re.compile(r"^\[([a-zA-Z0-9_]+):(.+)\]$")
     LINK = re.compile(r"^(?P<type>link|sock)\|"
-                      "(?P<owner>[a-zA-Z][\w.-]*)\|"
-                      "(?P<sockname>[a-zA-Z_][\w.-]*)\|"
-                      "(?P<model>\w*)\|"
-                      "(?P<mac>(?:(?:[0-9a-hA-H]{2}:){5}[0-9a-hA-H]{2})|)$")
+                      r"(?P<owner>[a-zA-Z][\w.-]*)\|"
+                      r"(?P<sockname>[a-zA-Z_][\w.-]*)\|"
+                      r"(?P<model>\w*)\|"
+                      r"(?P<mac>(?:(?:[0-9a-hA-H]{2}:){5}[0-9a-hA-H]{2})|)$")
 
     def __init__(self, fileobj):
         self.fileobj = fileobj
@@ -77,16 +86,43 @@ class Parser:
         second kind of section.
         """
 
-        line = self.fileobj.readline()
-        while line:
-            if line.startswith('#') or self.EMPTY.match(line):
-                line = self.fileobj.readline()
+        for _, item in self.tokens():
+            yield item
+
+    def tokens(self):
+        """Yield the pairs C{(lineno, item)}, where C{item} is a L{Section}
+        or a L{Link}."""
+
+        if isinstance(self.fileobj, str):
+            lines = self.fileobj.split("\n")
+        else:
+            lines = self.fileobj
+        section = None
+        for lineno, line in enumerate(lines, 1):
+            line = line.rstrip("\n")
+            if not line or line[0] == "#" or line.isspace():
                 continue
-            match = self.SECTION_HEADER.match(line)
-            if match:
-                yield Section(match.group(1), match.group(2), self.fileobj)
-            else:
+            if section is not None:
+                name, sep, value = line.partition("=")
+                if sep:
+                    name = name.rstrip()
+                    if _is_word(name):
+                        section.options.append((name, value.lstrip()))
+                        continue
+                # The section is complete
+                yield section.lineno, section
+                section = None
+            if line[0] == "[":
+                match = self.SECTION_HEADER.match(line)
+                if match:
+                    section = Section(match.group(1), match.group(2), [],
+                                      lineno)
+                    continue
+            elif line.startswith(("link|", "sock|")):
                 match = self.LINK.match(line)
                 if match:
-                    yield Link._make(match.groups())
-            line = self.fileobj.readline()
+                    yield lineno, Link._make(match.groups())
+                    continue
+            logger.warn(line_skipped, lineno=lineno, line=line)
+        if section is not None:
+            yield section.lineno, section
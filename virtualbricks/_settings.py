@@ -55,6 +55,9 @@ DEFAULT_CONF = {
     "show_missing": True,
     "qemupath": "/usr/bin",
     "vdepath": "/usr/bin",
+    "jobs_slots": 4,
+    "jobs_io_slots": 2,
+    "spawn_server": False,
 }
 
 
@@ -79,7 +82,8 @@ class SettingsMeta(type):
 class Settings(six.with_metaclass(SettingsMeta)):
 
     __boolean_values__ = ('kvm', 'ksm', 'python', 'femaleplugs',
-                          'erroronloop', 'systray', 'show_missing')
+                          'erroronloop', 'systray', 'show_missing',
+                          'spawn_server')
     DEFAULT_SECTION = "Main"
     DEFAULT_PROJECT = DEFAULT_PROJECT
     VIRTUALBRICKS_HOME = VIRTUALBRICKS_HOME
@@ -113,6 +117,10 @@ class Settings(six.with_metaclass(SettingsMeta)):
             raise NoOptionError(attr)
 
     def set(self, attr, value):
+        from virtualbricks import capabilities
+
+        if attr in capabilities.PATH_SETTINGS:
+            capabilities.cache.invalidate()
         self.config.set(self.DEFAULT_SECTION, attr, str(value))
 
     def store(self):
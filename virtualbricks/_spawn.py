@@ -1,3 +1,4 @@
+# -*- test-case-name: virtualbricks.tests.test_spawnserver -*-
 # Virtualbricks - a vde/qemu gui written in python and GTK/Glade.
 # Copyright (C) 2018 Virtualbricks team
 
@@ -15,10 +16,32 @@
 # with this program; if not, write to the Free Software Foundation, Inc.,
 # 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
 
+import array
+import errno
+import json
 import locale
 import os
+import select
+import signal
+import socket
+import subprocess
+import sys
+
 import six
+from twisted.internet import error, process, protocol
 from twisted.internet.utils import getProcessOutput, getProcessOutputAndValue
+from twisted.protocols import basic
+
+from virtualbricks import capabilities, log, spawnserver
+
+
+logger = log.Logger()
+server_started = log.Event("Spawn server started ({path})")
+server_unavailable = log.Event("Spawn server not available, spawning from "
+                               "the main process")
+server_lost = log.Event("Spawn server lost, spawning from the main process")
+server_slow = log.Event("Spawn server too slow, spawning {executable} from "
+                        "the main process")
 
 
 def _abspath_exe(path, executable, return_relative=True):
@@ -27,21 +50,14 @@ def _abspath_exe(path, executable, return_relative=True):
             return executable
         else:
             return None
-    if isinstance(path, six.string_types) and path != '':
-        abspath = os.path.join(path, executable)
-        if os.access(abspath, os.X_OK):
-            return abspath
-        elif return_relative:
-            return executable
-        else:
-            return None
-    paths = os.environ.get('PATH', '.').split(':')
-    for path in paths:
-        if os.access(os.path.join(path, executable), os.X_OK):
-            return os.path.join(path, executable)
-    if return_relative:
+    if not isinstance(path, six.string_types):
+        path = ''
+    # The lookups are cached, an empty path searches the PATH
+    abspath = capabilities.cache.resolve(path, executable)
+    if abspath is None and return_relative:
         # cannot find executable, return the relative filename
         return executable
+    return abspath
 
 
 def _encode(value):
@@ -78,3 +94,248 @@ def abspath_qemu(executable, return_relative=True):
     from virtualbricks import settings
 
     return _abspath_exe(settings.get('qemupath'), executable, return_relative)
+
+
+class _StatusProtocol(basic.LineOnlyReceiver):
+
+    delimiter = b"\n"
+
+    def __init__(self, process):
+        self.process = process
+
+    def lineReceived(self, line):
+        verb, _, status = line.partition(b" ")
+        if verb == b"exit":
+            self.process.processEnded(int(status))
+
+    def connectionLost(self, reason):
+        if self.process.pid is not None:
+            # The server is gone before the child
+            self.process.processEnded(None)
+
+
+class _LateReplyProtocol(basic.LineOnlyReceiver):
+    """Read the reply of a request given up, the child spawned too late is
+    already spawned by the reactor: terminate it."""
+
+    delimiter = b"\n"
+
+    def lineReceived(self, line):
+        verb, _, value = line.partition(b" ")
+        if verb == b"pid":
+            try:
+                os.kill(int(value), signal.SIGTERM)
+            except OSError:
+                pass
+        self.transport.loseConnection()
+
+
+class _LateReplyFactory(protocol.Factory):
+
+    noisy = False
+    protocol = _LateReplyProtocol
+
+
+class _StatusFactory(protocol.Factory):
+
+    noisy = False
+
+    def __init__(self, process):
+        self.process = process
+
+    def buildProtocol(self, addr):
+        return _StatusProtocol(self.process)
+
+
+class RemoteProcess(process.Process):
+    """A process started by the spawn server.
+
+    The child writes and reads the pipes of the main process directly, only
+    its exit status is read from the spawn server. It has the same interface
+    of the processes returned by C{reactor.spawnProcess}.
+    """
+
+    def __init__(self, reactor, pid, proto, stdin, stdout, stderr):
+        # Do not call process.Process.__init__, it forks
+        process._BaseProcess.__init__(self, proto)
+        self.pid = pid
+        self.pipes = {
+            0: process.ProcessWriter(reactor, self, 0, stdin),
+            1: process.ProcessReader(reactor, self, 1, stdout),
+            2: process.ProcessReader(reactor, self, 2, stderr)}
+        proto.makeConnection(self)
+
+    def _getReason(self, status):
+        if status is None:
+            return error.ProcessTerminated()
+        return process.Process._getReason(self, status)
+
+    def reapProcess(self):
+        # The child is reaped by the spawn server
+        pass
+
+    def maybeCallProcessEnded(self):
+        if self.pipes or not self.lostProcess:
+            return
+        process._BaseProcess.maybeCallProcessEnded(self)
+
+
+def _to_text(value):
+    if isinstance(value, bytes):
+        return os.fsdecode(value)
+    return value
+
+
+def _readline(sock):
+    # One byte at a time, what follows the line belongs to the reactor
+    data = b""
+    while not data.endswith(b"\n"):
+        char = sock.recv(1)
+        if not char:
+            raise EOFError()
+        data += char
+    return data[:-1]
+
+
+class SpawnServer:
+    """Start the processes with the spawn server, see
+    L{virtualbricks.spawnserver}.
+
+    Until the server is started, or if it is not available, the processes
+    are spawned by the reactor. They are spawned by the reactor also if the
+    server does not reply within C{reply_timeout} seconds, the reactor does
+    not wait longer for a busy server.
+
+    @ivar spawned: the number of processes started by the server.
+    """
+
+    # Seconds to wait for the reply to a request.
+    timeout = 5.0
+    # Seconds to wait for the pid of the child, then the reactor spawns it.
+    reply_timeout = 0.2
+
+    def __init__(self, reactor=None):
+        self._reactor = reactor
+        self.path = None
+        self.process = None
+        self.spawned = 0
+
+    @property
+    def reactor(self):
+        if self._reactor is None:
+            from twisted.internet import reactor
+            self._reactor = reactor
+        return self._reactor
+
+    def start(self, path):
+        """Start the server listening on the unix socket C{path}.
+
+        The server is a new interpreter that runs only the script
+        L{virtualbricks.spawnserver}, it does not import GTK or the engine.
+        """
+
+        if not spawnserver.available():
+            logger.warn(server_unavailable)
+            return
+        self.path = path
+        self.process = subprocess.Popen(
+            [sys.executable, spawnserver.__file__, path],
+            stdin=subprocess.PIPE, close_fds=True)
+        logger.info(server_started, path=path)
+
+    def stop(self):
+        if self.process is not None:
+            self.process.stdin.close()
+            self.process.wait()
+            self.process = None
+
+    def is_running(self):
+        return self.process is not None and self.process.poll() is None
+
+    def _connect(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sock.settimeout(self.timeout)
+            sock.connect(self.path)
+        except socket.error:
+            sock.close()
+            raise
+        return sock
+
+    def spawnProcess(self, proto, executable, args, env={}, path=None):
+        """Spawn a process, same arguments of C{reactor.spawnProcess}.
+
+        The spawn server does not change the working directory: if C{path}
+        is given the process is spawned by the reactor.
+        """
+
+        if path is not None or not self.is_running():
+            return self.reactor.spawnProcess(proto, executable, args, env,
+                                             path)
+        try:
+            sock = self._connect()
+        except socket.error as e:
+            if e.errno not in (errno.ENOENT, errno.ECONNREFUSED):
+                logger.warn(server_lost)
+            # Not ready yet or gone
+            return self.reactor.spawnProcess(proto, executable, args, env,
+                                             path)
+        try:
+            return self._spawn(sock, proto, executable, args, env)
+        except socket.timeout:
+            logger.warn(server_slow, executable=executable)
+            return self.reactor.spawnProcess(proto, executable, args, env,
+                                             path)
+        finally:
+            sock.close()
+
+    def _spawn(self, sock, proto, executable, args, env):
+        stdin_r, stdin_w = os.pipe()
+        stdout_r, stdout_w = os.pipe()
+        stderr_r, stderr_w = os.pipe()
+        child = (stdin_r, stdout_w, stderr_w)
+        parent = (stdin_w, stdout_r, stderr_r)
+        try:
+            request = json.dumps({
+                "executable": _to_text(executable),
+                "args": [_to_text(arg) for arg in args],
+                "env": dict((_to_text(k), _to_text(v))
+                            for k, v in (env or {}).items())})
+            sock.sendmsg([request.encode("utf-8") + b"\n"],
+                         [(socket.SOL_SOCKET, socket.SCM_RIGHTS,
+                           array.array("i", child).tobytes())])
+            # Do not hold the reactor if the server is busy
+            readable, _, _ = select.select([sock], [], [], self.reply_timeout)
+            if not readable:
+                self.reactor.adoptStreamConnection(
+                    sock.fileno(), socket.AF_UNIX, _LateReplyFactory())
+                raise socket.timeout()
+            reply = _readline(sock)
+        except Exception:
+            for fd in parent:
+                os.close(fd)
+            raise
+        finally:
+            for fd in child:
+                os.close(fd)
+        verb, _, value = reply.partition(b" ")
+        if verb != b"pid":
+            for fd in parent:
+                os.close(fd)
+            code, _, message = value.partition(b" ")
+            raise OSError(int(code), message.decode("utf-8", "replace"))
+        proc = RemoteProcess(self.reactor, int(value), proto, *parent)
+        # The status arrives on the same connection
+        self.reactor.adoptStreamConnection(
+            sock.fileno(), socket.AF_UNIX, _StatusFactory(proc))
+        self.spawned += 1
+        return proc
+
+
+server = SpawnServer()
+
+
+def spawnProcess(proto, executable, args, env={}, path=None):
+    """Spawn a process with the default L{server}."""
+
+    return server.spawnProcess(proto, executable, args, env, path)
@@ -0,0 +1,225 @@
+# -*- test-case-name: virtualbricks.tests.test_autosave -*-
+# Virtualbricks - a vde/qemu gui written in python and GTK/Glade.
+# Copyright (C) 2018 Virtualbricks team
+
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+"""Save the current project when it changes.
+
+The factory counts the changes to the project (see
+L{BrickFactory.mark_dirty}) and emits C{project-changed} when the project
+becomes dirty. The L{Autosaver} saves the project when the edits settle, no
+change for C{delay} seconds, but never later than C{max_delay} seconds after
+the first unsaved change. Nothing is saved if the project did not change.
+
+The state of the project is taken on the reactor thread, that is cheap, and
+the project file is written from that state in a thread: the reactor never
+waits for the disk.
+
+With C{use_journal} the changes are appended to the journal of the project
+(see L{virtualbricks.journal}) as they happen and the project file is saved
+only when the journal grows over L{journal.SIZE_LIMIT}; then the journal is
+compacted.
+"""
+
+import time
+
+from twisted.internet import defer, threads
+from twisted.python import filepath
+
+from virtualbricks import configfile, journal, log, snapshot, watchdog
+
+
+__all__ = ["Autosaver", "DELAY", "MAX_DELAY"]
+
+logger = log.Logger()
+saved = log.Event("Project saved to {path} in {elapsed:.3f}s")
+
+# Seconds without changes before the project is saved.
+DELAY = 5.0
+# Seconds after the first unsaved change at most.
+MAX_DELAY = 60.0
+
+
+class Autosaver:
+    """Save the project of C{factory} when it is dirty.
+
+    @ivar saves: the number of saves.
+    @ivar failures: the number of failed saves.
+    @ivar latency: a L{watchdog.Histogram} of the time from the start of a
+        save to the end of the write.
+    @ivar blocking: a L{watchdog.Histogram} of the time spent on the reactor
+        thread by every save.
+    @ivar use_journal: if the changes are recorded in the journal of the
+        project while the autosave is running.
+    """
+
+    _call = None
+    _saving = None
+    _first_change = None
+    _seen = None
+
+    def __init__(self, factory, delay=DELAY, max_delay=MAX_DELAY, clock=None,
+                 timer=time.time, filename=configfile.project_filename,
+                 defer_to_thread=threads.deferToThread, use_journal=False):
+        if clock is None:
+            from twisted.internet import reactor as clock
+        self.factory = factory
+        self.delay = delay
+        self.max_delay = max_delay
+        self.clock = clock
+        self.timer = timer
+        self.filename = filename
+        self.defer_to_thread = defer_to_thread
+        self.use_journal = use_journal
+        self.config = configfile.ConfigFile()
+        self.running = False
+        self.saves = 0
+        self.failures = 0
+        self.latency = watchdog.Histogram()
+        self.blocking = watchdog.Histogram()
+
+    def start(self):
+        if self.running:
+            return
+        self.running = True
+        self.factory.connect("project-changed", self._changed)
+        self.open_journal()
+        if self.factory.is_dirty():
+            self._changed(self.factory)
+
+    def stop(self):
+        """Stop saving the project and close the journal.
+
+        @return: a deferred that fires when the save in progress, if any,
+            is done and the journal is written.
+        """
+
+        if self.running:
+            self.running = False
+            self.factory.disconnect("project-changed", self._changed)
+            self._cancel()
+        return self._wait().addCallback(lambda _: self._close_journal())
+
+    def open_journal(self):
+        """Open the journal of the current project, that must be already
+        restored. Nothing is done if the autosave is not running or does not
+        use the journal."""
+
+        if not self.running or not self.use_journal:
+            return
+        self._close_journal()
+        journal.Journal(self.factory, journal.filename(self.filename()),
+                        on_full=self.save, clock=self.clock, timer=self.timer,
+                        defer_to_thread=self.defer_to_thread).open()
+
+    def _close_journal(self):
+        if self.factory.journal is not None:
+            return self.factory.journal.close()
+
+    def _wait(self):
+        if self._saving is None:
+            return defer.succeed(None)
+        d = defer.Deferred()
+        self._saving.addBoth(lambda result: d.callback(None) or result)
+        return d
+
+    def _cancel(self):
+        if self._call is not None and self._call.active():
+            self._call.cancel()
+        self._call = None
+
+    def _changed(self, factory):
+        # Called when the project becomes dirty. The changes are already in
+        # the journal if it is open.
+        if (not self.running or not factory.is_dirty() or
+                factory.journal is not None):
+            return
+        if self._call is None or not self._call.active():
+            self._first_change = self.clock.seconds()
+            self._schedule()
+            # The operation that made the project dirty can be still making
+            # changes (a new brick creates its socks first), count them when
+            # it is done.
+            self.clock.callLater(0, self._count)
+
+    def _count(self):
+        self._seen = self.factory.changes
+
+    def _schedule(self):
+        self._seen = self.factory.changes
+        remaining = self._first_change + self.max_delay - self.clock.seconds()
+        self._call = self.clock.callLater(max(min(self.delay, remaining), 0),
+                                          self._settle)
+
+    def _settle(self):
+        self._call = None
+        # Postpone the save while the project keeps changing, at most
+        # max_delay seconds after the first change.
+        elapsed = self.clock.seconds() - self._first_change
+        if self.factory.changes != self._seen and elapsed < self.max_delay:
+            self._schedule()
+        else:
+            self.save()
+
+    def save(self):
+        """Save the project now if it is dirty.
+
+        @return: a deferred that fires when the project is written.
+        """
+
+        self._cancel()
+        if self._saving is not None:
+            # The changes made in the meantime are saved later
+            return self._wait()
+        journal = self.factory.journal
+        if not self.factory.is_dirty() and not (journal is not None and
+                                                 journal.is_full()):
+            return defer.succeed(None)
+        start = self.timer()
+        changes = self.factory.changes
+        path = self.filename()
+        if journal is not None:
+            journal.mark()
+        number, state = configfile.take_state(self.factory)
+        self.blocking.add(self.timer() - start)
+        d = self._saving = self.defer_to_thread(
+            self.config.write, filepath.FilePath(path), state, number)
+        d.addCallbacks(self._saved, self._failed,
+                       (path, changes, start, journal), None, (path, ))
+        d.addBoth(self._done)
+        return self._wait()
+
+    def _saved(self, snapshot_written, path, changes, start, journal):
+        elapsed = self.timer() - start
+        self.saves += 1
+        self.latency.add(elapsed)
+        self.factory.mark_clean(changes)
+        if not snapshot_written:
+            logger.warn(snapshot.cannot_write, path=snapshot.filename(path),
+                        hide_to_user=True)
+        logger.debug(saved, path=path, elapsed=elapsed)
+        if journal is not None:
+            return journal.compact()
+
+    def _failed(self, fail, path):
+        self.failures += 1
+        logger.failure(configfile.config_save_error, fail)
+
+    def _done(self, _):
+        self._saving = None
+        # Save the changes made during the write
+        if self.running and self.factory.is_dirty():
+            self._changed(self.factory)
@@ -16,64 +16,73 @@
 # with this program; if not, write to the Free Software Foundation, Inc.,
 # 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
 
+import ast
+import copy
 import re
 
+from twisted.internet import defer
 from twisted.python import reflect
 
 from virtualbricks import log, observable
 
 import six
 if six.PY3:
-    def iterFixItem(self):
-        super(Config, self).__init__((n, v.default) for n, v
-                                     in self.parameters.items())
     def iterFixKeys(self,write):
         for key in sorted(self.keys()):
             write("%s=%s" % (key, self[key]))
     def iterFixItemAttrs(self,attrs):
+        changed = False
         for name, value in attrs.items():
             if value != self.config[name]:
-                logger.info(attribute_set, attr=name, brick=self, value=value)
+                if not self._restore:
+                    logger.info(attribute_set, attr=name, brick=self,
+                                value=value)
                 self.config[name] = value
+                changed = True
                 setter = getattr(self, "cbset_" + name, None)
                 if setter:
-                    setter(value)
+                    result = setter(value)
+                    if isinstance(result, defer.Deferred):
+                        result.addErrback(logger.failure_eb, live_set_failed,
+                                          attr=name, brick=self)
+        if changed and not self._restore:
+            self.factory.mark_dirty(self)
         self.notify_changed()
     def iterFixSave(self,fileobj):
         opt_tmp = "{0}={1}"
-        l = []
-        for name, param in sorted(self.config.parameters.items()):
-            if self.config[name] != param.default:
-                value = param.to_string_brick(self.config[name], self)
-                l.append(opt_tmp.format(name, value))
+        l = [opt_tmp.format(name, value)
+             for name, value in saved_options(self)]
         if l:
             l.append("")
         tmp = "[{0}:{1}]\n{2}\n"
         fileobj.write(tmp.format(self.get_type(), self.name, "\n".join(l)))
 
 else:
-    def iterFixItem(self):
-        super(Config, self).__init__((n, v.default) for n, v
-                                     in self.parameters.iteritems())
     def iterFixKeys(self,write):
         for key in sorted(self.iterkeys()):
             write("%s=%s" % (key, self[key]))
     def iterFixItemAttrs(self,attrs):
+        changed = False
         for name, value in attrs.iteritems():
             if value != self.config[name]:
-                logger.info(attribute_set, attr=name, brick=self, value=value)
+                if not self._restore:
+                    logger.info(attribute_set, attr=name, brick=self,
+                                value=value)
                 self.config[name] = value
+                changed = True
                 setter = getattr(self, "cbset_" + name, None)
                 if setter:
-                    setter(value)
+                    result = setter(value)
+                    if isinstance(result, defer.Deferred):
+                        result.addErrback(logger.failure_eb, live_set_failed,
+                                          attr=name, brick=self)
+        if changed and not self._restore:
+            self.factory.mark_dirty(self)
         self.notify_changed()
     def iterFixSave(self,fileobj):
         opt_tmp = "{0}={1}"
-        l = []
-        for name, param in sorted(self.config.parameters.iteritems()):
-            if self.config[name] != param.default:
-                value = param.to_string_brick(self.config[name], self)
-                l.append(opt_tmp.format(name, value))
+        l = [opt_tmp.format(name, value)
+             for name, value in saved_options(self)]
         if l:
             l.append("")
         tmp = "[{0}:{1}]\n{2}\n"
@@ -87,42 +96,163 @@ __metaclass__ = type
 logger = log.Logger()
 attribute_set = log.Event("Attribute {attr} set in {brick} with value "
                           "{value}.")
+live_set_failed = log.Event("Cannot set {attr} on running {brick}")
 param_not_found = log.Event("Parameter {param} in {brick} not found. "
                             "(val: {value})")
 
 
+def saved_options(brick):
+    """Return the options of C{brick} that are saved in the project, the
+    C{(name, value)} pairs of the values that differ from the defaults, as
+    strings."""
+
+    parameters = brick.config.parameters
+    # The defaults are not saved, look only at the values that are set
+    options = []
+    for name, value in sorted(brick.config.overrides()):
+        param = parameters[name]
+        if value != param.default:
+            options.append((name, param.to_string_brick(value, brick)))
+    return options
+
+
 class Config(dict):
+    """The configuration of a brick.
+
+    The defaults are shared by all the instances of a class, an instance
+    stores only the values that are set (copy-on-write). The dict interface
+    shows both.
+    """
 
     CONFIG_LINE = re.compile(r"^(\w+?)=(.*)$")
     parameters = {}
+    # The compiled schema, see _schema
+    _defaults = {}
+    _from_string = {}
+    _to_string = {}
 
     def __init__(self):
-        parameters = {}
-        reflect.accumulateClassDict(self.__class__, "parameters", parameters)
-        self.parameters = parameters
-        iterFixItem(self)
+        self.parameters = self._schema()
+
+    @classmethod
+    def _schema(cls):
+        # The parameters of a class never change, collect them from the class
+        # hierarchy only once and share them, the defaults and the
+        # converters between the instances.
+        try:
+            return cls.__dict__["_parameters"]
+        except KeyError:
+            parameters = {}
+            reflect.accumulateClassDict(cls, "parameters", parameters)
+            cls._defaults = dict((name, param.default)
+                                 for name, param in parameters.items())
+            cls._from_string = dict((name, param.from_string_brick)
+                                    for name, param in parameters.items())
+            cls._to_string = dict((name, param.to_string)
+                                  for name, param in parameters.items())
+            cls._parameters = parameters
+            return parameters
+
+    def convert(self, section, brick):
+        """Convert the C{(name, string)} pairs of a saved section.
+
+        @return: a dict that maps every name to its value.
+        @raise KeyError: if a parameter does not exist.
+        """
+
+        from_string = self._from_string
+        values = {}
+        for name, value in section:
+            try:
+                convert = from_string[name]
+            except KeyError:
+                logger.error(param_not_found, param=name, brick=brick,
+                             value=value)
+                raise
+            values[name] = convert(value, brick)
+        return values
 
     # dict interface
 
+    def __missing__(self, name):
+        return self._defaults[name]
+
     def __setitem__(self, name, value):
         if name not in self.parameters:
             raise ValueError(_("Parameter %s not found") % name)
-        super(Config, self).__setitem__(name, value)
+        if value is self._defaults[name]:
+            # Back to the default, share it again
+            dict.pop(self, name, None)
+        else:
+            dict.__setitem__(self, name, value)
+
+    def __contains__(self, name):
+        return name in self._defaults
+
+    def __len__(self):
+        return len(self._defaults)
+
+    def __iter__(self):
+        return iter(self._defaults)
+
+    def keys(self):
+        return self._defaults.keys()
+
+    def items(self):
+        get = dict.get
+        return [(name, get(self, name, default))
+                for name, default in self._defaults.items()]
+
+    def values(self):
+        return [value for _, value in self.items()]
+
+    def __eq__(self, other):
+        if not isinstance(other, dict):
+            return NotImplemented
+        return dict(self.items()) == dict(other.items())
+
+    def __ne__(self, other):
+        if not isinstance(other, dict):
+            return NotImplemented
+        return not self == other
+
+    __hash__ = None
+
+    def overrides(self):
+        """Return the C{(name, value)} pairs of the values that are set."""
+
+        return dict.items(self)
+
+    def __copy__(self):
+        new = self.__class__()
+        dict.update(new, dict.items(self))
+        return new
+
+    def __deepcopy__(self, memo):
+        new = self.__class__()
+        memo[id(self)] = new
+        # Copy the mutable defaults too but do not store the immutable ones
+        for name, default in self._defaults.items():
+            value = dict.get(self, name, default)
+            new[name] = copy.deepcopy(value, memo)
+        return new
 
     # NOTE: old interface, values are always strings
     def get(self, name, default=None):
         try:
-            val = dict.__getitem__(self, name)
-            return self.parameters[name].to_string(val)
+            to_string = self._to_string[name]
         except KeyError:
             return default
+        return to_string(dict.get(self, name, self._defaults[name]))
 
     # XXX: check this interface
     def __getattr__(self, name):
         # return always a string
-        if name not in self.parameters:
+        try:
+            to_string = self._to_string[name]
+        except KeyError:
             raise AttributeError(name)
-        return self.parameters[name].to_string(self[name])
+        return to_string(self[name])
 
     def dump(self, write):
         iterFixKeys(self,write)
@@ -199,8 +329,10 @@ class SpinFloat(SpinMixin, Float):
 
 class Boolean(Parameter):
 
+    TRUE = frozenset(["true", "*", "yes"])
+
     def from_string(self, in_string):
-        return in_string.lower() in set(["true", "*", "yes"])
+        return in_string.lower() in self.TRUE
 
     def to_string(self, in_object):
         return "*" if in_object else ""
@@ -228,11 +360,19 @@ class ListOf(Parameter):
         self.element_type = element_type
 
     def from_string(self, in_string):
-        strings = eval(in_string, {}, {})
-        return map(self.element_type.from_string, strings)
+        # The list is saved as the repr of a list of strings, parse it as a
+        # literal: the project file must not be able to run code.
+        try:
+            strings = ast.literal_eval(in_string)
+        except (ValueError, SyntaxError):
+            raise ValueError(_("Invalid list {0!r}").format(in_string))
+        if (not isinstance(strings, (list, tuple)) or
+                not all(isinstance(s, six.string_types) for s in strings)):
+            raise ValueError(_("Invalid list {0!r}").format(in_string))
+        return [self.element_type.from_string(s) for s in strings]
 
     def to_string(self, in_object):
-        return str(map(self.element_type.to_string, in_object))
+        return str([self.element_type.to_string(o) for o in in_object])
 
 
 class Base(object):
@@ -250,6 +390,7 @@ class Base(object):
 
     def set_name(self, name):
         self._name = name
+        self.factory.reindex(self)
         self.notify_changed()
 
     name = property(get_name, set_name)
@@ -277,15 +418,8 @@ class Base(object):
             raise KeyError(_("%s config has no %s option.") %
                            (self.name, name))
 
-    def _getvalue(self, name, value):
-        try:
-            return self.config.parameters[name].from_string_brick(value, self)
-        except KeyError:
-            logger.error(param_not_found, param=name, brick=self, value=value)
-            raise
-
     def load_from(self, section):
-        self.set(dict((n, self._getvalue(n, v)) for n, v in section))
+        self.set(self.config.convert(section, self))
 
     def save_to(self, fileobj):
         iterFixSave(self,fileobj)
@@ -23,18 +23,21 @@ import termios
 import tty
 import re
 import copy
-import itertools
+import operator
+import collections
 
 from twisted.application import app
-from twisted.internet import defer, task, stdio, error
+from twisted.internet import defer, stdio, error
 from twisted.protocols import basic
 from twisted.python import failure, log as legacyLog
 from twisted.conch.insults import insults
 from twisted.conch import manhole
 
-from virtualbricks import errors, settings, configfile, console, project, log
+from virtualbricks import errors, settings, console, project, log
 from virtualbricks import events, link, router, switches, tunnels, tuntaps
-from virtualbricks import virtualmachines, wires
+from virtualbricks import virtualmachines, wires, power, macs, topology
+from virtualbricks import _spawn, capabilities, jobs, procstat, watchdog
+from virtualbricks import autosave
 from virtualbricks.virtualmachines import is_virtualmachine
 from virtualbricks import observable
 from virtualbricks.tools import is_running
@@ -43,6 +46,15 @@ from virtualbricks.tools import is_running
 if False:  # pyflakes
     _ = str
 
+_FIRST_LETTER = re.compile(r"[a-zA-Z]")
+# The notifications that change the project. The changes to the brick
+# configurations and to the links are recorded by the bricks and by the plugs,
+# brick-changed and event-changed are emitted when they start and stop too.
+_DIRTY_SIGNALS = frozenset(["brick-added", "bricks-added", "brick-removed",
+                            "image-added", "image-removed", "image-changed",
+                            "event-added", "event-removed"])
+_VALID_NAME = re.compile(r"[a-zA-Z0-9_\.-]+\Z")
+
 logger = log.Logger()
 reg_basic_types = log.Event("Registering basic types")
 engine_bye = log.Event("Engine: Bye!")
@@ -57,6 +69,21 @@ shut_down = log.Event("Server Shut Down.")
 new_event_ok = log.Event("New event {name} OK")
 uncaught_exception = log.Event("Uncaught exception: {error()}")
 brick_stop = log.Event("Error on brick poweroff")
+new_bricks_ok = log.Event("Created {count} bricks")
+cow_failed = log.Event("Cannot create the private COW images in advance: "
+                       "{error}")
+clones_created = log.Event("Cloned {template} {count} times in {elapsed:.2f}s "
+                           "({rate:.1f} clones/s)")
+
+CloneResult = collections.namedtuple("CloneResult", ["bricks", "elapsed",
+                                                     "rate"])
+
+
+def same_sock(index, template_plug):
+    """Default rule of L{BrickFactory.clone_many}: connect the clone's plug
+    to the same sock of the template's plug."""
+
+    return template_plug.sock
 
 
 def install_brick_types(registry=None):
@@ -88,6 +115,60 @@ def install_brick_types(registry=None):
     return registry
 
 
+class _Index(object):
+    """Map the names of the objects owned by the factory to the objects.
+
+    The name of an object is read with C{keyfunc}. The index remembers the
+    name under which each object is stored so that, after a rename, calling
+    L{update} moves the object under the new name. Names are not assumed to be
+    unique: if more objects share a name, the first one added is returned.
+    """
+
+    def __init__(self, keyfunc):
+        self._keyfunc = keyfunc
+        self._objects = {}
+        self._keys = {}
+
+    def add(self, obj):
+        key = self._keyfunc(obj)
+        self._keys[obj] = key
+        self._objects.setdefault(key, []).append(obj)
+
+    def remove(self, obj):
+        key = self._keys.pop(obj)
+        objects = self._objects[key]
+        objects.remove(obj)
+        if not objects:
+            del self._objects[key]
+
+    def update(self, obj):
+        """Move C{obj} under its new name and return the old one, C{None}
+        if the name did not change."""
+
+        if obj in self._keys and self._keys[obj] != self._keyfunc(obj):
+            old = self._keys[obj]
+            self.remove(obj)
+            self.add(obj)
+            return old
+        return None
+
+    def clear(self):
+        self._objects.clear()
+        self._keys.clear()
+
+    def get(self, key):
+        try:
+            return self._objects[key][0]
+        except KeyError:
+            return None
+
+    def __contains__(self, key):
+        return key in self._objects
+
+    def __len__(self):
+        return len(self._keys)
+
+
 class BrickFactory(object):
     """This is the main class for the core engine.
 
@@ -95,13 +176,11 @@ class BrickFactory(object):
     It also contains a thread to manage the command console.
     """
 
-    # __restore is True during the restore of the project. Events are not
-    # propagated.
-    __restore = False
-    __signals = ("brick-added", "brick-removed", "brick-changed",
+    __signals = ("brick-added", "bricks-added", "brick-removed",
+                 "brick-changed",
                  "image-added", "image-removed", "image-changed",
                  "event-added", "event-removed", "event-changed",
-                 "quit")
+                 "project-changed", "quit")
 
     def __init__(self, quit):
         self.quit_d = quit
@@ -109,19 +188,70 @@ class BrickFactory(object):
         self.events = []
         self.socks = []
         self.disk_images = []
+        self.__bricks_idx = _Index(operator.attrgetter("name"))
+        self.__events_idx = _Index(operator.attrgetter("name"))
+        self.__images_idx = _Index(operator.attrgetter("name"))
+        self.__paths_idx = _Index(operator.attrgetter("path"))
+        self.__socks_idx = _Index(operator.attrgetter("nickname"))
+        # The socks created for each brick, to remove them with the brick
+        self.__brick_socks = {}
+        self.macs = macs.MacAllocator()
+        self.graph = topology.Graph()
+        self.sampler = procstat.Sampler(self)
+        self.watchdog = watchdog.Watchdog()
+        self.autosave = autosave.Autosaver(self, use_journal=True)
+        self.jobs = jobs.manager
         self.__factories = install_brick_types()
         self.__observable = observable.Observable(*self.__signals)
         self.changed = observable.Event(self.__observable, "brick-changed")
+        # Every change to the project increments the counter, the project is
+        # dirty until the changes are saved.
+        self.changes = 0
+        self._saved_changes = 0
+        # The journal of the current project, see virtualbricks.journal
+        self.journal = None
 
     def _notify(self, event, *args):
-        # if not self.__restore:
-            self.__observable.notify(event, *args)
+        self.__observable.notify(event, *args)
+        if event in _DIRTY_SIGNALS:
+            self.mark_dirty(*args)
+
+    def mark_dirty(self, *objects):
+        """Record a change to the project, C{project-changed} is emitted
+        when a clean project becomes dirty.
+
+        @param objects: the bricks, events, images or socks that changed,
+            they are recorded in the journal.
+        """
+
+        if self.journal is not None:
+            self.journal.touch(objects)
+        dirty = self.is_dirty()
+        self.changes += 1
+        if not dirty:
+            self.__observable.notify("project-changed", self)
+
+    def mark_clean(self, changes=None):
+        """Record that the project has been saved.
+
+        @param changes: the value of L{changes} when the project was
+            serialized, the later changes are still to be saved. By default
+            all the changes.
+        """
+
+        if changes is None:
+            changes = self.changes
+        self._saved_changes = max(self._saved_changes, changes)
+
+    def is_dirty(self):
+        return self.changes != self._saved_changes
 
     def quit(self):
         if any(is_running(brick) for brick in self.bricks):
             msg = _("Cannot close virtualbricks: there are running bricks")
             raise errors.BrickRunningError(msg)
         logger.info(engine_bye)
+        self.sampler.stop()
         for e in self.events:
             e.poweroff()
         self._notify("quit", self)
@@ -132,6 +262,9 @@ class BrickFactory(object):
         if any(is_running(brick) for brick in self.bricks):
             msg = _("Project cannot be closed: there are running bricks")
             raise errors.BrickRunningError(msg)
+        if self.journal is not None:
+            # Closing the project does not change it
+            self.journal.close()
         # Don't change the list while iterating over it
         for brick in list(self.bricks):
             if is_virtualmachine(brick):
@@ -143,6 +276,10 @@ class BrickFactory(object):
             self.del_event(e)
 
         del self.socks[:]
+        self.__socks_idx.clear()
+        self.__brick_socks.clear()
+        self.graph.clear()
+        self.macs.reset(self.macs.seed)
         for image in self.disk_images[:]:
             self.remove_disk_image(image)
 
@@ -165,8 +302,38 @@ class BrickFactory(object):
         self.__observable.remove_observer(name, callback, args, kwds)
 
     def set_restore(self, restore):
-        # self.__restore = restore
-        pass
+        # During the restore of a project the notifications are coalesced and
+        # delivered at the end.
+        if restore:
+            self.__observable.begin_batch()
+        else:
+            self.__observable.commit_batch()
+
+    def batch(self, delay=None):
+        """Return a context manager that coalesces the notifications of the
+        factory: each event is delivered once per emitter when the context
+        manager exits, or C{delay} seconds later if C{delay} is given.
+
+            with factory.batch() as batch:
+                brick.set(attrs)
+                ...
+            print(batch.suppressed)
+        """
+
+        return observable.batch(self.__observable, delay)
+
+    def reindex(self, obj):
+        """Update the name indexes after a brick, an event, an image or a sock
+        has been renamed. Objects not owned by the factory are ignored."""
+
+        for index in (self.__bricks_idx, self.__events_idx,
+                      self.__images_idx):
+            old = index.update(obj)
+            if old is not None and self.journal is not None:
+                self.journal.renamed(obj, old)
+        for index in (self.__paths_idx, self.__socks_idx):
+            index.update(obj)
+        self.mark_dirty(obj)
 
     # Disk Images
 
@@ -179,31 +346,32 @@ class BrickFactory(object):
         img = virtualmachines.Image(self.normalize_name(name), path,
                                     description)
         self.disk_images.append(img)
+        self.__images_idx.add(img)
+        self.__paths_idx.add(img)
+        img.observable.add_observer("changed", self.reindex, (), {})
         self._notify("image-added", img)
         return img
 
     def assert_path_not_in_use(self, path):
-        for img in self.disk_images:
-            if img.path == path:
-                raise errors.ImageAlreadyInUseError(path)
+        if path in self.__paths_idx:
+            raise errors.ImageAlreadyInUseError(path)
 
     def remove_disk_image(self, image):
         self.disk_images.remove(image)
+        self.__images_idx.remove(image)
+        self.__paths_idx.remove(image)
+        image.observable.remove_observer("changed", self.reindex, (), {})
         self._notify("image-removed", image)
 
     def get_image_by_name(self, name):
         """Return a disk image given its name or {None}."""
 
-        for img in self.disk_images:
-            if img.name == name:
-                return img
+        return self.__images_idx.get(name)
 
     def get_image_by_path(self, path):
         """Get disk image object from the image library by its path."""
 
-        for img in self.disk_images:
-            if img.path == path:
-                return img
+        return self.__paths_idx.get(path)
 
     # Bricks
 
@@ -226,12 +394,149 @@ class BrickFactory(object):
             raise errors.InvalidTypeError(_("Invalid brick type %s") % type)
         brick = Type(self, self.normalize_name(name))
         self.bricks.append(brick)
+        self.__bricks_idx.add(brick)
+        self.graph.add(brick)
         brick.changed.connect(self._brick_changed)
         if is_virtualmachine(brick):
             brick.image_changed.connect(self._image_changed)
         self._notify("brick-added", brick)
         return brick
 
+    def new_bricks(self, specs, links=()):
+        """Create many bricks at once.
+
+        All the names and types are validated in one pass before any brick is
+        created, if one of them is not valid no brick is created. Instead of
+        one C{brick-added} notification per brick, a single C{bricks-added}
+        notification is emitted with the list of the new bricks.
+
+        @param specs: The bricks to create.
+        @type specs: iterable of C{(type, name)} tuples.
+        @param links: The connections between the bricks, each link connects
+            the brick C{name} to C{endpoint}. The endpoint is the nickname of
+            a sock or the name of a brick, in this case its first sock is
+            used. Endpoints can refer to the new bricks.
+        @type links: iterable of C{(name, endpoint)} tuples.
+        @return: the list of the new bricks.
+        @raises: InvalidNameError, NameAlreadyInUseError, InvalidTypeError,
+            NotConnectedError
+        """
+
+        todo = []
+        names = set()
+        for type, name in specs:
+            try:
+                Type = self.__factories[type.lower()]
+            except KeyError:
+                raise errors.InvalidTypeError(_("Invalid brick type %s") %
+                                              type)
+            _name = self._check_name(name)
+            if _name in names or self.is_in_use(_name):
+                raise errors.NameAlreadyInUseError(name)
+            names.add(_name)
+            todo.append((Type, _name))
+        links = list(links)
+        for name, endpoint in links:
+            if name not in names and name not in self.__bricks_idx:
+                raise errors.InvalidNameError(_("Brick %s not found") % name)
+
+        socks = len(self.socks)
+        new = [Type(self, name) for Type, name in todo]
+        try:
+            plugs = list(self._resolve_links(links, new))
+        except Exception:
+            # Forget the socks created by the new bricks
+            for sock in self.socks[socks:]:
+                self.__socks_idx.remove(sock)
+                self.__brick_socks.pop(sock.brick, None)
+            del self.socks[socks:]
+            raise
+        # Connect the new bricks before observing them, no brick-changed
+        # notification is emitted for them.
+        for brick, sock in plugs:
+            brick.connect(sock)
+        for brick in new:
+            self.bricks.append(brick)
+            self.__bricks_idx.add(brick)
+            self.graph.add(brick)
+            brick.changed.connect(self._brick_changed)
+            if is_virtualmachine(brick):
+                brick.image_changed.connect(self._image_changed)
+        logger.info(new_bricks_ok, count=len(new))
+        self._notify("bricks-added", new)
+        return new
+
+    def _resolve_links(self, links, new):
+        bricks = dict((brick.name, brick) for brick in new)
+        for name, endpoint in links:
+            brick = bricks.get(name) or self.__bricks_idx.get(name)
+            sock = self.__socks_idx.get(endpoint)
+            if sock is None:
+                peer = bricks.get(endpoint) or self.__bricks_idx.get(endpoint)
+                if peer is None or not peer.socks:
+                    raise errors.NotConnectedError(
+                        _("Endpoint %s not found") % endpoint)
+                sock = peer.socks[0]
+            yield brick, sock
+
+    def clone_many(self, template, count, name_pattern="{name}_{index}",
+                   rule=same_sock, clock=None):
+        """Create C{count} copies of a virtual machine.
+
+        The clones are created at once with L{new_bricks}, they share the
+        configuration of the template but each has new MAC addresses and a
+        private COW image, linked to the template's image, for each disk with
+        an image. The COW images are created in advance, as many at the same
+        time as the job manager allows.
+
+        @param name_pattern: The format string of the names of the clones,
+            C{{name}} is the name of the template and C{{index}} the number of
+            the clone, starting from 1.
+        @param rule: A callable C{rule(index, template_plug)} that returns the
+            sock the clone's plug must be connected to, or C{None} to leave it
+            disconnected. By default the clones are connected like the
+            template.
+        @return: a deferred that fires with a L{CloneResult}: the list of the
+            clones, the time taken and the throughput in clones per second.
+        @raises: InvalidTypeError if C{template} is not a virtual machine,
+            the errors of L{new_bricks}.
+        """
+
+        if not is_virtualmachine(template):
+            raise errors.InvalidTypeError(
+                _("Only virtual machines can be cloned"))
+        if clock is None:
+            from twisted.internet import reactor as clock
+        started = clock.seconds()
+        names = [name_pattern.format(name=template.name, index=i)
+                 for i in range(1, count + 1)]
+        # Only the values set in the template, the defaults are already there
+        # and the unused disks are not created
+        config = dict(template.config.overrides())
+        for disk in template.disks():
+            if disk.image is not None and not disk.readonly():
+                config["private" + disk.device] = True
+        with self.batch():
+            clones = self.new_bricks((template.get_type(), n) for n in names)
+            for i, clone in enumerate(clones, 1):
+                attrs = copy.deepcopy(config)
+                attrs["name"] = clone.name
+                clone.set(attrs)
+                for plug in template.plugs:
+                    clone.add_plug(rule(i, plug), model=plug.model)
+                for sock in template.socks:
+                    clone.add_sock(model=sock.model)
+
+        def report(_):
+            elapsed = clock.seconds() - started
+            rate = count / elapsed if elapsed else float(count)
+            logger.info(clones_created, template=template.name, count=count,
+                        elapsed=elapsed, rate=rate)
+            return CloneResult(clones, elapsed, rate)
+
+        d = virtualmachines.create_overlays(clones)
+        return d.addCallback(report)
+
     def dup_brick(self, brick):
         name = self.next_name("copy_of_" + brick.name)
         new_brick = self.new_brick(brick.get_type(), name)
@@ -249,28 +554,60 @@ class BrickFactory(object):
             msg = "Cannot delete brick {0:n}: brick is running".format(brick)
             raise errors.BrickRunningError(msg)
         logger.info(remove_brick, brick=brick.name)
-        socks = set(brick.socks)
-        if socks:
+        if brick.socks:
             logger.info(remove_socks,
-                        socks=", ".join(s.nickname for s in socks))
-            for _brick in self.bricks:
-                for plug in _brick.plugs:
-                    if plug.configured() and plug.sock in socks:
-                        logger.info(disconnect_plug, sock=plug.sock.nickname)
-                        plug.disconnect()
-            for sock in [s for s in self.socks if s.brick is brick]:
-                self.socks.remove(sock)
+                        socks=", ".join(s.nickname for s in brick.socks))
+        for plug in self.graph.incoming(brick):
+            if plug.brick is not brick:
+                logger.info(disconnect_plug, sock=plug.sock.nickname)
+                plug.disconnect()
+        for sock in self.__brick_socks.pop(brick, ()):
+            self.socks.remove(sock)
+            self.__socks_idx.remove(sock)
         for plug in brick.plugs:
             if plug.configured():
                 plug.disconnect()
+        self.graph.remove(brick)
+        if is_virtualmachine(brick):
+            for endpoint in brick.plugs + brick.socks:
+                self.macs.release(endpoint.mac)
         self.bricks.remove(brick)
+        self.__bricks_idx.remove(brick)
         brick.changed.disconnect(self._brick_changed)
         self._notify("brick-removed", brick)
 
+    def poweron_all(self, bricks=None, max_parallel=power.MAX_PARALLEL):
+        """Start the given bricks, or all the bricks, following the topology.
+
+        See L{virtualbricks.power.poweron_all}.
+        """
+
+        if bricks is None:
+            bricks = self.bricks
+        # Create all the private COW images in one batch before starting
+        # the virtual machines.
+        vms = [b for b in power.dependency_graph(bricks)
+               if is_virtualmachine(b) and not is_running(b)]
+        d = virtualmachines.create_overlays(vms)
+        # Every virtual machine will report its own error at poweron
+        d.addErrback(lambda fail: logger.warn(cow_failed,
+                                              error=fail.getErrorMessage()))
+        d.addCallback(lambda _: power.poweron_all(bricks, max_parallel))
+        return d
+
+    def poweroff_all(self, bricks=None, max_parallel=power.MAX_PARALLEL,
+                     timeouts=None):
+        """Stop the given bricks, or all the bricks, consumers first.
+
+        See L{virtualbricks.power.poweroff_all}.
+        """
+
+        if bricks is None:
+            bricks = self.bricks
+        return power.poweroff_all(bricks, max_parallel, timeouts)
+
     def get_brick_by_name(self, name):
-        for b in self.bricks:
-            if b.name == name:
-                return b
+        return self.__bricks_idx.get(name)
 
     def _brick_changed(self, brick):
         self._notify("brick-changed", brick)
@@ -292,6 +629,7 @@ class BrickFactory(object):
         event = events.Event(self, self.normalize_name(name))
         logger.debug(new_event_ok, name=event.name)
         self.events.append(event)
+        self.__events_idx.add(event)
         event.changed.connect(self._event_changed)
         self._notify("event-added", event)
         return event
@@ -306,12 +644,11 @@ class BrickFactory(object):
         event.poweroff()
         event.changed.disconnect(self._event_changed)
         self.events.remove(event)
+        self.__events_idx.remove(event)
         self._notify("event-removed", event)
 
     def get_event_by_name(self, name):
-        for e in self.events:
-            if e.name == name:
-                return e
+        return self.__events_idx.get(name)
 
     def rename_event(self, event, name):
         event.name = self.normalize_name(name)
@@ -329,10 +666,8 @@ class BrickFactory(object):
         """used to determine whether the chosen name can be used or
         it has already a duplicate among bricks or events."""
 
-        for o in itertools.chain(self.bricks, self.events, self.disk_images):
-            if o.name == name:
-                return True
-        return False
+        return (name in self.__bricks_idx or name in self.__events_idx or
+                name in self.__images_idx)
 
     def normalize_name(self, name):
         """
@@ -343,19 +678,23 @@ class BrickFactory(object):
         @rase NameAlreadyInUseError: if the name is already in use.
         """
 
+        _name = self._check_name(name)
+        if self.is_in_use(_name):
+            raise errors.NameAlreadyInUseError(name)
+        return _name
+
+    def _check_name(self, name):
         if not isinstance(name, str):
             raise errors.InvalidNameError(_("Name must be a string"))
         _name = name.strip()
-        if not re.search("\A[a-zA-Z]", _name):
+        if not _FIRST_LETTER.match(_name):
             msg = _("Name {0} does not start with a " "letter").format(name)
             raise errors.InvalidNameError(msg)
-        _name = re.sub(' ', '_', _name)
-        if not re.search("\A[a-zA-Z0-9_\.-]+\Z", _name):
+        _name = _name.replace(" ", "_")
+        if not _VALID_NAME.match(_name):
             msg = _("Name must contains only letters, numbers, underscores, "
                     "hyphens and points, {}").format(name)
             raise errors.InvalidNameError(msg)
-        if self.is_in_use(_name):
-            raise errors.NameAlreadyInUseError(name)
         return _name
 
     def new_plug(self, brick):
@@ -364,22 +703,20 @@ class BrickFactory(object):
     def new_sock(self, brick, name=""):
         sock = link.Sock(brick, name)
         self.socks.append(sock)
+        self.__socks_idx.add(sock)
+        self.__brick_socks.setdefault(brick, []).append(sock)
+        self.mark_dirty(brick)
         return sock
 
     def get_sock_by_name(self, name):
         if name == "_hostonly":
             return virtualmachines.hostonly_sock
-        for sock in self.socks:
-            if sock.nickname == name:
-                return sock
+        return self.__socks_idx.get(name)
 
     def connect_to(self, brick, nick):
-        endpoint = None
         if not nick:
             return None
-        for n in self.socks:
-            if n.nickname == nick:
-                endpoint = n
+        endpoint = self.__socks_idx.get(nick)
         if endpoint is not None:
             return brick.connect(endpoint)
         else:
@@ -469,10 +806,11 @@ class Console(basic.LineOnlyReceiver):
             stdio.StandardIO(self)
 
 
-def AutosaveTimer(factory, interval=180):
-    l = task.LoopingCall(configfile.safe_save, factory)
-    l.start(interval, now=False)
-    return l
+def save_on_shutdown(factory):
+    """Wait for the autosave in progress and save the current project."""
+
+    d = factory.autosave.stop()
+    return d.addCallback(lambda _: project.manager.save_current(factory))
 
 
 class AppLogger(app.AppLogger):
@@ -578,6 +916,13 @@ class Application:
             if e.errno != errno.EEXIST:
                 raise
 
+    def install_spawn_server(self, reactor):
+        if settings.get("spawn_server"):
+            _spawn.server.start(os.path.join(settings.VIRTUALBRICKS_HOME,
+                                             "spawn.sock"))
+            reactor.addSystemEventTrigger("after", "shutdown",
+                                          _spawn.server.stop)
+
     def get_namespace(self):
         return {}
 
@@ -587,6 +932,7 @@ class Application:
         self.install_stdlog_handler()
         self.logger.start(self)
         self.install_home()
+        self.install_spawn_server(reactor)
         quit = defer.Deferred()
         factory = self.factory_factory(quit)
         self._run(factory)
@@ -598,10 +944,19 @@ class Application:
             app.fixPdb()
         reactor.addSystemEventTrigger("before", "shutdown", settings.store)
         project.manager.restore_last(factory)
-        reactor.addSystemEventTrigger("before", "shutdown",
-                                      project.manager.save_current, factory)
+        reactor.addSystemEventTrigger("before", "shutdown", save_on_shutdown,
+                                      factory)
         reactor.addSystemEventTrigger("before", "shutdown", self.logger.stop)
-        AutosaveTimer(factory)
+        factory.autosave.start()
+        factory.watchdog.start()
+        reactor.addSystemEventTrigger("before", "shutdown",
+                                      factory.watchdog.stop)
+        factory.jobs.configure(int(settings.get("jobs_slots")),
+                               int(settings.get("jobs_io_slots")))
+        reactor.addSystemEventTrigger("before", "shutdown",
+                                      factory.jobs.cancel_all)
+        reactor.addSystemEventTrigger("before", "shutdown",
+                                      capabilities.cache.save)
         if not self.config["noterm"] and not self.config["daemon"]:
             namespace = self.get_namespace()
             namespace["factory"] = factory
@@ -23,12 +23,14 @@ import functools
 import re
 
 from twisted.internet import protocol, reactor, error, defer
+from twisted.python import failure
 from zope.interface import implementer
 
 from virtualbricks import base, errors, settings, log, interfaces
 from virtualbricks.base import (Config as _Config, Parameter, String, Integer,
                                 SpinInt, Float, SpinFloat, Boolean, Object,
                                 ListOf)
+from virtualbricks import _spawn
 from virtualbricks._spawn import abspath_vde
 
 
@@ -51,6 +53,8 @@ console_done = log.Event("Console terminated\n{status}")
 console_terminated = log.Event("Console terminated\n{status}\nProcess stdout:"
                                "\n{out()}\nProcess stderr:\n{err()}\n")
 invalid_ack = log.Event("ACK received but no command sent.")
+brick_ready = log.Event("{name} ready in {elapsed:.3f}s")
+not_ready = log.Event("{name} started but not ready")
 
 
 class ProcessLogger(object):
@@ -123,64 +127,180 @@ class FakeProcess:
         pass
 
 
+CommandReply = collections.namedtuple("CommandReply",
+                                      ["command", "code", "message", "data"])
+
+
+class CommandError(errors.Error):
+    """The management console replied to a command with an error code."""
+
+    def __init__(self, command, code, message):
+        errors.Error.__init__(self, command, code, message)
+        self.command = command
+        self.code = code
+        self.message = message
+
+    def __str__(self):
+        return "{0}: {1} {2}".format(self.command, self.code, self.message)
+
+
+def parse_reply(command, ack):
+    """Parse the output of a command of the VDE management console.
+
+    The output is made by optional data lines, enclosed between C{0000 DATA
+    END WITH '.'} and a single dot, and by a status line C{1000 Success} or
+    C{1xxx <error>}, where C{xxx} is the errno.
+
+    @rtype: L{CommandReply}
+    @raise CommandError: if the status line reports an error.
+    """
+
+    code, message, data = None, "", []
+    in_data = False
+    for line in ack.decode("utf-8", "replace").splitlines():
+        if in_data:
+            if line == ".":
+                in_data = False
+            else:
+                data.append(line)
+        elif line.startswith("0000 "):
+            in_data = True
+        else:
+            match = _STATUS.match(line)
+            if match:
+                code, message = int(match.group(1)), match.group(2)
+    if code is not None and code != 1000:
+        raise CommandError(command, code, message)
+    return CommandReply(command, code, message, data)
+
+
+_STATUS = re.compile(r"^(1\d{3}) (.*)$")
+
+
 class VDEProcessProtocol(Process):
     """
     Handle the VDE management console.
 
-    Commands are serialized, until an ACK is received, the next command is not
-    sent.
+    Up to C{PIPELINE_SIZE} commands are written to the console without
+    waiting for their replies, the others are queued. Every command returns a
+    deferred that fires with a L{CommandReply} or fails with L{CommandError}.
+    The console replies in order, every reply is terminated by the prompt.
 
     @cvar delimiter: The line-ending delimiter to use.
     """
 
-    _buffer = ""
-    delimiter = u"\n"
-    prompt = re.compile(r"^vde(?:\[[^]]*\]:|\$) ", re.MULTILINE)
-    PIPELINE_SIZE = 1
+    delimiter = b"\n"
+    prompt = re.compile(br"^vde(?:\[[^]]*\]:|\$) ", re.MULTILINE)
+    PIPELINE_SIZE = 16
 
     def __init__(self, brick):
         Process.__init__(self, brick)
+        # Commands sent and not acknowledged yet, followed by the commands
+        # waiting to be sent.
         self.queue = collections.deque()
-
+        self._deferreds = collections.deque()
+        self._in_flight = 0
+        self._buffer = bytearray()
+        # The prompt is always at the beginning of a line: search it only
+        # from the last incomplete line.
+        self._scan = 0
 
     def data_received(self, data):
         """
-        Translates bytes into lines, and calls ack_received.
+        Split the output at the prompts and call ack_received for every
+        complete reply.
         """
-        
-        acks = self.prompt.split(self._buffer + data.decode("utf-8"))
-        self._buffer = acks.pop(-1)
-        for ack in acks:
+
+        buf = self._buffer
+        buf += data
+        while True:
+            match = self.prompt.search(buf, self._scan)
+            if match is None:
+                newline = buf.rfind(b"\n", self._scan)
+                if newline != -1:
+                    self._scan = newline + 1
+                return
+            ack = bytes(buf[:match.start()])
+            del buf[:match.end()]
+            self._scan = 0
             self.ack_received(ack)
 
     def ack_received(self, ack):
         self.logger.info(ack)
         try:
-            self.queue.popleft()
+            cmd = self.queue.popleft()
         except IndexError:
             self.logger.warn(invalid_ack)
             self.transport.loseConnection()
         else:
-            if len(self.queue):
-                self._send_command()
+            self._in_flight -= 1
+            d = self._deferreds.popleft()
+            try:
+                reply = parse_reply(cmd, ack)
+            except CommandError:
+                d.errback()
+            else:
+                d.callback(reply)
+            self._flush(self.PIPELINE_SIZE)
 
     def send_command(self, cmd):
+        """Send a command to the console.
+
+        @return: a deferred that fires with the L{CommandReply}.
+        """
+
+        d = self._enqueue(cmd)
+        self._flush(self.PIPELINE_SIZE)
+        return d
+
+    def send_batch(self, cmds):
+        """Send many commands with a single write, regardless of the pipeline
+        size.
+
+        @return: a deferred that fires with the list of L{CommandReply}, or
+            fails with the first L{CommandError}.
+        """
+
+        dl = [self._enqueue(cmd) for cmd in cmds]
+        self._flush(len(self.queue))
+        d = defer.gatherResults(dl, consumeErrors=True)
+        return d.addErrback(lambda f: f.value.subFailure if
+                            f.check(defer.FirstError) else f)
+
+    def _enqueue(self, cmd):
+        if not isinstance(cmd, bytes):
+            cmd = cmd.encode("utf-8")
+        cmd = cmd.rstrip(self.delimiter)
+        d = defer.Deferred()
         self.queue.append(cmd)
-        if 0 < len(self.queue) <= self.PIPELINE_SIZE:
-            self._send_command()
+        self._deferreds.append(d)
+        return d
 
-    def _send_command(self):
-        cmd = self.queue[0]
-        self.logger.info(cmd)
-        if cmd.decode("utf-8").endswith(self.delimiter):
-            return self.transport.write(cmd)
-        return self.transport.writeSequence((cmd, self.delimiter.encode("utf-8")))
+    def _flush(self, window):
+        start = self._in_flight
+        stop = min(window, len(self.queue))
+        if start >= stop:
+            return
+        data = []
+        for i in range(start, stop):
+            self.logger.info(self.queue[i])
+            data.extend((self.queue[i], self.delimiter))
+        self._in_flight = stop
+        self.transport.writeSequence(data)
+
+    def processEnded(self, status):
+        deferreds, self._deferreds = self._deferreds, collections.deque()
+        self.queue.clear()
+        self._in_flight = 0
+        for d in deferreds:
+            d.errback(status)
+        Process.processEnded(self, status)
 
     def outReceived(self, data):
         self.data_received(data)
 
     def write(self, cmd):
-        self.send_command(cmd)
+        return self.send_command(cmd)
 
 
 class TermProtocol(protocol.ProcessProtocol):
@@ -222,7 +342,13 @@ class Brick(base.Base):
     term_command = "vdeterm"
     _started_d = None
     _exited_d = None
+    _ready_d = None
+    _spawned = None
     _last_status = None
+    # Seconds between the start of the process and its readiness.
+    time_to_ready = None
+    # The signal sent by poweroff(), None if the brick is asked to stop.
+    poweroff_signal = "TERM"
     process_protocol = VDEProcessProtocol
     config_factory = Config
 
@@ -242,7 +368,12 @@ class Brick(base.Base):
 
     def poweron(self):
         if self.proc is not None:
-            return defer.succeed(self)
+            if self._ready_d is None:
+                return defer.succeed(self)
+            # Still starting, wait for the readiness probe
+            d = defer.Deferred()
+            self._ready_waiters.append(d)
+            return d
 
         if not self.configured():
             return defer.fail(errors.BadConfigError(
@@ -302,13 +433,61 @@ class Brick(base.Base):
 
     def process_started(self, proc):
         started, self._started_d = self._started_d, None
-        started.callback(self)
+        if self._spawned is None:
+            self._spawned = reactor.seconds()
+        self._ready_waiters = [started] if started is not None else []
+        self._ready_d = d = defer.maybeDeferred(self.probe_ready)
+
+        def ready(_):
+            self.time_to_ready = reactor.seconds() - self._spawned
+            logger.debug(brick_ready, name=self.name,
+                         elapsed=self.time_to_ready)
+            return self
+
+        def failed(fail):
+            if fail.check(defer.CancelledError) and self.proc is None:
+                # The process ended before being ready
+                return failure.Failure(errors.BrickError(
+                    self.name, self._last_status))
+            logger.failure(not_ready, fail, name=self.name)
+            # Do not leave running a brick that poweron reports as failed
+            try:
+                self.send_signal("TERM")
+            except error.ProcessExitedAlready:
+                pass
+            return fail
+
+        def fire(result):
+            self._ready_d = None
+            waiters, self._ready_waiters = self._ready_waiters, []
+            for waiter in waiters:
+                if isinstance(result, failure.Failure):
+                    waiter.errback(result)
+                else:
+                    waiter.callback(result)
+
+        d.addCallbacks(ready, failed).addBoth(fire)
         self.notify_changed()
 
+    def probe_ready(self):
+        """Wait until the brick is usable by the other bricks.
+
+        Called when the process is started, the deferred returned by
+        C{poweron()} fires when this deferred fires. By default the brick is
+        ready as soon as the process is started.
+
+        @rtype: L{defer.Deferred}
+        """
+
+        return defer.succeed(None)
+
     def process_ended(self, proc, status):
         self.proc = None
-        self._start_related_events(off=True)
+        self._spawned = None
         self._last_status = status
+        if self._ready_d is not None:
+            self._ready_d.cancel()
+        self._start_related_events(off=True)
         # ovvensive programming, raise an exception instead of hide the error
         # behind a lambda (lambda _: None)
         exited, self._exited_d = self._exited_d, None
@@ -364,7 +543,8 @@ class Brick(base.Base):
                 prog = settings.get("sudo")
                 args = [settings.get("sudo"), "--"] + args
             self.proc = self.process_protocol(self)
-            reactor.spawnProcess(self.proc, prog, args, os.environ)
+            self._spawned = reactor.seconds()
+            _spawn.spawnProcess(self.proc, prog, args, os.environ)
 
         l = [defer.maybeDeferred(self.prog), defer.maybeDeferred(self.args)]
         d = defer.gatherResults(l, consumeErrors=True)
@@ -419,11 +599,28 @@ class Brick(base.Base):
                 self.console()]
         get_args = lambda: " ".join(args)
         logger.info(open_console, name=self.name, args=get_args)
-        reactor.spawnProcess(TermProtocol(), term, args, os.environ)
+        _spawn.spawnProcess(TermProtocol(), term, args, os.environ)
 
     def send(self, data):
+        """Send a command to the running process.
+
+        @return: a deferred that fires with the reply of the management
+            console, if the process has one.
+        """
+
         if self.proc:
-            self.proc.write(data)
+            return defer.maybeDeferred(self.proc.write, data)
+        return defer.succeed(None)
+
+    def send_batch(self, commands):
+        """Send many commands to the management console in a single round
+        trip."""
+
+        if self.proc is None:
+            return defer.succeed([])
+        if not hasattr(self.proc, "send_batch"):
+            return defer.gatherResults([self.send(cmd) for cmd in commands])
+        return self.proc.send_batch(commands)
 
     def get_state(self):
         """return state of the brick"""
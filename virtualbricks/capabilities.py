@@ -0,0 +1,252 @@
+# -*- test-case-name: virtualbricks.tests.test_capabilities -*-
+# Virtualbricks - a vde/qemu gui written in python and GTK/Glade.
+# Copyright (C) 2018 Virtualbricks team
+
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+"""The capabilities of the host: where are the VDE and qemu executables and
+what they support.
+
+The executables are looked up once for every search directory, the qemu
+binaries are probed once for their version and for the output of C{-cpu
+help}, C{-machine help} and C{-device help}. Everything is kept in memory
+and in the workspace, in the file C{.capabilities}:
+
+  - the lookups of a directory are thrown away when the directory changes
+    (its modification time changes when a file is added or removed) and
+    when the C{vdepath} or C{qemupath} settings change;
+  - the probes of a binary are keyed by its path and its modification time.
+"""
+
+import errno
+import json
+import os
+
+from twisted.internet import defer, utils
+
+from virtualbricks import log
+
+
+__all__ = ["Capabilities", "cache", "PATH_SETTINGS"]
+
+logger = log.Logger()
+cannot_load = log.Event("Cannot load the capabilities from {filename}")
+cannot_save = log.Event("Cannot save the capabilities to {filename}")
+probed = log.Event("Probed {executable}: {version}")
+
+FILENAME = ".capabilities"
+FORMAT = 1
+# The settings that change the search directories.
+PATH_SETTINGS = ("vdepath", "qemupath")
+# The probes of a qemu binary, name and arguments.
+PROBES = (("version", ["-version"]),
+          ("cpus", ["-cpu", "help"]),
+          ("machines", ["-machine", "help"]),
+          ("devices", ["-device", "help"]))
+
+
+def _search_path(directory):
+    if not directory:
+        return os.environ.get("PATH", ".").split(os.pathsep)
+    return directory.split(os.pathsep)
+
+
+def _mtime(path):
+    try:
+        return os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+
+
+def _decode(output):
+    return output.decode("utf-8", "replace")
+
+
+class Capabilities:
+    """A cache of the capabilities of the host, see the module
+    documentation.
+
+    @param filename: the file where the cache is saved, by default
+        C{.capabilities} in the workspace.
+    @param run: a function with the same signature of
+        C{utils.getProcessOutputAndValue}, used to probe the binaries.
+    """
+
+    def __init__(self, filename=None, run=utils.getProcessOutputAndValue):
+        self._filename = filename
+        self.run = run
+        self._loaded = False
+        self._dirty = False
+        # directory -> {"mtime": mtimes, "executables": {name: path}}
+        self._directories = {}
+        # path -> {"mtime": mtime, "version": ..., "cpus": ..., ...}
+        self._probes = {}
+        self._probing = {}
+
+    @property
+    def filename(self):
+        if self._filename is None:
+            from virtualbricks import settings
+            return os.path.join(settings.get("workspace"), FILENAME)
+        return self._filename
+
+    def load(self):
+        """Load the cache, the stale entries are dropped."""
+
+        self._loaded = True
+        try:
+            with open(self.filename) as fp:
+                data = json.load(fp)
+        except (IOError, OSError) as e:
+            if e.errno != errno.ENOENT:
+                logger.warn(cannot_load, filename=self.filename)
+            return
+        except ValueError:
+            logger.warn(cannot_load, filename=self.filename)
+            return
+        if data.get("format") != FORMAT:
+            return
+        for directory, entry in data.get("directories", {}).items():
+            if entry["mtime"] == self._mtimes(directory):
+                self._directories.setdefault(directory, entry)
+        for path, probe in data.get("probes", {}).items():
+            if probe["mtime"] == _mtime(path):
+                self._probes.setdefault(path, probe)
+
+    def save(self):
+        """Save the cache if it changed."""
+
+        if not self._dirty:
+            return
+        data = {"format": FORMAT, "directories": self._directories,
+                "probes": self._probes}
+        tmp = self.filename + ".tmp"
+        try:
+            with open(tmp, "w") as fp:
+                json.dump(data, fp)
+            os.rename(tmp, self.filename)
+        except (IOError, OSError):
+            logger.warn(cannot_save, filename=self.filename)
+        else:
+            self._dirty = False
+
+    def invalidate(self):
+        """Forget the lookups, the probes are still valid because they are
+        checked against the modification time of the binaries."""
+
+        self._directories.clear()
+        self._dirty = True
+
+    def _ensure_loaded(self):
+        if not self._loaded:
+            self.load()
+
+    def _mtimes(self, directory):
+        return [_mtime(d) for d in _search_path(directory)]
+
+    def resolve(self, directory, executable):
+        """Return the absolute path of C{executable} or C{None}.
+
+        @param directory: the directories to search, separated by
+            C{os.pathsep}; if empty the C{PATH} is used.
+        """
+
+        self._ensure_loaded()
+        mtimes = self._mtimes(directory)
+        entry = self._directories.get(directory)
+        if entry is None or entry["mtime"] != mtimes:
+            entry = self._directories[directory] = {
+                "mtime": mtimes, "executables": {}}
+        executables = entry["executables"]
+        try:
+            return executables[executable]
+        except KeyError:
+            pass
+        for path in _search_path(directory):
+            abspath = os.path.join(path, executable)
+            if os.access(abspath, os.X_OK):
+                break
+        else:
+            abspath = None
+        executables[executable] = abspath
+        self._dirty = True
+        return abspath
+
+    def probe(self, executable):
+        """Probe a qemu binary.
+
+        @param executable: the absolute path of the binary.
+        @return: a deferred that fires with a dict with the keys C{version},
+            C{cpus}, C{machines} and C{devices}, the output of the
+            respective commands.
+        """
+
+        self._ensure_loaded()
+        mtime = _mtime(executable)
+        probe = self._probes.get(executable)
+        if probe is not None and probe["mtime"] == mtime:
+            return defer.succeed(probe)
+        if mtime is None:
+            return defer.fail(OSError(errno.ENOENT, os.strerror(errno.ENOENT),
+                                      executable))
+        # Only one probe at a time for every binary
+        waiter = defer.Deferred()
+        if executable in self._probing:
+            self._probing[executable].append(waiter)
+        else:
+            self._probing[executable] = [waiter]
+            d = self._probe(executable, mtime)
+            d.addBoth(self._probed, executable)
+        return waiter
+
+    def _probed(self, result, executable):
+        for waiter in self._probing.pop(executable):
+            waiter.callback(result)
+
+    @defer.inlineCallbacks
+    def _probe(self, executable, mtime):
+        try:
+            results = yield defer.gatherResults(
+                [self.run(executable, args, os.environ)
+                 for _, args in PROBES], consumeErrors=True)
+        except defer.FirstError as e:
+            e.subFailure.raiseException()
+        out, err, code = results[0]
+        if code != 0:
+            raise OSError(errno.ENOEXEC, _decode(err).strip(), executable)
+        probe = {"mtime": mtime}
+        for (name, _), (out, _, _) in zip(PROBES, results):
+            probe[name] = _decode(out)
+        self._probes[executable] = probe
+        self._dirty = True
+        logger.info(probed, executable=executable,
+                    version=probe["version"].strip())
+        self.save()
+        defer.returnValue(probe)
+
+    def qemu_version(self, executable):
+        """Return a deferred that fires with the output of C{executable
+        -version}, where C{executable} is looked up in C{qemupath}."""
+
+        from virtualbricks import _spawn
+
+        path = _spawn.abspath_qemu(executable, return_relative=False)
+        if path is None:
+            return defer.fail(OSError(errno.ENOENT, os.strerror(errno.ENOENT),
+                                      executable))
+        return self.probe(path).addCallback(lambda probe: probe["version"])
+
+
+cache = Capabilities()
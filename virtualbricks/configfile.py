@@ -21,11 +21,14 @@ import os.path
 import errno
 import traceback
 import contextlib
+import itertools
+import threading
 import six
 from twisted.python import filepath
 from zope.interface import implementer
 
-from virtualbricks import interfaces, settings, _configparser, log
+from virtualbricks import (interfaces, settings, snapshot, journal,
+                           _configparser, log)
 
 
 if False:  # pyflakes
@@ -33,8 +36,8 @@ if False:  # pyflakes
 
 
 __all__ = ["BrickBuilder", "ConfigFile", "EventBuilder", "ImageBuilder",
-           "LinkBuilder", "SockBuilder", "log_events", "restore", "safe_save",
-           "save"]
+           "LinkBuilder", "SockBuilder", "log_events", "project_filename",
+           "restore", "safe_save", "save"]
 
 
 logger = log.Logger()
@@ -56,6 +59,12 @@ skip_image_noa = log.Event("Cannot access image file, skipping")
 config_dump = log.Event("CONFIG DUMP on {path}")
 open_project = log.Event("Open project at {path}")
 config_save_error = log.Event("Error while saving configuration file")
+cannot_load_line = log.Event("Cannot load the project, error at line "
+                             "{lineno}")
+cannot_load_snapshot = log.Event("Cannot load the snapshot of {path}, "
+                                 "parsing the project")
+snapshot_restored = log.Event("Restored {count} bricks from the snapshot")
+journal_replayed = log.Event("Replayed {count} changes from the journal")
 
 log_events = [link_type_error,
               brick_not_found,
@@ -70,13 +79,45 @@ log_events = [link_type_error,
               skip_image_noa,
               config_dump,
               open_project,
-              config_save_error]
+              config_save_error,
+              cannot_load_line,
+              cannot_load_snapshot,
+              snapshot_restored,
+              journal_replayed]
+
+
+# The project files are written one at a time, by the reactor or by the
+# autosave thread.
+_write_lock = threading.Lock()
+# The states are numbered when they are taken, on the reactor thread. The
+# autosave thread can write after a save made on the reactor: the number of
+# the last state written to each file tells that its state is older.
+_states = itertools.count(1)
+_written = {}
+
+
+def take_state(factory):
+    """Return the state of C{factory}, see L{snapshot.state}, and its number
+    for L{ConfigFile.write}."""
+
+    return next(_states), snapshot.state(factory)
+
+
+def _backup_copy(original, fbackup):
+    # The original is never written in place, it is replaced by a rename: a
+    # hard link is as good as a copy and it does not read the whole file.
+    try:
+        os.link(original.path, fbackup.path)
+    except OSError as e:
+        if e.errno == errno.ENOENT:
+            raise
+        original.copyTo(fbackup)
 
 
 @contextlib.contextmanager
 def backup(original, fbackup):
     try:
-        original.copyTo(fbackup)
+        _backup_copy(original, fbackup)
     except OSError as e:
         if e.errno == errno.ENOENT:
             yield
@@ -310,35 +351,63 @@ class ConfigFile:
             else:
                 fp = str_or_obj
             logger.debug(config_dump, path=fp.path)
-            with backup(fp, fp.sibling(fp.basename() + "~")):
-                tmpfile = fp.sibling("." + fp.basename() + ".sav")
-                with open(tmpfile.path, "wt") as fd:
-                    self.save_to(factory, fd)
-                tmpfile.moveTo(fp)
+            changes = factory.changes
+            number, state = take_state(factory)
+            if not self.write(fp, state, number):
+                logger.warn(snapshot.cannot_write,
+                            path=snapshot.filename(fp.path),
+                            hide_to_user=True)
+            factory.mark_clean(changes)
         else:
             self.save_to(factory, str_or_obj)
 
     def save_to(self, factory, fileobj):
-        for img in factory.disk_images:
-            img.save_to(fileobj)
-
-        for event in factory.events:
-            event.save_to(fileobj)
-
-        socks = []
-        plugs = []
-        for brick in iter(factory.bricks):
-            brick.save_to(fileobj)
-            if brick.get_type() == "Qemu":
-                socks.extend(brick.socks)
-            plugs.extend(brick.plugs)
-
-        for sock in socks:
-            t = "sock|{s.brick.name}|{s.nickname}|{s.model}|{s.mac}\n"
-            fileobj.write(t.format(s=sock))
+        self.save_state(snapshot.state(factory), fileobj)
+
+    def save_state(self, state, fileobj):
+        """Write the state returned by L{snapshot.state} as a project
+        file."""
+
+        images, events, bricks, socks, links = state
+        for name, path in images:
+            _write_section(fileobj, "Image", name, [("path", path)])
+        for name, options in events:
+            _write_section(fileobj, "Event", name, options)
+        for type, name, options in bricks:
+            _write_section(fileobj, type, name, options)
+        for owner, nickname, model, mac in socks:
+            fileobj.write("sock|{0}|{1}|{2}|{3}\n".format(owner, nickname,
+                                                         model, mac))
+        for owner, sockname, model, mac in links:
+            fileobj.write("link|{0}|{1}|{2}|{3}\n".format(owner, sockname,
+                                                         model, mac))
+
+    def write(self, fp, state, number=None):
+        """Write the project file C{fp} and its snapshot from C{state}.
+
+        The factory is not used and nothing is logged, the autosave calls
+        it from a thread.
+
+        @param number: the number of the state returned by L{take_state}.
+            If a newer state is already written to C{fp}, nothing is done.
+        @return: C{False} if the snapshot cannot be written.
+        """
 
-        for plug in plugs:
-            plug.save_to(fileobj)
+        with _write_lock:
+            if number is not None and number < _written.get(fp.path, 0):
+                return True
+            with backup(fp, fp.sibling(fp.basename() + "~")):
+                tmpfile = fp.sibling("." + fp.basename() + ".sav")
+                with open(tmpfile.path, "wt") as fd:
+                    self.save_state(state, fd)
+                tmpfile.moveTo(fp)
+            if number is not None:
+                _written[fp.path] = number
+            try:
+                snapshot.write(fp.path, state)
+            except EnvironmentError:
+                return False
+            return True
 
     def restore(self, factory, str_or_obj):
         if isinstance(str_or_obj, (six.string_types, filepath.FilePath)):
@@ -348,25 +417,103 @@ class ConfigFile:
                 fp = str_or_obj
             restore_backup(fp, fp.sibling(fp.basename() + "~"))
             logger.info(open_project, path=fp.path)
-            with open(fp.path,"rt") as fd:
-                self.restore_from(factory, fd)
+            state = snapshot.read(fp.path)
+            records = journal.read(journal.filename(fp.path))
+            if state is not None:
+                try:
+                    self.restore_snapshot(factory,
+                                          journal.replay(state, records))
+                except Exception:
+                    logger.exception(cannot_load_snapshot, path=fp.path,
+                                     hide_to_user=True)
+                    factory.reset()
+                    state = None
+            if state is None:
+                with open(fp.path,"rt") as fd:
+                    self.restore_from(factory, fd)
+                if records:
+                    state = journal.replay(snapshot.state(factory), records)
+                    factory.reset()
+                    self.restore_snapshot(factory, state)
+            if records:
+                # The project file is behind the journal
+                logger.info(journal_replayed, count=len(records))
+            else:
+                factory.mark_clean()
         else:
             self.restore_from(factory, str_or_obj)
 
     def restore_from(self, factory, fileobj):
+        tokens = list(_configparser.Parser(fileobj).tokens())
+        # Reserve the MAC addresses of the project before any new address is
+        # generated, so that the new ones do not collide with them.
+        factory.macs.reserve_all(
+            item.mac for _, item in tokens
+            if isinstance(item, _configparser.Link) and item.mac)
+        with freeze_notify(factory):
+            for lineno, item in tokens:
+                try:
+                    interfaces.IBuilder(item).load_from(factory, item)
+                except Exception:
+                    logger.error(cannot_load_line, lineno=lineno,
+                                 hide_to_user=True)
+                    raise
+
+    def restore_snapshot(self, factory, state):
+        """Restore the state returned by L{snapshot.read}.
+
+        The bricks are created at once with L{BrickFactory.new_bricks} and
+        the links are resolved without the lookups and the log messages of
+        the builders.
+        """
+
+        images, events, bricks, socks, links = state
+        macs = [mac for _, _, _, mac in socks + links]
+        factory.macs.reserve_all(mac for mac in macs if mac)
         with freeze_notify(factory):
-            for item in _configparser.Parser(fileobj):
-                interfaces.IBuilder(item).load_from(factory, item)
+            for name, path in images:
+                ImageBuilder(name).load_from(factory, [("path", path)])
+            for name, options in events:
+                EventBuilder(name).load_from(factory, options)
+            new = factory.new_bricks((type, name) for type, name, _ in bricks)
+            for brick, (_, _, options) in zip(new, bricks):
+                if options:
+                    with freeze_notify(brick):
+                        brick.load_from(options)
+            for owner, _, model, mac in socks:
+                factory.get_brick_by_name(owner).add_sock(mac, model)
+            for owner, sockname, model, mac in links:
+                sock = factory.get_sock_by_name(sockname)
+                if sock:
+                    factory.get_brick_by_name(owner).connect(sock, mac, model)
+                else:
+                    logger.warn(sock_not_found, sockname=sockname,
+                                line="|".join(("link", owner, sockname,
+                                               model, mac)))
+        logger.info(snapshot_restored, count=len(new))
+
+
+def _write_section(fileobj, type, name, options):
+    fileobj.write("[{0}:{1}]\n".format(type, name))
+    for option in options:
+        fileobj.write("{0}={1}\n".format(*option))
+    fileobj.write("\n")
 
 
 _config = ConfigFile()
 
 
+def project_filename():
+    """Return the project file of the current project."""
+
+    workspace = settings.get("workspace")
+    project = settings.get("current_project")
+    return os.path.join(workspace, project, ".project")
+
+
 def save(factory, filename=None):
     if filename is None:
-        workspace = settings.get("workspace")
-        project = settings.get("current_project")
-        filename = os.path.join(workspace, project, ".project")
+        filename = project_filename()
     _config.save(factory, filename)
 
 
@@ -379,7 +526,5 @@ def safe_save(factory, filename=None):
 
 def restore(factory, filename=None):
     if filename is None:
-        workspace = settings.get("workspace")
-        project = settings.get("current_project")
-        filename = os.path.join(workspace, project, ".project")
+        filename = project_filename()
     _config.restore(factory, filename)
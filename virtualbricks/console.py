@@ -38,6 +38,10 @@ if False:  # pyflakes
     _ = str
 
 
+def _fmt(value, spec="{0:.0f}"):
+    return "-" if value is None else spec.format(value)
+
+
 class _Error(Exception):
     """Please don't use."""
 
@@ -127,6 +131,10 @@ class VBProtocol(Protocol):
     Base commands -----------------------------------------------------
     h[elp]                  print this help
     ps                      List of active process
+    top [N]                 Resources used by the N busiest bricks
+    lag [reset]             Histogram of the reactor lag
+    autosave                Saves and latencies of the autosave and the journal
+    jobs [cancel ID]        List or cancel the background jobs
     n[ew] TYPE NAME         Create a new TYPE brick with NAME
     list                    List of bricks already created
     socks                   List of connections available for bricks
@@ -252,6 +260,103 @@ class VBProtocol(Protocol):
             for b in procs:
                 self.sendLine("%d\t%s\t%s" % (b.pid, b.get_type(), b.name))
 
+    def do_top(self, limit=None):
+        """Resources used by the running bricks"""
+
+        if limit is not None:
+            try:
+                limit = int(limit)
+            except ValueError:
+                self.sendLine("Invalid limit '{0}', usage: top [limit]"
+                              .format(limit))
+                return
+        sampler = self.factory.sampler
+        if not sampler.is_running():
+            sampler.start()
+        rows = sampler.top(limit=limit)
+        if not rows:
+            self.sendLine("No process running")
+            return
+        self.sendLine("PID\tCPU%\tRSS(KiB)\tCSW/s\tRead/s\tWrite/s\tName")
+        self.sendLine("-" * 64)
+        for brick, stats in rows:
+            self.sendLine("\t".join([
+                str(stats.pids[0]), _fmt(stats.cpu_percent, "{0:.1f}"),
+                str(stats.rss // 1024), _fmt(stats.switches_rate),
+                _fmt(stats.read_rate), _fmt(stats.write_rate), brick.name]))
+        cost = sampler.cost[-1] if sampler.cost else 0
+        self.sendLine("sampling: every {0:.1f}s, last round {1:.1f}ms".format(
+            sampler.interval, cost * 1000))
+
+    def do_lag(self, reset=None):
+        """Histogram of the reactor lag"""
+
+        watchdog = self.factory.watchdog
+        histogram = watchdog.histogram
+        if reset == "reset":
+            histogram.reset()
+            return
+        self.sendLine("ticks: {0}, stalls: {1}, mean: {2:.1f}ms, "
+                      "p99: {3:.1f}ms, max: {4:.1f}ms".format(
+                          histogram.count, watchdog.stalls,
+                          histogram.mean() * 1000,
+                          histogram.percentile(99) * 1000,
+                          histogram.max * 1000))
+        for bound, count in histogram.buckets():
+            if count:
+                label = ("<= {0:g}ms".format(bound * 1000) if bound is not None
+                         else "> {0:g}ms".format(histogram.bounds[-1] * 1000))
+                self.sendLine("{0:>10}\t{1}".format(label, count))
+
+    def do_autosave(self):
+        """Saves and latencies of the autosave and the journal"""
+
+        autosave = self.factory.autosave
+        journal = self.factory.journal
+        self.sendLine("saves: {0}, failures: {1}, dirty: {2}".format(
+            autosave.saves, autosave.failures,
+            "yes" if self.factory.is_dirty() else "no"))
+        histograms = [("total", autosave.latency),
+                      ("reactor", autosave.blocking)]
+        if journal is None:
+            self.sendLine("journal: closed")
+        else:
+            self.sendLine("journal: {0} bytes, {1} commits, {2} records"
+                          .format(journal.size, journal.commits,
+                                  journal.records))
+            histograms.append(("commit", journal.latency))
+        for name, histogram in histograms:
+            self.sendLine("{0:>8}: mean: {1:.1f}ms, p99: {2:.1f}ms, "
+                          "max: {3:.1f}ms".format(
+                              name, histogram.mean() * 1000,
+                              histogram.percentile(99) * 1000,
+                              histogram.max * 1000))
+
+    def do_jobs(self, cmd=None, job_id=None):
+        """List or cancel the background jobs"""
+
+        manager = self.factory.jobs
+        if cmd == "cancel":
+            try:
+                manager.cancel(int(job_id))
+            except (KeyError, TypeError, ValueError):
+                self.sendLine("No such job: {0}".format(job_id))
+            return
+        jobs = manager.jobs()
+        if not jobs:
+            self.sendLine("No jobs")
+            return
+        now = manager.reactor.seconds()
+        self.sendLine("ID\tState\tDone%\tTime(s)\tDescription")
+        self.sendLine("-" * 64)
+        for job in jobs:
+            self.sendLine("\t".join([
+                str(job.id), job.state, _fmt(job.progress, "{0:.1f}"),
+                "{0:.1f}".format(job.elapsed(now)), job.description]))
+        self.sendLine("slots: {0} running, {1} queued, {2} total, {3} I/O"
+                      .format(len(manager.running()), len(manager.queued()),
+                              manager.slots, manager.io_slots))
+
     def do_reset(self):
         self.factory.reset()
 
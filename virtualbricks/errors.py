@@ -58,6 +58,20 @@ class InvalidActionError(Error):
     pass
 
 
+class BrickError(Error):
+    """The process of a brick ended before the brick was ready."""
+
+    def __init__(self, name, status):
+        Error.__init__(self, name, status)
+        self.name = name
+        self.status = status
+
+    def __str__(self):
+        reason = getattr(self.status, "value", self.status)
+        return _("Process of %s ended before being ready: %s") % (self.name,
+                                                                   reason)
+
+
 class LockedImageError(Error):
 
     def __init__(self, image, master):
@@ -100,12 +100,11 @@ from twisted.internet import utils, defer, task, error
 from twisted.python import filepath
 
 from virtualbricks import __version__
-from virtualbricks import (tools, log, console, settings,
-                           virtualmachines, project, errors)
+from virtualbricks import (tools, log, console, settings, jobs,
+                           virtualmachines, project, errors, imageinfo)
 from virtualbricks.virtualmachines import is_virtualmachine
 from virtualbricks.tools import dispose
 from virtualbricks.gui import graphics, widgets
-from virtualbricks._spawn import getQemuOutputAndValue
 from virtualbricks.errors import NoOptionError
 
 
@@ -256,6 +255,44 @@ class Window(Base):
         pass
 
 
+class JobsWindow(Window):
+    """List the background jobs and cancel the selected one."""
+
+    resource = "jobs.ui"
+
+    def __init__(self, manager):
+        Window.__init__(self)
+        self.manager = manager
+        for name in "job-added", "job-changed", "job-removed":
+            manager.connect(name, self.on_job_changed)
+        self.populate()
+
+    def populate(self):
+        model = self.get_object("liststore1")
+        model.clear()
+        for job in self.manager.jobs():
+            model.append((job.id, job.state, int(job.progress or 0),
+                          job.description))
+
+    def on_job_changed(self, job):
+        self.populate()
+
+    def on_JobsWindow_destroy(self, window):
+        for name in "job-added", "job-changed", "job-removed":
+            self.manager.disconnect(name, self.on_job_changed)
+
+    def on_cancelbutton_clicked(self, button):
+        model, itr = self.get_object("treeview").get_selection().get_selected()
+        if itr:
+            try:
+                self.manager.cancel(model.get_value(itr, 0))
+            except KeyError:
+                pass
+
+    def on_closebutton_clicked(self, button):
+        self.window.destroy()
+
+
 class AboutDialog(Window):
 
     resource = "about.ui"
@@ -511,7 +548,7 @@ class BaseEthernetDialog(Window):
                     socks.append((sock.nickname, sock))
 
     def on_randomize_button_clicked(self, button):
-        self.get_object("mac_entry").set_text(tools.random_mac())
+        self.get_object("mac_entry").set_text(self.factory.macs.generate())
 
     def on_EthernetDialog_response(self, dialog, response_id):
         if response_id == Gtk.ResponseType.OK:
@@ -522,7 +559,7 @@ class BaseEthernetDialog(Window):
             mac = self.get_object("mac_entry").get_text()
             if not self.is_valid(mac):
                 logger.error(invalid_mac, mac=mac)
-                mac = tools.random_mac()
+                mac = self.factory.macs.generate()
             self.do(sock, mac, model)
         dialog.destroy()
 
@@ -586,6 +623,7 @@ class EditEthernetDialog(BaseEthernetDialog):
                 self.plug.disconnect()
             self.plug.connect(sock)
             if mac:
+                self.factory.macs.replace(self.plug.mac, mac)
                 self.plug.mac = mac
             if model:
                 self.plug.model = model
@@ -780,7 +818,6 @@ class CommitImageDialog(Window):
 
     resource = "commitdialog.ui"
     parent = None
-    _set_label_d = None
 
     def __init__(self, progessbar, factory):
         Window.__init__(self)
@@ -801,13 +838,13 @@ class CommitImageDialog(Window):
             if exit_status != 0:
                 logger.error(commit_failed, err=err)
 
-        d = getQemuOutputAndValue("qemu-img", ["commit", path], os.environ)
-        d.addCallback(log_err)
-        return d
+        job = jobs.qemu_img(["commit", "-p", path])
+        job.deferred.addCallback(log_err)
+        return job
 
     def do_image_commit(self, path):
         self.window.destroy()
-        self.progessbar.wait_for(self._do_image_commit, path)
+        self.progessbar.wait_for_job(self._do_image_commit(path))
 
     def commit_file(self, pathname):
         question = ("Warning: the base image will be updated to the\n"
@@ -864,34 +901,25 @@ class CommitImageDialog(Window):
         self.get_object("cow_checkbutton").set_visible(not active)
         self.get_object("msg_label").set_visible(False)
 
-    def _commit_image_show_result(self, codes):
-        out, err, code = codes
-        if code != 0:
-            logger.error(base_not_found, err=err)
+    def _commit_image_show_result(self, backing_file):
+        label = self.get_object("msg_label")
+        if backing_file:
+            label.set_text("backing file: " + backing_file)
         else:
-            label = self.get_object("msg_label")
-            for line in out.splitlines():
-                if line.startswith("backing file: "):
-                    label.set_text(line)
-                    break
-            else:
-                label.set_text(_("Base not found (invalid cow?)"))
-            label.set_visible(True)
+            label.set_text(_("Base not found (invalid cow?)"))
+        label.set_visible(True)
 
     def on_cowpath_filechooser_file_set(self, filechooser):
-        if self._set_label_d is not None:
-            self._set_label_d.cancel()
         filename = filechooser.get_filename()
         if os.access(filename, os.R_OK):
-            code = getQemuOutputAndValue("qemu-img", ["info", filename],
-                                         os.environ)
-            code.addCallback(self._commit_image_show_result)
-            self._set_label_d = code
-            return code
+            try:
+                backing_file = imageinfo.backing_file(filename)
+            except (IOError, OSError) as e:
+                logger.error(base_not_found, err=e)
+            else:
+                self._commit_image_show_result(backing_file)
 
     def set_label(self, combobox=None, button=None):
-        if self._set_label_d is not None:
-            self._set_label_d.cancel()
         if combobox is None:
             combobox = self.get_object("disk_combo")
         if button is None:
@@ -904,12 +932,10 @@ class CommitImageDialog(Window):
             disk = model[itr][1]
             base = disk.image and disk.image.path or None
             if base and button.get_active():
-                # XXX: make disk.get_real_disk_name's deferred cancellable
                 deferred = disk.get_real_disk_name()
                 deferred.addCallback(label.set_text)
                 deferred.addCallback(lambda _: label.set_visible(True))
                 deferred.addErrback(logger.failure_eb, img_combo)
-                self._set_label_d = deferred
             elif base:
                 label.set_visible(True)
                 label.set_text(base)
@@ -1004,10 +1030,8 @@ class CreateImageDialog(Window):
             else:
                 return self.factory.new_disk_image(name, pathname)
 
-        exit = getQemuOutputAndValue(
-            "qemu-img",
-            ["create", "-f", fmt, pathname, size + unit], os.environ
-        )
+        exit = jobs.qemu_img(["create", "-f", fmt, pathname, size + unit],
+                             io=False).deferred
         exit.addCallback(_create_disk)
         logger.log_failure(exit, img_create_err)
         return exit
@@ -1497,10 +1521,22 @@ class Freezer:
         deferred.addBoth(self.stop, self.start())
         return deferred
 
-    def start(self):
+    def wait_for_job(self, job):
+        """Like L{wait_for_deferred} but show the progress of the job."""
+
+        job.deferred.addBoth(self.stop, self.start(job))
+        return job.deferred
+
+    def update(self, job):
+        if job is None or job.progress is None:
+            self.progressbar.pulse()
+        else:
+            self.progressbar.set_fraction(job.progress / 100)
+
+    def start(self, job=None):
         self.freeze()
         self.window.show_all()
-        lc = task.LoopingCall(self.progressbar.pulse)
+        lc = task.LoopingCall(self.update, job)
         lc.start(0.2, False)
         return lc
 
@@ -1519,6 +1555,9 @@ class ProgressBar:
     def wait_for(self, something, *args):
         return self.freezer.wait_for(something, *args)
 
+    def wait_for_job(self, job):
+        return self.freezer.wait_for_job(job)
+
 
 def all_paths_set(model):
     return all(path for (path,) in iter_model(model, 1))
@@ -1663,7 +1702,7 @@ class _HumbleImport:
                     lst.append(self.rebase(path.path, cow.path))
         return defer.DeferredList(lst)
 
-    def rebase(self, backing_file, cow, run=utils.getProcessOutputAndValue):
+    def rebase(self, backing_file, cow, run=jobs.run):
         args = ["rebase", "-u", "-b", backing_file, cow]
         d = run("qemu-img", args, os.environ)
         return d.addCallback(complain_on_error)
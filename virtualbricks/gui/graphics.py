@@ -111,7 +111,7 @@ class Node:
 
 class Topology:
 
-    def __init__(self, widget, bricks, scale=1.00, orientation="LR",
+    def __init__(self, widget, bricks, graph, scale=1.00, orientation="LR",
                  tempdir="/tmp"):
         self.topowidget = widget
         self.tempdir = tempdir
@@ -134,29 +134,28 @@ class Topology:
 
         for b in bricks:
             loop = 0
-            for e in b.plugs:
-                if e.sock is not None:
-                    if b.get_type() == 'Tap':
-                        self.topo.add_edge(b.name, e.sock.brick.name)
-                        e = self.topo.get_edge(b.name, e.sock.brick.name)
-                    elif len(b.plugs) == 2:
-                        if loop == 0:
-                            self.topo.add_edge(e.sock.brick.name, b.name)
-                            e = self.topo.get_edge(e.sock.brick.name, b.name)
-                        else:
-                            self.topo.add_edge(b.name, e.sock.brick.name)
-                            e = self.topo.get_edge(b.name, e.sock.brick.name)
-                    elif loop < (len(b.plugs) + 1) / 2:
+            for e in graph.links(b):
+                if b.get_type() == 'Tap':
+                    self.topo.add_edge(b.name, e.sock.brick.name)
+                    e = self.topo.get_edge(b.name, e.sock.brick.name)
+                elif len(b.plugs) == 2:
+                    if loop == 0:
                         self.topo.add_edge(e.sock.brick.name, b.name)
                         e = self.topo.get_edge(e.sock.brick.name, b.name)
                     else:
                         self.topo.add_edge(b.name, e.sock.brick.name)
                         e = self.topo.get_edge(b.name, e.sock.brick.name)
-                    loop += 1
-                    e.attr['dir'] = 'none'
-                    e.attr['color'] = 'black'
-                    e.attr['name'] = "      "
-                    e.attr['decorate'] = 'true'
+                elif loop < (len(b.plugs) + 1) / 2:
+                    self.topo.add_edge(e.sock.brick.name, b.name)
+                    e = self.topo.get_edge(e.sock.brick.name, b.name)
+                else:
+                    self.topo.add_edge(b.name, e.sock.brick.name)
+                    e = self.topo.get_edge(b.name, e.sock.brick.name)
+                loop += 1
+                e.attr['dir'] = 'none'
+                e.attr['color'] = 'black'
+                e.attr['name'] = "      "
+                e.attr['decorate'] = 'true'
 
         # draw and save
         self.topo.write(self.get_topo_filename())
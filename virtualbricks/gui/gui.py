@@ -35,12 +35,12 @@ from virtualbricks.interfaces import registerAdapter
 from virtualbricks.gui.interfaces import (IMenu, IJobMenu, IConfigController,
                                           IPrerequisite, IState, IControl,
                                           IStateManager)
-from virtualbricks._spawn import getQemuOutput
 from virtualbricks.bricks import Brick
 from virtualbricks.events import Event
 from virtualbricks.link import Plug, Sock
 from virtualbricks.virtualmachines import VirtualMachine
-from virtualbricks import tools, settings, project, log, brickfactory, qemu
+from virtualbricks import (tools, settings, project, log, brickfactory, qemu,
+                           imageinfo, capabilities)
 from virtualbricks.tools import dispose, is_running
 from virtualbricks.gui import graphics, dialogs, widgets, help
 
@@ -179,13 +179,13 @@ class VMPopupMenu(BrickPopupMenu):
 
     def resume(self, factory):
 
-        def grep(out, pattern):
-            if out.find(pattern) == -1:
+        def find_snapshot(info, name):
+            if not any(s.name == name for s in info.snapshots):
                 raise RuntimeError(_("Cannot find suspend point."))
 
         def loadvm(_):
             if self.original.proc is not None:
-                self.original.send("loadvm virtualbricks\n")
+                return self.original.loadvm("virtualbricks")
             else:
                 return self.original.poweron("virtualbricks")
 
@@ -198,9 +198,8 @@ class VMPopupMenu(BrickPopupMenu):
             logger.error(s_r_not_supported)
             return defer.fail(RuntimeError(_("Suspend/Resume not supported on "
                                              "this disk.")))
-        args = ["snapshot", "-l", path]
-        output = getQemuOutput("qemu-img", args, os.environ)
-        output.addCallback(grep, "virtualbricks")
+        output = defer.maybeDeferred(imageinfo.info, path)
+        output.addCallback(find_snapshot, "virtualbricks")
         output.addCallback(loadvm)
         logger.log_failure(output, snap_error)
         return output
@@ -386,8 +385,8 @@ class VMJobMenu(JobMenu):
                                              "this disk.")))
 
         if tools.image_type_from_file(path) == tools.ImageFormat.QCOW2:
-            self.original.send("savevm virtualbricks\n")
-            return self.original.poweroff()
+            d = self.original.savevm("virtualbricks")
+            return d.addCallback(lambda _: self.original.poweroff())
         else:
             logger.error(s_r_not_supported)
             return defer.fail(RuntimeError(_("Suspend/Resume not supported on "
@@ -399,11 +398,11 @@ class VMJobMenu(JobMenu):
 
     def on_powerdown_activate(self, menuitem):
         logger.info(send_acpi, acpievent="powerdown")
-        self.original.send("system_powerdown\n")
+        self.original.system_powerdown()
 
     def on_reset_activate(self, menuitem):
         logger.info(send_acpi, acpievent="reset")
-        self.original.send("system_reset\n")
+        self.original.system_reset()
 
     def on_term_activate(self, menuitem, gui):
         logger.debug(proc_signal, signame="SIGTERM")
@@ -1135,7 +1134,7 @@ class QemuConfigController(ConfigController):
         panel = Gtk.Alignment()
         label = Gtk.Label("Loading configuration...")
         panel.add(label)
-        d = getQemuOutput("qemu-system-x86_64", ["-version"])
+        d = capabilities.cache.qemu_version("qemu-system-x86_64")
         d.addCallbacks(install_qemu_version, logger.failure_eb,
                        errbackArgs=(retrieve_qemu_version_error, True))
         d.addErrback(close_panel)
@@ -1471,6 +1470,7 @@ class TopologyMixin(object):
 
     __should_draw_topology = False
     __topology = None
+    __topology_key = None
 
     # public interface
 
@@ -1575,15 +1575,22 @@ class TopologyMixin(object):
             self._draw_topology()
 
     def _draw_topology(self):
-        logger.debug(drawing_topology)
         if self.get_object('topology_tb').get_active():
             orientation = "TB"
         else:
             orientation = "LR"
-        self.__topology = graphics.Topology(
-            self.get_object('image_topology'),
-            self.brickfactory.bricks, 1.00, orientation,
-            settings.VIRTUALBRICKS_HOME)
+        bricks = self.brickfactory.bricks
+        graph = self.brickfactory.graph
+        # The layout is expensive, redraw only if something visible changed:
+        # the links, the orientation or the bricks' names and icons.
+        key = (graph.version, orientation,
+               tuple((b.name, graphics.brick_icon(b)) for b in bricks))
+        if self.__topology is None or key != self.__topology_key:
+            logger.debug(drawing_topology)
+            self.__topology = graphics.Topology(
+                self.get_object('image_topology'), bricks, graph, 1.00,
+                orientation, settings.VIRTUALBRICKS_HOME)
+            self.__topology_key = key
         self.__should_draw_topology = False
 
 
@@ -1677,6 +1684,9 @@ class ProgressBar:
     def wait_for(self, something, *args):
         return self.freezer.wait_for(something, *args)
 
+    def wait_for_job(self, job):
+        return self.freezer.wait_for_job(job)
+
 
 class _Root(object):
     # This object ensure that super() calls are not forwarded to object.
@@ -1715,11 +1725,13 @@ class BricksBindingList(widgets.AbstractBindingList):
     def __init__(self, factory):
         widgets.AbstractBindingList.__init__(self, factory)
         factory.connect("brick-added", self._on_added)
+        factory.connect("bricks-added", self._on_bulk_added)
         factory.connect("brick-removed", self._on_removed)
         factory.connect("brick-changed", self._on_changed)
 
     def __dispose__(self):
         self._factory.disconnect("brick-added", self._on_added)
+        self._factory.disconnect("bricks-added", self._on_bulk_added)
         self._factory.disconnect("brick-removed", self._on_removed)
         self._factory.disconnect("brick-changed", self._on_changed)
 
@@ -1769,6 +1781,7 @@ class VBGUI(TopologyMixin, ReadmeMixin, _Root):
         self.__initialize_components()
         factory.connect("brick-changed", self.on_brick_changed)
         factory.connect("brick-added", self.on_brick_changed)
+        factory.connect("bricks-added", self.on_brick_changed)
         factory.connect("brick-removed", self.on_brick_changed)
         self.progressbar = ProgressBar(self)
         if settings.get("systray"):
@@ -1847,6 +1860,7 @@ class VBGUI(TopologyMixin, ReadmeMixin, _Root):
     def __dispose__(self):
         self.factory.disconnect("brick-changed", self.on_brick_changed)
         self.factory.disconnect("brick-added", self.on_brick_changed)
+        self.factory.disconnect("bricks-added", self.on_brick_changed)
         self.factory.disconnect("brick-removed", self.on_brick_changed)
         if self.__bricks_binding_list is not None:
             dispose(self.__bricks_binding_list)
@@ -2083,6 +2097,10 @@ class VBGUI(TopologyMixin, ReadmeMixin, _Root):
         dialogs.LoggingWindow(self.messages_buffer).show()
         return True
 
+    def on_menuViewJobs_activate(self, menuitem):
+        dialogs.JobsWindow(self.brickfactory.jobs).show(self.wndMain)
+        return True
+
     def on_menuImagesCreate_activate(self, menuitem):
         dialogs.CreateImageDialog(self, self.brickfactory).show(self.wndMain)
         return True
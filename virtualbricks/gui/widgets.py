@@ -218,6 +218,10 @@ class AbstractBindingList:
     def _on_added(self, obj):
         self._observable.notify("added", obj)
 
+    def _on_bulk_added(self, objs):
+        for obj in objs:
+            self._on_added(obj)
+
     def _on_removed(self, obj):
         self._observable.notify("removed", obj)
 
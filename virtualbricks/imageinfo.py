@@ -0,0 +1,312 @@
+# -*- test-case-name: virtualbricks.tests.test_imageinfo -*-
+# Virtualbricks - a vde/qemu gui written in python and GTK/Glade.
+# Copyright (C) 2018 Virtualbricks team
+
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+"""Read the metadata of the disk images without running qemu-img.
+
+The headers of qcow, qcow2, QED, VMDK, VDI, VPC and UML COW images are parsed
+directly. Fixed VPC images are recognised by the footer at the end of the
+file. As qemu-img does, files with an unknown header are raw images. The
+results of L{info} are cached and the cache is invalidated when the inode,
+the size or the modification time of the file change.
+"""
+
+import os
+import struct
+import collections
+
+from twisted.python import constants
+
+
+__all__ = ["ImageFormat", "ImageInfo", "Snapshot", "read_info", "info",
+           "backing_file", "clear_cache"]
+
+
+class ImageFormat(constants.Names):
+
+    RAW = constants.NamedConstant()
+    QCOW2 = constants.NamedConstant()
+    QED = constants.NamedConstant()
+    QCOW = constants.NamedConstant()
+    COW = constants.NamedConstant()
+    VDI = constants.NamedConstant()
+    VMDK = constants.NamedConstant()
+    VPC = constants.NamedConstant()
+    CLOOP = constants.NamedConstant()
+    UNKNOWN = constants.NamedConstant()
+
+
+# virtual_size is in bytes, 0 when unknown. backing_file is None if the
+# image has no backing file.
+ImageInfo = collections.namedtuple("ImageInfo", [
+    "format", "version", "virtual_size", "backing_file", "cluster_size",
+    "snapshots"])
+Snapshot = collections.namedtuple("Snapshot", [
+    "id", "name", "vm_state_size", "date", "vm_clock_nsec"])
+
+COW_MAGIC = b"OOOM"
+COW_BACKING_SIZE = 1024
+QCOW_MAGIC = b"QFI\xfb"
+COWD_MAGIC = b"COWD"
+VMDK_MAGIC = b"KDMV"
+VMDK_DESCRIPTOR = b"# Disk DescriptorFile"
+QED_MAGIC = b"QED\x00"
+VDI_SIGNATURE = 0xbeda107f
+VPC_COOKIE = b"conectix"
+VPC_SPARSE_COOKIE = b"cxsparse"
+CLOOP_MAGIC = b"#!/bin/sh\n#V2.0 Format\n"
+
+# qcow2: magic, version, backing_file_offset, backing_file_size,
+# cluster_bits, size, crypt_method, l1_size, l1_table_offset,
+# refcount_table_offset, refcount_table_clusters, nb_snapshots,
+# snapshots_offset
+QCOW2_HEADER = struct.Struct(">4sIQIIQIIQQIIQ")
+# qcow2 snapshot entry: l1_table_offset, l1_size, id_str_size, name_size,
+# date_sec, date_nsec, vm_clock_nsec, vm_state_size, extra_data_size
+QCOW2_SNAPSHOT = struct.Struct(">QIHHIIQII")
+# qcow: magic, version, backing_file_offset, backing_file_size, mtime, size,
+# cluster_bits, l2_bits
+QCOW_HEADER = struct.Struct(">4sIQIIQBB")
+# UML cow v2: after the backing file, mtime and size
+COW_TAIL = struct.Struct(">IQ")
+# QED: magic, cluster_size, table_size, header_size, features,
+# compat_features, autoclear_features, l1_table_offset, image_size,
+# backing_filename_offset, backing_filename_size
+QED_HEADER = struct.Struct("<4sIIIQQQQQII")
+# VMDK sparse extent: magic, version, flags, capacity, grain_size,
+# descriptor_offset, descriptor_size (sizes in sectors)
+VMDK_HEADER = struct.Struct("<4sIIQQQQ")
+# VDI: text, signature, version, header_size, image_type, image_flags,
+# description, offset_bmap, offset_data, cylinders, heads, sectors,
+# sector_size, unused, disk_size, block_size
+VDI_HEADER = struct.Struct("<64sIIIII256sIIIIIIIQI")
+# VPC footer: cookie, features, version, data_offset, timestamp,
+# creator_app, creator_version, creator_os, original_size, current_size
+VPC_FOOTER = struct.Struct(">8sIIQI4sI4sQQ")
+# VPC dynamic header: cookie, data_offset, table_offset, header_version,
+# max_table_entries, block_size, checksum, parent_uuid, parent_timestamp,
+# reserved, parent_unicode_name
+VPC_DYNAMIC = struct.Struct(">8sQQIIII16sII512s")
+
+SECTOR = 512
+_PROBE_SIZE = 512
+# Never read absurdly large backing file names or snapshot tables from a
+# corrupted header.
+_MAX_NAME = 4096
+_MAX_SNAPSHOTS = 65536
+
+
+def _read(fp, offset, size):
+    """Read C{size} bytes at C{offset}, padding with zeros if the file is
+    shorter."""
+
+    fp.seek(offset)
+    return fp.read(size).ljust(size, b"\x00")
+
+
+def _read_name(fp, offset, size):
+    if not size or size > _MAX_NAME:
+        return None
+    fp.seek(offset)
+    data = fp.read(size)
+    if len(data) != size:
+        return None
+    return data.decode("utf-8", "replace")
+
+
+def _cluster(bits):
+    return 1 << bits if 9 <= bits <= 31 else 0
+
+
+def _qcow2(fp, header):
+    (_, version, bf_offset, bf_size, cluster_bits, size, _, _, _, _, _,
+     nb_snapshots, snapshots_offset) = QCOW2_HEADER.unpack(
+         _read(fp, 0, QCOW2_HEADER.size))
+    snapshots = []
+    if nb_snapshots <= _MAX_SNAPSHOTS:
+        offset = snapshots_offset
+        for _ in range(nb_snapshots):
+            entry = _read(fp, offset, QCOW2_SNAPSHOT.size)
+            (_, _, id_size, name_size, date_sec, _, vm_clock, vm_state,
+             extra_size) = QCOW2_SNAPSHOT.unpack(entry)
+            offset += QCOW2_SNAPSHOT.size + extra_size
+            id_str = _read(fp, offset, id_size).decode("utf-8", "replace")
+            offset += id_size
+            name = _read(fp, offset, name_size).decode("utf-8", "replace")
+            offset += name_size
+            # Entries are aligned to 8 bytes
+            offset = (offset + 7) & ~7
+            snapshots.append(Snapshot(id_str, name, vm_state, date_sec,
+                                      vm_clock))
+    return ImageInfo(ImageFormat.QCOW2, version, size,
+                     _read_name(fp, bf_offset, bf_size),
+                     _cluster(cluster_bits), snapshots)
+
+
+def _qcow(fp, header):
+    _, version, bf_offset, bf_size, _, size, cluster_bits, _ = \
+        QCOW_HEADER.unpack(_read(fp, 0, QCOW_HEADER.size))
+    return ImageInfo(ImageFormat.QCOW, version, size,
+                     _read_name(fp, bf_offset, bf_size),
+                     _cluster(cluster_bits), [])
+
+
+def _cow(fp, header):
+    version = struct.unpack(">I", header[4:8])[0]
+    backing = _read(fp, 8, COW_BACKING_SIZE).rstrip(b"\x00")
+    _, size = COW_TAIL.unpack(_read(fp, 8 + COW_BACKING_SIZE, COW_TAIL.size))
+    return ImageInfo(ImageFormat.COW, version, size,
+                     backing.decode("utf-8", "replace") or None, 0, [])
+
+
+def _qed(fp, header):
+    (_, cluster_size, _, _, _, _, _, _, size, bf_offset,
+     bf_size) = QED_HEADER.unpack(_read(fp, 0, QED_HEADER.size))
+    return ImageInfo(ImageFormat.QED, 1, size,
+                     _read_name(fp, bf_offset, bf_size), cluster_size, [])
+
+
+def _vmdk_descriptor(text):
+    parent = None
+    sectors = 0
+    for line in text.splitlines():
+        line = line.strip()
+        if line.startswith("parentFileNameHint="):
+            parent = line.split("=", 1)[1].strip().strip('"') or None
+        elif line.startswith(("RW ", "RDONLY ", "NOACCESS ")):
+            try:
+                sectors += int(line.split()[1])
+            except (IndexError, ValueError):
+                pass
+    return parent, sectors
+
+
+def _vmdk(fp, header):
+    if header.startswith(COWD_MAGIC):
+        return ImageInfo(ImageFormat.VMDK, 1, 0, None, 0, [])
+    if header.startswith(VMDK_DESCRIPTOR):
+        # A text descriptor that points to the extents
+        fp.seek(0)
+        text = fp.read(64 * 1024).decode("utf-8", "replace")
+        parent, sectors = _vmdk_descriptor(text)
+        return ImageInfo(ImageFormat.VMDK, 1, sectors * SECTOR, parent, 0, [])
+    (_, version, _, capacity, grain, desc_offset,
+     desc_size) = VMDK_HEADER.unpack(_read(fp, 0, VMDK_HEADER.size))
+    parent = None
+    if desc_offset and desc_size:
+        text = _read(fp, desc_offset * SECTOR, min(desc_size * SECTOR,
+                                                   64 * 1024))
+        parent, _ = _vmdk_descriptor(text.rstrip(b"\x00").decode(
+            "utf-8", "replace"))
+    return ImageInfo(ImageFormat.VMDK, version, capacity * SECTOR, parent,
+                     grain * SECTOR, [])
+
+
+def _vdi(fp, header):
+    fields = VDI_HEADER.unpack(_read(fp, 0, VDI_HEADER.size))
+    version, disk_size, block_size = fields[2], fields[14], fields[15]
+    return ImageInfo(ImageFormat.VDI, version >> 16, disk_size, None,
+                     block_size, [])
+
+
+def _vpc(fp, footer_offset=0):
+    fields = VPC_FOOTER.unpack(_read(fp, footer_offset, VPC_FOOTER.size))
+    data_offset, size = fields[3], fields[9]
+    parent = None
+    cluster_size = 0
+    if data_offset != 0xffffffffffffffff:
+        dynamic = VPC_DYNAMIC.unpack(_read(fp, data_offset, VPC_DYNAMIC.size))
+        if dynamic[0] == VPC_SPARSE_COOKIE:
+            cluster_size = dynamic[5]
+            name = dynamic[10].decode("utf-16-be", "replace").rstrip("\x00")
+            parent = name or None
+    return ImageInfo(ImageFormat.VPC, fields[2] >> 16, size, parent,
+                     cluster_size, [])
+
+
+def _raw(fp, format):
+    fp.seek(0, os.SEEK_END)
+    size = fp.tell()
+    if format is ImageFormat.RAW and size >= SECTOR:
+        # Fixed VPC images have only the footer, in the last sector
+        if _read(fp, size - SECTOR, len(VPC_COOKIE)) == VPC_COOKIE:
+            return _vpc(fp, size - SECTOR)
+    return ImageInfo(format, 0, size, None, 0, [])
+
+
+def read_info(fp):
+    """Return the L{ImageInfo} of the image open, in binary mode, as C{fp}.
+    """
+
+    header = _read(fp, 0, _PROBE_SIZE)
+    magic = header[:4]
+    if magic == QCOW_MAGIC:
+        if struct.unpack(">I", header[4:8])[0] == 1:
+            return _qcow(fp, header)
+        return _qcow2(fp, header)
+    elif magic == COW_MAGIC:
+        return _cow(fp, header)
+    elif magic == QED_MAGIC:
+        return _qed(fp, header)
+    elif magic in (VMDK_MAGIC, COWD_MAGIC) or \
+            header.startswith(VMDK_DESCRIPTOR):
+        return _vmdk(fp, header)
+    elif header[:8] == VPC_COOKIE:
+        return _vpc(fp)
+    elif struct.unpack("<I", header[64:68])[0] == VDI_SIGNATURE:
+        return _vdi(fp, header)
+    elif header.startswith(CLOOP_MAGIC):
+        return _raw(fp, ImageFormat.CLOOP)
+    return _raw(fp, ImageFormat.RAW)
+
+
+_CACHE_SIZE = 256
+_cache = collections.OrderedDict()
+
+
+def clear_cache():
+    _cache.clear()
+
+
+def info(path):
+    """Return the L{ImageInfo} of the image at C{path}.
+
+    The result is cached until the file changes.
+
+    @raises: IOError, OSError if the file cannot be read.
+    """
+
+    with open(path, "rb") as fp:
+        st = os.fstat(fp.fileno())
+        key = (st.st_dev, st.st_ino)
+        stamp = (st.st_size, st.st_mtime)
+        try:
+            cached_stamp, result = _cache.pop(key)
+        except KeyError:
+            cached_stamp = result = None
+        if cached_stamp != stamp:
+            result = read_info(fp)
+        _cache[key] = (stamp, result)
+        if len(_cache) > _CACHE_SIZE:
+            _cache.popitem(last=False)
+        return result
+
+
+def backing_file(path):
+    """Return the backing file of the image at C{path} or C{None}."""
+
+    return info(path).backing_file
@@ -0,0 +1,378 @@
+# -*- test-case-name: virtualbricks.tests.test_jobs -*-
+# Virtualbricks - a vde/qemu gui written in python and GTK/Glade.
+# Copyright (C) 2018 Virtualbricks team
+
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+"""Background jobs: qemu-img and archive operations.
+
+The long operations on the disk images and on the archives are external
+processes run by a L{JobManager}. At most C{slots} jobs run at the same time
+and at most C{io_slots} of them are I/O bound, the others wait in a queue
+ordered by priority. A job can be cancelled while it is queued or running,
+its progress is parsed from the output of C{qemu-img -p} and the finished
+jobs are kept in a short history.
+
+L{run} has the same signature of C{utils.getProcessOutputAndValue} and its
+deferred fires with the same C{(out, err, code)} tuple, so it can replace it
+where a C{run} function is injected.
+"""
+
+import collections
+import itertools
+import os
+import re
+
+from twisted.internet import defer, error, protocol
+
+from virtualbricks import log, observable
+from virtualbricks._spawn import abspath_qemu
+
+
+__all__ = ["Job", "JobManager", "manager", "submit", "run", "qemu_img", "HIGH",
+           "NORMAL", "LOW", "QUEUED", "RUNNING", "DONE", "FAILED", "CANCELLED"]
+
+logger = log.Logger()
+job_started = log.Event("Job {id} started: {description}")
+job_ended = log.Event("Job {id} {state} in {elapsed:.1f}s: {description}")
+spawn_failed = log.Event("Cannot start job {id}: {description}")
+
+# Priorities, lower values run first.
+HIGH = 0
+NORMAL = 10
+LOW = 20
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+CANCELLED = "cancelled"
+
+# Maximum number of jobs running at the same time.
+SLOTS = 4
+# Maximum number of I/O bound jobs running at the same time.
+IO_SLOTS = 2
+# Number of finished jobs kept.
+HISTORY = 50
+# Seconds given to a cancelled job to terminate before it is killed.
+KILL_DELAY = 5.0
+
+# qemu-img -p writes "    (12.34/100%)\r" every time the progress changes.
+PROGRESS_RE = re.compile(br"\((\d+(?:\.\d+)?)/100%\)")
+
+
+class Job:
+    """An external process run by the L{JobManager}.
+
+    C{deferred} fires with the tuple C{(out, err, code)} when the process
+    exits, fails with C{defer.CancelledError} if the job is cancelled and
+    with C{error.ProcessTerminated} if the process is killed by a signal.
+
+    @ivar progress: the percentage of completion or C{None} if the process
+        does not report it.
+    """
+
+    transport = None
+    kill_call = None
+    started = None
+    ended = None
+    code = None
+    progress = None
+    cancelling = False
+
+    def __init__(self, job_id, executable, args=(), env={}, path=None,
+                 description=None, priority=NORMAL, io=True, created=None):
+        self.id = job_id
+        self.executable = executable
+        self.args = list(args)
+        self.env = env
+        self.path = path
+        self.description = description or " ".join(
+            [os.path.basename(executable)] + self.args)
+        self.priority = priority
+        self.io = io
+        self.state = QUEUED
+        self.created = created
+        self.deferred = None
+
+    def __repr__(self):
+        return "<Job {0} {1} {2!r}>".format(self.id, self.state,
+                                            self.description)
+
+    def is_finished(self):
+        return self.state in (DONE, FAILED, CANCELLED)
+
+    def elapsed(self, now):
+        """Return the seconds spent running, C{0} if not started yet."""
+
+        if self.started is None:
+            return 0.0
+        end = self.ended if self.ended is not None else now
+        return end - self.started
+
+
+class _JobProtocol(protocol.ProcessProtocol):
+
+    def __init__(self, job, manager):
+        self.job = job
+        self.manager = manager
+        self.out = []
+        self.err = []
+        self._tail = b""
+
+    def outReceived(self, data):
+        self.out.append(data)
+        self._parse(data)
+
+    def errReceived(self, data):
+        self.err.append(data)
+
+    def _parse(self, data):
+        data = self._tail + data
+        matches = PROGRESS_RE.findall(data)
+        # Keep the end of the chunk in case a progress line is split
+        self._tail = data[-32:]
+        if matches:
+            self.manager._progress(self.job, float(matches[-1]))
+
+    def processEnded(self, reason):
+        self.manager._ended(self.job, b"".join(self.out), b"".join(self.err),
+                            reason)
+
+
+class JobManager:
+    """Run the jobs in background, see the module documentation.
+
+    The observable events C{job-added}, C{job-changed} and C{job-removed}
+    are notified with the job when a job is submitted, when its state or
+    progress changes and when it leaves the history.
+    """
+
+    def __init__(self, slots=SLOTS, io_slots=IO_SLOTS, history=HISTORY,
+                 reactor=None):
+        self.slots = slots
+        self.io_slots = io_slots
+        self._reactor = reactor
+        self.history = collections.deque(maxlen=history)
+        self._ids = itertools.count(1)
+        self._queue = []
+        self._running = []
+        self.__observable = observable.Observable("job-added", "job-changed",
+                                                  "job-removed")
+
+    @property
+    def reactor(self):
+        # The default manager is created at import time, before the reactor
+        # is installed.
+        if self._reactor is None:
+            from twisted.internet import reactor
+            self._reactor = reactor
+        return self._reactor
+
+    def connect(self, name, callback, *args, **kwds):
+        self.__observable.add_observer(name, callback, args, kwds)
+
+    def disconnect(self, name, callback, *args, **kwds):
+        self.__observable.remove_observer(name, callback, args, kwds)
+
+    def configure(self, slots, io_slots):
+        """Change the number of slots, new jobs are started if possible."""
+
+        self.slots = max(slots, 1)
+        self.io_slots = max(io_slots, 1)
+        self._dispatch()
+
+    def submit(self, executable, args=(), env={}, path=None,
+               description=None, priority=NORMAL, io=True):
+        """Queue a new job.
+
+        @param io: C{True} if the job is I/O bound, at most C{io_slots} of
+            them run at the same time.
+        @return: the L{Job}.
+        """
+
+        job = Job(next(self._ids), executable, args, env, path, description,
+                  priority, io, self.reactor.seconds())
+        job.deferred = defer.Deferred(lambda _: self.cancel(job))
+        key = (job.priority, job.id)
+        for i, queued in enumerate(self._queue):
+            if (queued.priority, queued.id) > key:
+                self._queue.insert(i, job)
+                break
+        else:
+            self._queue.append(job)
+        self.__observable.notify("job-added", job)
+        self._dispatch()
+        return job
+
+    def run(self, executable, args=(), env={}, path=None, **kwds):
+        """Submit a job and return its deferred.
+
+        @see: L{submit} for the keyword arguments.
+        """
+
+        return self.submit(executable, args, env, path, **kwds).deferred
+
+    def _dispatch(self):
+        while self._queue and len(self._running) < self.slots:
+            io_running = sum(1 for job in self._running if job.io)
+            for i, job in enumerate(self._queue):
+                if not job.io or io_running < self.io_slots:
+                    break
+            else:
+                return
+            del self._queue[i]
+            self._start(job)
+
+    def _start(self, job):
+        proto = _JobProtocol(job, self)
+        try:
+            job.transport = self.reactor.spawnProcess(
+                proto, job.executable, [job.executable] + job.args, job.env,
+                job.path)
+        except Exception:
+            logger.failure(spawn_failed, id=job.id,
+                           description=job.description)
+            job.started = self.reactor.seconds()
+            self._finish(job, FAILED)
+            job.deferred.errback()
+            return
+        job.state = RUNNING
+        job.started = self.reactor.seconds()
+        self._running.append(job)
+        logger.info(job_started, id=job.id, description=job.description)
+        self.__observable.notify("job-changed", job)
+
+    def _progress(self, job, progress):
+        if progress != job.progress:
+            job.progress = progress
+            self.__observable.notify("job-changed", job)
+
+    def _ended(self, job, out, err, reason):
+        self._running.remove(job)
+        job.transport = None
+        if job.kill_call is not None and job.kill_call.active():
+            job.kill_call.cancel()
+        code = reason.value.exitCode
+        if job.cancelling:
+            self._finish(job, CANCELLED)
+            if not job.deferred.called:
+                job.deferred.errback(defer.CancelledError())
+        elif code is None:
+            self._finish(job, FAILED)
+            job.deferred.errback(reason)
+        else:
+            job.code = code
+            if code == 0:
+                job.progress = 100.0
+            self._finish(job, DONE if code == 0 else FAILED)
+            job.deferred.callback((out, err, code))
+        self._dispatch()
+
+    def _finish(self, job, state):
+        job.state = state
+        job.ended = self.reactor.seconds()
+        logger.info(job_ended, id=job.id, state=state,
+                    elapsed=job.elapsed(job.ended),
+                    description=job.description)
+        if len(self.history) == self.history.maxlen:
+            self.__observable.notify("job-removed", self.history[0])
+        self.history.append(job)
+        self.__observable.notify("job-changed", job)
+
+    def _kill(self, job):
+        if job.transport is not None:
+            try:
+                job.transport.signalProcess("KILL")
+            except error.ProcessExitedAlready:
+                pass
+
+    def cancel(self, job):
+        """Cancel a queued or a running job.
+
+        A running job is terminated and killed if it does not exit within
+        L{KILL_DELAY} seconds.
+
+        @param job: a L{Job} or its id.
+        @raise KeyError: if there is no such job.
+        """
+
+        if not isinstance(job, Job):
+            job = self.get(job)
+        if job.state == QUEUED:
+            self._queue.remove(job)
+            self._finish(job, CANCELLED)
+            if not job.deferred.called:
+                job.deferred.errback(defer.CancelledError())
+        elif job.state == RUNNING and not job.cancelling:
+            job.cancelling = True
+            try:
+                job.transport.signalProcess("TERM")
+            except error.ProcessExitedAlready:
+                pass
+            else:
+                job.kill_call = self.reactor.callLater(KILL_DELAY, self._kill,
+                                                       job)
+
+    def cancel_all(self):
+        """Cancel all the queued and running jobs."""
+
+        for job in self._queue[::-1] + self._running:
+            self.cancel(job)
+
+    def get(self, job_id):
+        for job in self.jobs():
+            if job.id == job_id:
+                return job
+        raise KeyError(job_id)
+
+    def jobs(self):
+        """Return all the known jobs: the finished ones, then the running and
+        the queued ones in the order in which they are run."""
+
+        return list(self.history) + self._running + self._queue
+
+    def queued(self):
+        return list(self._queue)
+
+    def running(self):
+        return list(self._running)
+
+
+manager = JobManager()
+
+
+def submit(executable, args=(), env={}, path=None, **kwds):
+    """Submit a job to the default L{manager}, see L{JobManager.submit}."""
+
+    return manager.submit(executable, args, env, path, **kwds)
+
+
+def run(executable, args=(), env={}, path=None, **kwds):
+    """Run a job with the default L{manager}, see L{JobManager.run}."""
+
+    return manager.run(executable, args, env, path, **kwds)
+
+
+def qemu_img(args, env=None, **kwds):
+    """Submit C{qemu-img} from the configured qemu path as a job.
+
+    @return: the L{Job}.
+    """
+
+    if env is None:
+        env = os.environ
+    kwds.setdefault("description", " ".join(["qemu-img"] + list(args)))
+    return submit(abspath_qemu("qemu-img"), args, env, **kwds)
@@ -0,0 +1,442 @@
+# -*- test-case-name: virtualbricks.tests.test_journal -*-
+# Virtualbricks - a vde/qemu gui written in python and GTK/Glade.
+# Copyright (C) 2018 Virtualbricks team
+
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+"""The journal of the changes to a project.
+
+The changes to the bricks, the links, the images and the events are
+appended to C{.project.journal}, next to the project file, when they
+happen. A record holds the new state of one object, a brick with its
+options, its socks and its plugs, or the removal or the renaming of a name:
+
+    ("brick", name, type, options, socks, links)
+    ("event", name, options)
+    ("image", name, path)
+    ("remove", name)
+    ("rename", old, new)
+
+The changes are grouped: the objects changed within C{delay} seconds are
+written with a single write and a single fsync, in a thread (group commit).
+
+The records are idempotent, L{replay} applies them to the state returned by
+L{snapshot.state} and gives the same project even if the project file was
+saved after the first records. When the journal grows the autosave saves
+the project file and the journal is compacted: only the records appended
+after the state was taken are kept (see L{Journal.mark}).
+
+The file starts with a magic string and every record is framed:
+
+    length (4 bytes) | crc32 (4 bytes) | marshal of the record
+
+A torn record at the end of the file, after a crash, ends the journal.
+"""
+
+import collections
+import errno
+import marshal
+import os
+import struct
+import time
+import zlib
+
+from twisted.internet import defer, threads
+
+from virtualbricks import base, link, log, snapshot, virtualmachines, watchdog
+
+
+__all__ = ["DELAY", "Journal", "SIZE_LIMIT", "SUFFIX", "encode", "filename",
+           "read", "replay"]
+
+logger = log.Logger()
+cannot_write = log.Event("Cannot write the journal {path}")
+cannot_read = log.Event("Cannot read the journal {path}")
+truncated = log.Event("Discarded {size} bytes at the end of the journal "
+                      "{path}")
+compacted = log.Event("Compacted the journal {path} to {size} bytes")
+
+MAGIC = b"VBJRNL\x00\x01"
+SUFFIX = ".journal"
+# Seconds the changes wait for other changes before they are written.
+DELAY = 0.1
+# Bytes after which the journal is folded in the project file.
+SIZE_LIMIT = 1 << 20
+_FRAME = struct.Struct(">II")
+
+
+def filename(path):
+    """Return the path of the journal of the project file C{path}."""
+
+    return path + SUFFIX
+
+
+def encode(record):
+    data = marshal.dumps(record)
+    return _FRAME.pack(len(data), zlib.crc32(data) & 0xffffffff) + data
+
+
+def _scan(data):
+    # Yield the records and the offset after each of them, stop at the first
+    # torn or corrupted record.
+    offset = len(MAGIC)
+    while offset + _FRAME.size <= len(data):
+        length, crc = _FRAME.unpack_from(data, offset)
+        start = offset + _FRAME.size
+        body = data[start:start + length]
+        if len(body) != length or zlib.crc32(body) & 0xffffffff != crc:
+            return
+        try:
+            record = marshal.loads(body)
+        except (EOFError, ValueError, TypeError):
+            return
+        offset = start + length
+        yield record, offset
+
+
+def _load(path):
+    # Return the records and the end of the last one, the end is zero if the
+    # file does not exist or is not a journal.
+    try:
+        with open(path, "rb") as fp:
+            data = fp.read()
+    except (IOError, OSError) as e:
+        if e.errno != errno.ENOENT:
+            logger.warn(cannot_read, path=path, hide_to_user=True)
+        return [], 0
+    if not data.startswith(MAGIC):
+        if data:
+            logger.warn(cannot_read, path=path, hide_to_user=True)
+        return [], 0
+    records = []
+    end = len(MAGIC)
+    for record, end in _scan(data):
+        records.append(record)
+    return records, end
+
+
+def read(path):
+    """Return the records of the journal C{path}, an empty list if there is
+    no journal."""
+
+    return _load(path)[0]
+
+
+def replay(state, records):
+    """Apply C{records} to C{state}, as returned by L{snapshot.state}, and
+    return the new state."""
+
+    images, events, bricks, socks, links = state
+    images = collections.OrderedDict(images)
+    events = collections.OrderedDict(events)
+    bricks = collections.OrderedDict((name, (type, options))
+                                     for type, name, options in bricks)
+    socks_of = collections.defaultdict(list)
+    for owner, nickname, model, mac in socks:
+        socks_of[owner].append((nickname, model, mac))
+    links_of = collections.defaultdict(list)
+    for owner, sockname, model, mac in links:
+        links_of[owner].append((sockname, model, mac))
+    tables = {"image": images, "event": events, "brick": bricks}
+    for record in records:
+        kind, name = record[:2]
+        if kind == "rename":
+            _rename(tables, socks_of, links_of, name, record[2])
+            continue
+        # The names are unique among the bricks, the events and the images,
+        # a record replaces the object with the same name, whatever it is.
+        for other, table in tables.items():
+            if other != kind:
+                table.pop(name, None)
+        if kind == "image":
+            images[name] = record[2]
+        elif kind == "event":
+            events[name] = record[2]
+        elif kind == "brick":
+            bricks[name] = record[2:4]
+            socks_of[name] = record[4]
+            links_of[name] = record[5]
+    return ([(name, path) for name, path in images.items()],
+            [(name, options) for name, options in events.items()],
+            [(type, name, options)
+             for name, (type, options) in bricks.items()],
+            [(name, ) + sock for name in bricks for sock in socks_of[name]],
+            [(name, ) + plug for name in bricks for plug in links_of[name]])
+
+
+def _rename(tables, socks_of, links_of, old, new):
+    # Keep the position of the renamed object, the object itself is recorded
+    # right after.
+    for table in tables.values():
+        if old in table and not any(new in other
+                                    for other in tables.values()):
+            items = [(new if name == old else name, value)
+                     for name, value in table.items()]
+            table.clear()
+            table.update(items)
+            socks_of[new] = socks_of.pop(old, [])
+            links_of[new] = links_of.pop(old, [])
+            return
+        table.pop(old, None)
+
+
+def _record(factory, obj):
+    # Return the record of the current state of obj or None if obj is not in
+    # the project anymore.
+    name = obj.name
+    if factory.get_brick_by_name(name) is obj:
+        return ("brick", name, obj.get_type(), base.saved_options(obj),
+                snapshot.brick_socks(obj), snapshot.brick_links(obj))
+    elif factory.get_event_by_name(name) is obj:
+        return ("event", name, base.saved_options(obj))
+    elif factory.get_image_by_name(name) is obj:
+        return ("image", name, obj.path)
+    return None
+
+
+class Journal:
+    """Append the changes to the project of C{factory} to the journal
+    C{path}.
+
+    @ivar size: the size of the journal file.
+    @ivar commits: the number of group commits.
+    @ivar records: the number of records written.
+    @ivar latency: a L{watchdog.Histogram} of the time to write and sync a
+        group of records.
+    """
+
+    _call = None
+    _mark = None
+
+    def __init__(self, factory, path, delay=DELAY, size_limit=SIZE_LIMIT,
+                 on_full=None, clock=None, timer=time.time,
+                 defer_to_thread=threads.deferToThread, fsync=os.fsync):
+        """
+        @param on_full: called without arguments when the journal should be
+            folded in the project file: it is larger than C{size_limit} or
+            some changes could not be written.
+        """
+
+        if clock is None:
+            from twisted.internet import reactor as clock
+        self.factory = factory
+        self.path = path
+        self.delay = delay
+        self.size_limit = size_limit
+        self.on_full = on_full
+        self.clock = clock
+        self.timer = timer
+        self.defer_to_thread = defer_to_thread
+        self.fsync = fsync
+        self.size = 0
+        self.commits = 0
+        self.records = 0
+        self.latency = watchdog.Histogram()
+        self._touched = collections.OrderedDict()
+        self._renamed = []
+        # The encoded records not written yet, with their sequence number
+        self._pending = []
+        self._seq = 0
+        # The records written after the mark, kept by the compaction
+        self._kept = []
+        # The writes and the compactions are done one at a time, in order
+        self._queue = defer.DeferredLock()
+
+    def open(self):
+        """Attach the journal to the factory, the project must be already
+        restored. A torn record at the end of the journal is discarded."""
+
+        end = _load(self.path)[1]
+        try:
+            size = os.path.getsize(self.path)
+        except OSError:
+            size = 0
+        if end < size:
+            logger.warn(truncated, path=self.path, size=size - end,
+                        hide_to_user=True)
+            with open(self.path, "r+b") as fp:
+                fp.truncate(end)
+        self.size = end
+        self.factory.journal = self
+
+    def close(self):
+        """Detach the journal from the factory and write the pending
+        changes.
+
+        @return: a deferred that fires when they are on disk.
+        """
+
+        if self.factory.journal is self:
+            self.factory.journal = None
+        return self.commit()
+
+    def touch(self, obj):
+        """Record the new state of C{obj}: a brick, an event, an image, a sock
+        or a sequence of them. If C{obj} is not in the project anymore its
+        removal is recorded."""
+
+        if isinstance(obj, (list, tuple)):
+            for item in obj:
+                self.touch(item)
+            return
+        if isinstance(obj, link.Sock):
+            # The plugs refer to the socks by name
+            self.touch(obj.brick)
+            self.touch([plug.brick for plug in obj.plugs])
+            return
+        if isinstance(obj, virtualmachines.Image):
+            # The disks refer to the images by name
+            for brick in self.factory.bricks:
+                if (virtualmachines.is_virtualmachine(brick) and
+                        any(disk.image is obj for disk in brick.disks())):
+                    self._touched[brick] = None
+        self._touched[obj] = None
+        self._schedule()
+
+    def renamed(self, obj, old):
+        """Record that C{obj} is not called C{old} anymore."""
+
+        self._renamed.append((old, obj))
+        self.touch(obj)
+
+    def _schedule(self):
+        if self._call is None:
+            self._call = self.clock.callLater(self.delay, self.commit)
+
+    def _encode(self):
+        factory = self.factory
+        # Only the names that are free now are removed or renamed, the others
+        # are taken by the objects recorded later.
+        removed = []
+        for old, obj in self._renamed:
+            if not factory.is_in_use(old):
+                if obj in self._touched and _record(factory, obj):
+                    removed.append(("rename", old, obj.name))
+                else:
+                    removed.append(("remove", old))
+        records = []
+        for obj in self._touched:
+            record = _record(factory, obj)
+            if record is not None:
+                records.append(record)
+            elif not factory.is_in_use(obj.name):
+                removed.append(("remove", obj.name))
+        self._renamed = []
+        self._touched.clear()
+        for record in removed + records:
+            self._seq += 1
+            self._pending.append((self._seq, encode(record)))
+
+    def commit(self):
+        """Write the pending changes now.
+
+        @return: a deferred that fires when they are on disk.
+        """
+
+        if self._call is not None and self._call.active():
+            self._call.cancel()
+        self._call = None
+        self._encode()
+        return self._queue.run(self._flush)
+
+    def _flush(self):
+        pending, self._pending = self._pending, []
+        if not pending:
+            return defer.succeed(None)
+        if self._mark is not None:
+            self._kept.extend(frame for seq, frame in pending
+                              if seq > self._mark)
+        start = self.timer()
+        d = self.defer_to_thread(self._append,
+                                 b"".join(frame for _, frame in pending))
+        d.addCallbacks(self._committed, self._failed, (len(pending), start))
+        return d
+
+    def _append(self, data):
+        # Called in a thread
+        with open(self.path, "ab") as fp:
+            if fp.tell() == 0:
+                fp.write(MAGIC)
+            fp.write(data)
+            fp.flush()
+            self.fsync(fp.fileno())
+            return fp.tell()
+
+    def _committed(self, size, count, start):
+        self.size = size
+        self.commits += 1
+        self.records += count
+        self.latency.add(self.timer() - start)
+        if self.is_full():
+            self._full()
+
+    def _failed(self, fail):
+        logger.failure(cannot_write, fail, path=self.path)
+        self._full()
+
+    def _full(self):
+        # The save is not waited: it compacts the journal, that waits for
+        # this write.
+        if self.on_full is not None:
+            self.on_full()
+
+    def is_full(self):
+        return self.size > self.size_limit
+
+    def mark(self):
+        """Mark the changes included in the state that is going to be saved,
+        call it right before L{snapshot.state}. L{compact} keeps only the
+        changes recorded after the mark."""
+
+        self._encode()
+        self._mark = self._seq
+        self._kept = []
+
+    def compact(self):
+        """Fold the journal in the project file just saved.
+
+        @return: a deferred that fires when the journal is rewritten.
+        """
+
+        return self._queue.run(self._compact)
+
+    def _compact(self):
+        if self._mark is None:
+            return defer.succeed(None)
+        data = b"".join(self._kept)
+        self._mark = None
+        self._kept = []
+        d = self.defer_to_thread(self._rewrite, data)
+        d.addCallbacks(self._compacted, logger.failure_eb,
+                       errbackArgs=(cannot_write, ),
+                       errbackKeywords={"path": self.path})
+        return d
+
+    def _rewrite(self, data):
+        # Called in a thread. If the journal cannot be rewritten the old one
+        # is still valid.
+        tmp = self.path + ".tmp"
+        with open(tmp, "wb") as fp:
+            fp.write(MAGIC)
+            fp.write(data)
+            fp.flush()
+            self.fsync(fp.fileno())
+            size = fp.tell()
+        os.rename(tmp, self.path)
+        return size
+
+    def _compacted(self, size):
+        self.size = size
+        logger.debug(compacted, path=self.path, size=size)
@@ -36,15 +36,17 @@ link_loop = log.Event("Loop link detected: aborting operation. If you want "
 
 class Plug:
 
-    sock = None
-    _antiloop = False
+    # There is a plug for every network card, keep them small
+    __slots__ = ("brick", "sock", "_antiloop", "model", "mac")
     mode = "vde"
     logger = log.Logger()
-    model = ""
-    mac = ""
 
     def __init__(self, brick):
         self.brick = brick
+        self.sock = None
+        self._antiloop = False
+        self.model = ""
+        self.mac = ""
 
     def configured(self):
         return self.sock is not None
@@ -79,13 +81,17 @@ class Plug:
         assert sock is not None, "Cannot connect a plug to nothing"
         sock.plugs.append(self)
         self.sock = sock
+        self.brick.factory.graph.link(self)
+        self.brick.factory.mark_dirty(self.brick)
 
     def disconnect(self):
         assert self.sock is not None, "Plug not connected"
         assert self in self.sock.plugs, \
                 "sock %r has not reference to %r" % (self.sock, self)
+        self.brick.factory.graph.unlink(self)
         self.sock.plugs.remove(self)
         self.sock = None
+        self.brick.factory.mark_dirty(self.brick)
 
     def save_to(self, fileobj):
         tmp = "link|{0.brick.name}|{1}|{0.model}|{0.mac}\n"
@@ -95,12 +101,14 @@ class Plug:
 
 class Sock:
 
+    __slots__ = ("brick", "path", "nickname", "plugs", "model", "mac")
+    mode = "sock"
+
     def __init__(self, brick, name=""):
         self.brick = brick
         self.path = name
         self.nickname = name
         self.plugs = []
-        self.mode = "sock"
 
     def get_free_ports(self):
         return self.brick.config["numports"] - len(self.plugs)
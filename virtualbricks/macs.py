@@ -0,0 +1,158 @@
+# -*- test-case-name: virtualbricks.tests.test_macs -*-
+# Virtualbricks - a vde/qemu gui written in python and GTK/Glade.
+# Copyright (C) 2018 Virtualbricks team
+
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+"""Allocation of the MAC addresses of the virtual machines' network cards.
+
+Addresses are generated under the C{00:aa} prefix and are unique in a
+project: the allocator keeps the index of the addresses in use, the ones
+generated and the ones loaded from the project file.
+"""
+
+import random
+
+from virtualbricks import log
+
+
+__all__ = ["PREFIX", "MacAllocator", "parse", "format_mac"]
+
+logger = log.Logger()
+duplicate_mac = log.Event("MAC address {mac} is used more than once")
+space_exhausted = log.Event("No free MAC address left under {prefix}")
+
+PREFIX = 0x00aa << 32
+SPACE = 1 << 32
+
+
+def parse(mac):
+    """Return the MAC address as an integer.
+
+    @raises ValueError: if C{mac} is not a valid MAC address.
+    """
+
+    try:
+        parts = mac.split(":")
+        if len(parts) == 6 and all(len(p) == 2 for p in parts):
+            return int("".join(parts), 16)
+    except (AttributeError, ValueError):
+        pass
+    raise ValueError("Invalid MAC address %r" % (mac, ))
+
+
+def format_mac(value):
+    return ":".join("{0:02x}".format((value >> s) & 0xff)
+                    for s in range(40, -8, -8))
+
+
+class MacAllocator:
+    """Collision-free allocator of MAC addresses.
+
+    Without a seed the addresses are random. With a seed the sequence of the
+    generated addresses depends only on the seed and on the addresses
+    reserved, regenerating the same lab gives the same addresses.
+    """
+
+    def __init__(self, seed=None):
+        self.reset(seed)
+
+    def reset(self, seed=None):
+        """Forget all the addresses and restart the generator."""
+
+        self.seed = seed
+        self._random = random.Random(seed)
+        self._used = set()
+
+    def __contains__(self, mac):
+        try:
+            return parse(mac) in self._used
+        except ValueError:
+            return False
+
+    def __len__(self):
+        return len(self._used)
+
+    def generate(self):
+        """Return a free address, without reserving it."""
+
+        if len(self._used) >= SPACE:
+            logger.error(space_exhausted, prefix=format_mac(PREFIX)[:5])
+            raise ValueError("MAC address space exhausted")
+        getrandbits = self._random.getrandbits
+        while True:
+            value = PREFIX | getrandbits(32)
+            if value not in self._used:
+                return format_mac(value)
+
+    def allocate(self):
+        """Return a new, reserved, address."""
+
+        mac = self.generate()
+        self._used.add(parse(mac))
+        return mac
+
+    def allocate_many(self, count):
+        """Return a list of C{count} new, reserved, addresses."""
+
+        return [self.allocate() for _ in range(count)]
+
+    def reserve(self, mac):
+        """Mark an address as in use.
+
+        Reserving an address already reserved is allowed, it happens when an
+        address is reserved before the objects using it are created.
+
+        @return: C{False} if the address was already reserved.
+        @raises ValueError: if C{mac} is not a valid MAC address.
+        """
+
+        value = parse(mac)
+        if value in self._used:
+            return False
+        self._used.add(value)
+        return True
+
+    def reserve_all(self, macs):
+        """Reserve many addresses at once, duplicates are logged.
+
+        @return: the set of the duplicated addresses.
+        """
+
+        duplicates = set()
+        for mac in macs:
+            try:
+                if not self.reserve(mac):
+                    duplicates.add(mac)
+            except ValueError:
+                pass
+        for mac in sorted(duplicates):
+            logger.warn(duplicate_mac, mac=mac)
+        return duplicates
+
+    def release(self, mac):
+        """Mark an address as free again."""
+
+        try:
+            self._used.discard(parse(mac))
+        except ValueError:
+            pass
+
+    def replace(self, old, new):
+        """Release C{old} and reserve C{new}."""
+
+        if old != new:
+            self.reserve(new)
+            self.release(old)
@@ -1,12 +1,23 @@
+# -*- test-case-name: virtualbricks.tests.test_observable -*-
 # Virtualbricks - a vde/qemu gui written in python and GTK/Glade.
 # Copyright (C) 2018 Virtualbricks team
 
+import collections
+
+
 class Observable:
 
     thawed = False
+    # Number of notifications dropped because they duplicated a pending one
+    # while batching.
+    suppressed = 0
 
     def __init__(self, *names):
         self.__events = {}
+        self.__batch_depth = 0
+        # Created by the first batch, most observables never batch
+        self.__pending = None
+        self.__delayed = None
         for name in names:
             self.add_event(name)
 
@@ -35,9 +46,61 @@ class Observable:
     def notify(self, name, emitter):
         if name not in self.__events:
             raise ValueError("Event %s not present" % name)
-        if not self.thawed:
-            for callback, args, kwds in self.__events[name]:
-                callback(emitter, *args, **kwds)
+        if self.thawed:
+            return
+        if self.__batch_depth:
+            key = (name, id(emitter))
+            if key in self.__pending:
+                self.suppressed += 1
+            else:
+                self.__pending[key] = (name, emitter)
+        else:
+            self._deliver(name, emitter)
+
+    def _deliver(self, name, emitter):
+        for callback, args, kwds in list(self.__events[name]):
+            callback(emitter, *args, **kwds)
+
+    def begin_batch(self):
+        """Start collecting the notifications instead of delivering them.
+
+        Batches can be nested, the notifications are delivered when the
+        outermost batch is committed. While batching, a notification of an
+        event already pending for the same emitter is suppressed.
+        """
+
+        if self.__pending is None:
+            self.__pending = collections.OrderedDict()
+        self.__batch_depth += 1
+
+    def commit_batch(self, delay=None, clock=None):
+        """Close a batch and deliver the pending notifications.
+
+        If C{delay} is not C{None}, the delivery is debounced: the batch is
+        kept open for other C{delay} seconds, and every commit that happens in
+        the meantime restarts the timer.
+        """
+
+        if self.__batch_depth == 0:
+            raise RuntimeError("No batch to commit")
+        if delay is not None:
+            if self.__delayed is not None and self.__delayed.active():
+                self.__batch_depth -= 1
+                self.__delayed.reset(delay)
+            else:
+                if clock is None:
+                    from twisted.internet import reactor as clock
+                self.__delayed = clock.callLater(delay, self.commit_batch)
+            return
+        self.__batch_depth -= 1
+        if self.__batch_depth == 0:
+            self.__delayed = None
+            while self.__pending:
+                _, (name, emitter) = self.__pending.popitem(last=False)
+                self._deliver(name, emitter)
+
+    def is_batching(self):
+        return self.__batch_depth > 0
 
     def __len__(self):
         return len(self.__events)
@@ -63,6 +126,30 @@ class Event:
         self.__observable.remove_observer(self.__name, callback, (), {})
 
 
+class batch:
+    """Context manager that coalesces the notifications of an observable.
+
+    The number of notifications suppressed during the batch is available as
+    C{suppressed} when the context manager exits.
+    """
+
+    suppressed = 0
+
+    def __init__(self, observable, delay=None, clock=None):
+        self.observable = observable
+        self.delay = delay
+        self.clock = clock
+
+    def __enter__(self):
+        self._start = self.observable.suppressed
+        self.observable.begin_batch()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.suppressed = self.observable.suppressed - self._start
+        self.observable.commit_batch(self.delay, self.clock)
+
+
 class thaw:
 
     def __init__(self, observable):
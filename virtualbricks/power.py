@@ -0,0 +1,332 @@
+# -*- test-case-name: virtualbricks.tests.test_power -*-
+# Virtualbricks - a vde/qemu gui written in python and GTK/Glade.
+# Copyright (C) 2018 Virtualbricks team
+
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+"""Start and stop many bricks at once following the topology.
+
+A brick depends on the bricks that own the socks its plugs are connected to:
+a virtual machine plugged into a switch depends on the switch. Bricks are
+started only when all their dependencies are up, bricks with no pending
+dependencies are started in parallel.
+"""
+
+import collections
+
+from twisted.internet import defer, error
+from twisted.python import failure
+
+from virtualbricks import errors, log
+
+
+__all__ = ["MAX_PARALLEL", "GRACEFUL_TIMEOUT", "KILL_TIMEOUT",
+           "PoweronResult", "PoweroffResult", "dependencies",
+           "dependency_graph", "sort", "poweron_all", "poweroff",
+           "poweroff_all"]
+
+logger = log.Logger()
+start_failed = log.Event("Cannot start {brick}")
+loop_detected = log.Event("Loop detected, cannot start {bricks}")
+escalate = log.Event("{brick} still running after {timeout}s, sending "
+                     "SIG{signal}")
+straggler = log.Event("{brick} still running after SIGKILL")
+stop_failed = log.Event("Error while stopping {brick}")
+
+MAX_PARALLEL = 16
+# Seconds to wait for a brick to stop by itself, before sending a SIGTERM.
+# Virtual machines receive an ACPI powerdown and need more time.
+GRACEFUL_TIMEOUT = {"Qemu": 60.0}
+DEFAULT_GRACEFUL_TIMEOUT = 5.0
+# Seconds to wait after each signal before escalating.
+KILL_TIMEOUT = 5.0
+
+PoweronResult = collections.namedtuple("PoweronResult",
+                                       ["brick", "elapsed", "failure"])
+PoweroffResult = collections.namedtuple("PoweroffResult",
+                                        ["brick", "elapsed", "signal",
+                                         "stopped"])
+
+
+def dependencies(brick):
+    """Return the bricks that must be running before C{brick} can start."""
+
+    return brick.factory.graph.dependencies(brick)
+
+
+def dependency_graph(bricks):
+    """Return a dict that maps each brick to the set of its dependencies.
+
+    The graph contains C{bricks} and, recursively, all their dependencies.
+    """
+
+    graph = {}
+    stack = list(bricks)
+    while stack:
+        brick = stack.pop()
+        if brick not in graph:
+            graph[brick] = deps = set(dependencies(brick))
+            stack.extend(deps)
+    return graph
+
+
+def sort(graph):
+    """Sort topologically the dependency graph.
+
+    Return a tuple of two elements. The first is the list of waves: the bricks
+    in a wave depend only on bricks of the previous waves. The second is the
+    set of the bricks that are part of a loop or that depend on a loop, these
+    cannot be sorted.
+    """
+
+    pending = dict((brick, len(deps)) for brick, deps in graph.items())
+    dependents = dict((brick, []) for brick in graph)
+    for brick, deps in graph.items():
+        for dep in deps:
+            dependents[dep].append(brick)
+    wave = [brick for brick, count in pending.items() if count == 0]
+    waves = []
+    while wave:
+        waves.append(wave)
+        next_wave = []
+        for brick in wave:
+            del pending[brick]
+            for dependent in dependents[brick]:
+                pending[dependent] -= 1
+                if pending[dependent] == 0:
+                    next_wave.append(dependent)
+        wave = next_wave
+    return waves, set(pending)
+
+
+class _Poweron:
+
+    def __init__(self, graph, max_parallel, clock):
+        self.graph = graph
+        self.clock = clock
+        self.semaphore = defer.DeferredSemaphore(max_parallel)
+        self.pending = dict((brick, len(deps)) for brick, deps
+                            in graph.items())
+        self.dependents = dict((brick, []) for brick in graph)
+        for brick, deps in graph.items():
+            for dep in deps:
+                self.dependents[dep].append(brick)
+        self.results = []
+        self.done = defer.Deferred()
+
+    def start(self):
+        waves, looped = sort(self.graph)
+        if looped:
+            graph = next(iter(looped)).factory.graph
+            loop = graph.find_cycle(looped) or looped
+            logger.error(loop_detected,
+                         bricks=lambda: ", ".join(b.name for b in loop))
+            for brick in looped:
+                self._add_result(brick, 0.0,
+                                 failure.Failure(errors.LinkLoopError()))
+        if waves:
+            for brick in waves[0]:
+                self._start(brick)
+        else:
+            self._check_done()
+        return self.done
+
+    def _start(self, brick):
+
+        def poweron():
+            started = self.clock.seconds()
+            d = defer.maybeDeferred(brick.poweron)
+            d.addBoth(lambda result: (self.clock.seconds() - started, result))
+            return d
+
+        self.semaphore.run(poweron).addCallback(self._started, brick)
+
+    def _started(self, elapsed_result, brick):
+        elapsed, result = elapsed_result
+        if isinstance(result, failure.Failure):
+            logger.failure(start_failed, result, brick=brick.name)
+            self._add_result(brick, elapsed, result)
+            self._skip_dependents(brick, result)
+        else:
+            self._add_result(brick, elapsed, None)
+            for dependent in self.dependents[brick]:
+                if dependent in self.pending:
+                    self.pending[dependent] -= 1
+                    if self.pending[dependent] == 0:
+                        self._start(dependent)
+        self._check_done()
+
+    def _skip_dependents(self, brick, fail):
+        stack = list(self.dependents[brick])
+        while stack:
+            dependent = stack.pop()
+            if self.pending.pop(dependent, None) is not None:
+                self._add_result(dependent, 0.0, fail)
+                stack.extend(self.dependents[dependent])
+
+    def _add_result(self, brick, elapsed, fail):
+        self.pending.pop(brick, None)
+        self.results.append(PoweronResult(brick, elapsed, fail))
+
+    def _check_done(self):
+        if len(self.results) == len(self.graph) and not self.done.called:
+            self.done.callback(self.results)
+
+
+def poweron_all(bricks, max_parallel=MAX_PARALLEL, clock=None):
+    """Start all the bricks and their dependencies.
+
+    A brick is started as soon as all its dependencies are running, at most
+    C{max_parallel} bricks are starting at the same time. If a brick cannot be
+    started, the bricks that depend on it are not started.
+
+    @return: a deferred that fires, when all the bricks are processed, with a
+        list of L{PoweronResult}, one for each brick, in completion order.
+        C{elapsed} is the time in seconds taken by the brick to start and
+        C{failure} is C{None} on success or the reason of the failure.
+    """
+
+    if clock is None:
+        from twisted.internet import reactor as clock
+    return _Poweron(dependency_graph(bricks), max_parallel, clock).start()
+
+
+class _Poweroff:
+
+    call = None
+
+    def __init__(self, brick, timeout, kill_timeout, clock):
+        self.brick = brick
+        self.signal = getattr(brick, "poweroff_signal", None)
+        self.timeout = timeout
+        self.kill_timeout = kill_timeout
+        self.clock = clock
+        self.done = defer.Deferred()
+
+    def start(self):
+        self.started = self.clock.seconds()
+        signal = "KILL" if self.signal == "TERM" else "TERM"
+        self.call = self.clock.callLater(self.timeout, self._send, signal,
+                                         self.timeout)
+        defer.maybeDeferred(self.brick.poweroff).addBoth(self._stopped)
+        return self.done
+
+    def _stopped(self, result):
+        if isinstance(result, failure.Failure):
+            logger.failure(stop_failed, result, brick=self.brick.name)
+        if not self.brick.__isrunning__():
+            self._done(True)
+        # else wait for the escalation
+
+    def _send(self, signal, elapsed):
+        if not self.brick.__isrunning__():
+            return self._done(True)
+        logger.warn(escalate, brick=self.brick.name, timeout=elapsed,
+                    signal=signal)
+        self.signal = signal
+        try:
+            self.brick.send_signal(signal)
+        except error.ProcessExitedAlready:
+            pass
+        if signal == "TERM":
+            self.call = self.clock.callLater(self.kill_timeout, self._send,
+                                             "KILL", self.kill_timeout)
+        else:
+            self.call = self.clock.callLater(self.kill_timeout,
+                                             self._give_up)
+
+    def _give_up(self):
+        if self.brick.__isrunning__():
+            logger.error(straggler, brick=self.brick.name)
+        self._done(not self.brick.__isrunning__())
+
+    def _done(self, stopped):
+        if self.call is not None and self.call.active():
+            self.call.cancel()
+        if not self.done.called:
+            elapsed = self.clock.seconds() - self.started
+            self.done.callback(PoweroffResult(self.brick, elapsed, self.signal,
+                                              stopped))
+
+
+def poweroff(brick, timeout=None, kill_timeout=KILL_TIMEOUT, clock=None):
+    """Stop a brick, escalating to SIGTERM and then to SIGKILL.
+
+    The brick is asked to stop with C{poweroff()}. If it is still running after
+    C{timeout} seconds (by default L{GRACEFUL_TIMEOUT} for its type) a SIGTERM
+    is sent, and after other C{kill_timeout} seconds a SIGKILL. The bricks
+    whose C{poweroff()} already sends a SIGTERM, see C{poweroff_signal},
+    receive the SIGKILL after C{timeout} seconds. If the brick is still
+    running C{kill_timeout} seconds after the SIGKILL it is reported as a
+    straggler.
+
+    @return: a deferred that fires with a L{PoweroffResult}. C{signal} is the
+        last signal sent, C{None} if the brick stopped gracefully, and
+        C{stopped} is C{False} for stragglers.
+    """
+
+    if clock is None:
+        from twisted.internet import reactor as clock
+    if timeout is None:
+        timeout = GRACEFUL_TIMEOUT.get(brick.get_type(),
+                                       DEFAULT_GRACEFUL_TIMEOUT)
+    return _Poweroff(brick, timeout, kill_timeout, clock).start()
+
+
+def poweroff_all(bricks, max_parallel=MAX_PARALLEL, timeouts=None,
+                 kill_timeout=KILL_TIMEOUT, clock=None):
+    """Stop all the running bricks, consumers first and providers last.
+
+    The bricks are stopped in waves: a brick is stopped after all the bricks
+    that depend on it, for example virtual machines and wires are stopped
+    before the switches they are plugged in. The bricks of a wave are stopped
+    in parallel, at most C{max_parallel} at the same time, with L{poweroff}.
+    Bricks part of a loop are stopped in a last wave.
+
+    @param timeouts: a dict that maps brick types to graceful timeouts,
+        overrides L{GRACEFUL_TIMEOUT}.
+    @return: a deferred that fires with a list of L{PoweroffResult}, one for
+        each running brick.
+    """
+
+    if clock is None:
+        from twisted.internet import reactor as clock
+    graceful = dict(GRACEFUL_TIMEOUT)
+    if timeouts:
+        graceful.update(timeouts)
+    running = [brick for brick in bricks if brick.__isrunning__()]
+    dependents = collections.OrderedDict((brick, set()) for brick in running)
+    for brick in running:
+        for dep in dependencies(brick):
+            if dep in dependents:
+                dependents[dep].add(brick)
+    waves, looped = sort(dependents)
+    if looped:
+        waves.append(list(looped))
+    semaphore = defer.DeferredSemaphore(max_parallel)
+    results = []
+
+    def stop(brick):
+        timeout = graceful.get(brick.get_type(), DEFAULT_GRACEFUL_TIMEOUT)
+        return poweroff(brick, timeout, kill_timeout, clock)
+
+    def stop_wave(_, wave):
+        dl = [semaphore.run(stop, brick) for brick in wave]
+        return defer.gatherResults(dl).addCallback(results.extend)
+
+    d = defer.succeed(None)
+    for wave in waves:
+        d.addCallback(stop_wave, wave)
+    return d.addCallback(lambda _: results)
@@ -0,0 +1,268 @@
+# -*- test-case-name: virtualbricks.tests.test_procstat -*-
+# Virtualbricks - a vde/qemu gui written in python and GTK/Glade.
+# Copyright (C) 2018 Virtualbricks team
+
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+"""Resource accounting of the running bricks.
+
+The L{Sampler} periodically reads C{/proc/<pid>/stat}, C{status}, C{io} and
+C{sched} of the process of every running brick, and of its children when the
+brick is started with sudo, and keeps a rolling window of L{BrickStats} for
+every brick.
+"""
+
+import collections
+import os
+import time
+
+from virtualbricks import log
+
+
+__all__ = ["ProcSample", "BrickStats", "read_sample", "Sampler"]
+
+logger = log.Logger()
+slow_sampling = log.Event("Sampling took {cost:.3f}s, interval raised to "
+                          "{interval:.1f}s")
+
+PROC = "/proc"
+try:
+    CLK_TCK = os.sysconf("SC_CLK_TCK")
+except (ValueError, OSError, AttributeError):
+    CLK_TCK = 100
+# Default number of seconds between two samples.
+INTERVAL = 2.0
+# Default number of samples kept for every brick.
+WINDOW = 30
+# Maximum fraction of the time spent sampling. If a round takes longer the
+# interval is raised.
+MAX_OVERHEAD = 0.02
+
+ProcSample = collections.namedtuple("ProcSample", [
+    "cpu_time", "rss", "voluntary_switches", "involuntary_switches",
+    "read_bytes", "write_bytes"])
+BrickStats = collections.namedtuple("BrickStats", [
+    "timestamp", "pids", "cpu_percent", "rss", "switches_rate", "read_rate",
+    "write_rate"])
+
+
+def _read(path):
+    with open(path, "rb") as fp:
+        return fp.read().decode("ascii", "replace")
+
+
+def _read_stat(base):
+    data = _read(os.path.join(base, "stat"))
+    # The command name may contain spaces and parenthesis
+    fields = data[data.rindex(")") + 2:].split()
+    return fields
+
+
+def _read_keys(path, sep):
+    values = {}
+    try:
+        data = _read(path)
+    except (IOError, OSError):
+        return values
+    for line in data.splitlines():
+        key, found, value = line.partition(sep)
+        if found:
+            values[key.strip()] = value.strip()
+    return values
+
+
+def read_sample(pid, proc=PROC):
+    """Read the resources used by a process.
+
+    C{cpu_time} is in seconds, C{rss} in bytes. The I/O counters are
+    C{None} if C{/proc/<pid>/io} is not readable, for example if the process
+    is run by another user.
+
+    @raise OSError: if the process does not exist.
+    """
+
+    base = os.path.join(proc, str(pid))
+    stat = _read_stat(base)
+    sched = _read_keys(os.path.join(base, "sched"), ":")
+    try:
+        cpu_time = float(sched["se.sum_exec_runtime"]) / 1000
+    except (KeyError, ValueError):
+        cpu_time = float(int(stat[11]) + int(stat[12])) / CLK_TCK
+    status = _read_keys(os.path.join(base, "status"), ":")
+    rss = int(status.get("VmRSS", "0 kB").split()[0]) * 1024
+    io = _read_keys(os.path.join(base, "io"), ":")
+    return ProcSample(
+        cpu_time, rss,
+        int(status.get("voluntary_ctxt_switches", 0)),
+        int(status.get("nonvoluntary_ctxt_switches", 0)),
+        int(io["read_bytes"]) if "read_bytes" in io else None,
+        int(io["write_bytes"]) if "write_bytes" in io else None)
+
+
+def _children_map(proc=PROC):
+    children = collections.defaultdict(list)
+    for name in os.listdir(proc):
+        if name.isdigit():
+            try:
+                ppid = int(_read_stat(os.path.join(proc, name))[1])
+            except (IOError, OSError, ValueError, IndexError):
+                continue
+            children[ppid].append(int(name))
+    return children
+
+
+def _sum(samples):
+    def total(values):
+        values = [v for v in values if v is not None]
+        return sum(values) if values else None
+    return ProcSample(*[total(values) for values in zip(*samples)])
+
+
+class Sampler:
+    """Periodically sample the resources used by the running bricks.
+
+    The time spent sampling is measured, C{cost} keeps the last samples. If a
+    round takes more than L{MAX_OVERHEAD} of the interval, the interval is
+    raised.
+    """
+
+    _call = None
+
+    def __init__(self, factory, interval=INTERVAL, window=WINDOW, clock=None,
+                 proc=PROC, timer=time.time):
+        if clock is None:
+            from twisted.internet import reactor as clock
+        self.factory = factory
+        self.base_interval = self.interval = interval
+        self.window = window
+        self.clock = clock
+        self.proc = proc
+        self.timer = timer
+        self.cost = collections.deque(maxlen=window)
+        self._stats = {}
+        self._last = {}
+
+    def start(self):
+        """Start sampling, the first sample is taken immediately."""
+
+        if self._call is None:
+            self._run()
+
+    def stop(self):
+        if self._call is not None:
+            self._call.cancel()
+            self._call = None
+
+    def is_running(self):
+        return self._call is not None
+
+    def _run(self):
+        self.sample()
+        self._call = self.clock.callLater(self.interval, self._run)
+
+    def _pids(self, brick, children):
+        pids = [brick.pid]
+        if brick.needsudo():
+            if children is None:
+                children = _children_map(self.proc)
+            stack = list(children.get(brick.pid, ()))
+            while stack:
+                pid = stack.pop()
+                pids.append(pid)
+                stack.extend(children.get(pid, ()))
+        return pids, children
+
+    def sample(self):
+        """Take a sample of all the running bricks.
+
+        Bricks that are not running anymore are forgotten.
+        """
+
+        started = self.timer()
+        now = self.clock.seconds()
+        running = set()
+        children = None
+        for brick in self.factory.bricks:
+            if brick.proc is None or brick.pid <= 0:
+                continue
+            pids, children = self._pids(brick, children)
+            samples = []
+            for pid in pids:
+                try:
+                    samples.append(read_sample(pid, self.proc))
+                except (IOError, OSError, ValueError, IndexError):
+                    pass
+            if samples:
+                running.add(brick)
+                self._add(brick, now, tuple(pids), _sum(samples))
+        for brick in set(self._stats) - running:
+            del self._stats[brick]
+            del self._last[brick]
+        cost = self.timer() - started
+        self.cost.append(cost)
+        interval = max(self.base_interval, cost / MAX_OVERHEAD)
+        if interval > self.interval:
+            logger.warn(slow_sampling, cost=cost, interval=interval)
+        self.interval = interval
+
+    def _add(self, brick, now, pids, sample):
+        last = self._last.get(brick)
+        self._last[brick] = (now, pids, sample)
+        if last is None or last[1] != pids or now <= last[0]:
+            # The first sample or the brick has been restarted: no rates yet
+            stats = BrickStats(now, pids, None, sample.rss, None, None, None)
+        else:
+            elapsed = now - last[0]
+            prev = last[2]
+
+            def rate(current, previous):
+                if current is None or previous is None:
+                    return None
+                return max(current - previous, 0) / elapsed
+
+            stats = BrickStats(
+                now, pids,
+                100.0 * rate(sample.cpu_time, prev.cpu_time),
+                sample.rss,
+                rate(sample.voluntary_switches + sample.involuntary_switches,
+                     prev.voluntary_switches + prev.involuntary_switches),
+                rate(sample.read_bytes, prev.read_bytes),
+                rate(sample.write_bytes, prev.write_bytes))
+        try:
+            window = self._stats[brick]
+        except KeyError:
+            window = self._stats[brick] = collections.deque(
+                maxlen=self.window)
+        window.append(stats)
+
+    def stats(self, brick):
+        """Return the list of L{BrickStats} of the brick, oldest first."""
+
+        return list(self._stats.get(brick, ()))
+
+    def latest(self, brick):
+        """Return the last L{BrickStats} of the brick or C{None}."""
+
+        window = self._stats.get(brick)
+        return window[-1] if window else None
+
+    def top(self, key="cpu_percent", limit=None):
+        """Return a list of C{(brick, stats)} with the last stats of every
+        running brick, sorted by C{key} in descending order."""
+
+        rows = [(brick, window[-1]) for brick, window in self._stats.items()
+                if window]
+        rows.sort(key=lambda row: getattr(row[1], key) or 0, reverse=True)
+        return rows[:limit] if limit is not None else rows
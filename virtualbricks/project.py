@@ -22,11 +22,11 @@ import itertools
 import re
 import six
 
-from twisted.internet import utils, error, defer
+from twisted.internet import error, defer
 from twisted.python import filepath
 
 from virtualbricks import (settings, configfile, log, errors, _configparser,
-                           tools)
+                           tools, jobs, snapshot, journal)
 
 
 logger = log.Logger()
@@ -65,7 +65,7 @@ class Tgz:
     exe_c = exe_x = "tar"
 
     def create(self, pathname, files, images=(),
-               run=utils.getProcessOutputAndValue):
+               run=jobs.run):
         logger.info(create_archive, path=pathname)
         args = ["cfzh", pathname, "-C", settings.VIRTUALBRICKS_HOME] + files
         if images:
@@ -91,7 +91,7 @@ class Tgz:
         return d
 
     def extract(self, pathname, destination,
-                run=utils.getProcessOutputAndValue):
+                run=jobs.run):
         logger.info(extract_archive, path=destination)
         args = ["Sxfz", pathname, "-C", destination]
         d = run(self.exe_x, args, os.environ)
@@ -182,6 +182,14 @@ class ProjectEntry:
             self.dump(fp)
 
 
+def _remove(fp):
+    try:
+        fp.remove()
+    except OSError as e:
+        if e.errno != errno.ENOENT:
+            raise
+
+
 def pass_through(function, *args, **kwds):
     def wrapper(arg):
         function(*args, **kwds)
@@ -212,6 +220,14 @@ class Project:
     def _project(self):
         return self._path.child(".project")
 
+    @property
+    def _snapshot(self):
+        return filepath.FilePath(snapshot.filename(self._project.path))
+
+    @property
+    def _journal(self):
+        return filepath.FilePath(journal.filename(self._project.path))
+
     def delete(self):
         try:
             self._path.remove()
@@ -252,6 +268,7 @@ class Project:
         # if an exception is raised, this value is not changed, i.e. it
         # is the default
         self._manager.current = self
+        factory.autosave.open_journal()
         return self
 
     def close(self, factory, settings=settings):
@@ -336,7 +353,11 @@ class Project:
         self._description_modified = True
 
     def files(self):
-        return (fp for fp in self._path.walk() if fp.isfile())
+        # The snapshot is a cache and the journal is folded in the project
+        # when it is saved, they are not exported
+        internal = (self._snapshot, self._journal)
+        return (fp for fp in self._path.walk()
+                if fp.isfile() and fp not in internal)
 
     def get_descriptor(self):
         with self._project.open() as fp:
@@ -405,6 +426,9 @@ class ProjectManager:
             return defer.fail(e)
         logger.debug(extract_project)
         deferred = self.archive.extract(vbppath, project.path)
+        # Never trust a snapshot or a journal found in an archive
+        deferred.addCallback(lambda _: _remove(project._snapshot))
+        deferred.addCallback(lambda _: _remove(project._journal))
         return deferred.addCallback(lambda _: project)
 
     def export(self, output, files, images=()):
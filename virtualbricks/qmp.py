@@ -0,0 +1,342 @@
+# -*- test-case-name: virtualbricks.tests.test_qmp -*-
+# Virtualbricks - a vde/qemu gui written in python and GTK/Glade.
+# Copyright (C) 2018 Virtualbricks team
+
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+"""Asynchronous client of the QEMU Machine Protocol.
+
+Every virtual machine exposes a QMP socket next to its human monitor. The
+client negotiates the capabilities, matches each command with its reply
+through the C{id} field and returns a deferred for every command, that fires
+with the C{return} value or fails with L{QMPError}. Asynchronous events sent
+by qemu are delivered through an L{observable.Observable}, one observable
+event for every QMP event name in L{EVENTS}.
+"""
+
+import collections
+import itertools
+import json
+
+from twisted.internet import defer, error, protocol, endpoints, task
+from twisted.protocols import basic
+from twisted.python import failure
+
+from virtualbricks import errors, log, observable
+
+
+__all__ = ["EVENTS", "QMPError", "NotConnectedError", "QMPEvent",
+           "QMPProtocol", "QMPClient"]
+
+logger = log.Logger()
+bad_message = log.Event("Invalid QMP message: {line!r}")
+unexpected_reply = log.Event("QMP reply to an unknown request: {message}")
+reply_time = log.Event("{name}: {command} replied in {elapsed:.3f}s")
+unknown_event = log.Event("{name}: unhandled QMP event {qmp_event}")
+connect_failed = log.Event("{name}: cannot connect to QMP socket {path}")
+
+EVENTS = ("SHUTDOWN", "STOP", "RESUME", "RESET", "POWERDOWN",
+          "BLOCK_JOB_COMPLETED", "BLOCK_JOB_ERROR", "DEVICE_DELETED")
+# Delays, in seconds, between the attempts to connect to the QMP socket.
+# Qemu creates the socket a while after the process is started.
+CONNECT_DELAYS = (0.05, 0.1, 0.2, 0.4, 0.8, 1.6, 3.2)
+# Number of latency samples kept for every command.
+LATENCY_SAMPLES = 64
+
+QMPEvent = collections.namedtuple("QMPEvent", ["name", "data", "timestamp"])
+
+
+class QMPError(errors.Error):
+    """Qemu replied to a command with an error."""
+
+    def __init__(self, error_class, desc):
+        errors.Error.__init__(self, error_class, desc)
+        self.error_class = error_class
+        self.desc = desc
+
+    def __str__(self):
+        return "{0}: {1}".format(self.error_class, self.desc)
+
+
+class NotConnectedError(errors.Error):
+    """The QMP socket of the virtual machine is not connected."""
+
+
+class QMPProtocol(basic.LineOnlyReceiver):
+    """One QMP session.
+
+    C{ready} fires with the protocol itself when the capabilities negotiation
+    is completed, the commands issued before are queued until then.
+    """
+
+    delimiter = b"\n"
+    MAX_LENGTH = 1 << 20
+    greeting = None
+    client = None
+
+    def __init__(self, clock=None):
+        if clock is None:
+            from twisted.internet import reactor as clock
+        self.clock = clock
+        self.ready = defer.Deferred()
+        self.events = observable.Observable(*EVENTS)
+        self.latency = collections.defaultdict(
+            lambda: collections.deque(maxlen=LATENCY_SAMPLES))
+        self.name = "qmp"
+        self._ids = itertools.count(1)
+        self._pending = {}
+        self._negotiated = False
+        self._queue = []
+
+    def connectionLost(self, reason=protocol.connectionDone):
+        pending, self._pending = self._pending, {}
+        for deferred, _, _ in pending.values():
+            deferred.errback(reason)
+        queue, self._queue = self._queue, []
+        for deferred, _, _ in queue:
+            deferred.errback(reason)
+        if not self.ready.called:
+            self.ready.errback(reason)
+        if self.client is not None:
+            self.client.connection_lost(self)
+
+    def lineReceived(self, line):
+        try:
+            message = json.loads(line.decode("utf-8"))
+        except ValueError:
+            logger.warn(bad_message, line=line)
+            return
+        if not isinstance(message, dict):
+            logger.warn(bad_message, line=line)
+        elif "QMP" in message:
+            self.greeting = message["QMP"]
+            self._send("qmp_capabilities", None).addCallbacks(
+                self._negotiated_cb, self.ready.errback)
+        elif "event" in message:
+            self._event_received(message)
+        elif "return" in message or "error" in message:
+            self._reply_received(message)
+        else:
+            logger.warn(bad_message, line=line)
+
+    def _negotiated_cb(self, _):
+        self._negotiated = True
+        queue, self._queue = self._queue, []
+        for deferred, command, arguments in queue:
+            self._send(command, arguments).chainDeferred(deferred)
+        self.ready.callback(self)
+
+    def _event_received(self, message):
+        name = message["event"]
+        timestamp = message.get("timestamp", {})
+        event = QMPEvent(name, message.get("data", {}),
+                         timestamp.get("seconds", 0) +
+                         timestamp.get("microseconds", 0) / 1e6)
+        try:
+            self.events.notify(name, event)
+        except ValueError:
+            logger.debug(unknown_event, name=self.name, qmp_event=name)
+
+    def _reply_received(self, message):
+        try:
+            deferred, command, started = self._pending.pop(message.get("id"))
+        except KeyError:
+            logger.warn(unexpected_reply, message=message)
+            return
+        elapsed = self.clock.seconds() - started
+        self.latency[command].append(elapsed)
+        logger.debug(reply_time, name=self.name, command=command,
+                     elapsed=elapsed)
+        if "error" in message:
+            err = message["error"]
+            deferred.errback(QMPError(err.get("class", "GenericError"),
+                                      err.get("desc", "")))
+        else:
+            deferred.callback(message["return"])
+
+    def _send(self, command, arguments):
+        request_id = next(self._ids)
+        request = {"execute": command, "id": request_id}
+        if arguments:
+            request["arguments"] = arguments
+        deferred = defer.Deferred()
+        self._pending[request_id] = (deferred, command, self.clock.seconds())
+        self.sendLine(json.dumps(request).encode("utf-8"))
+        return deferred
+
+    def execute(self, command, arguments=None):
+        """Execute a QMP command.
+
+        @return: a deferred that fires with the C{return} value of the
+            command or fails with L{QMPError}.
+        """
+
+        if self._negotiated:
+            return self._send(command, arguments)
+        deferred = defer.Deferred()
+        self._queue.append((deferred, command, arguments))
+        return deferred
+
+    def human_monitor_command(self, command_line):
+        """Execute a command of the human monitor that has no QMP
+        counterpart.
+
+        The human monitor reports the errors as text, any output is
+        considered an error.
+        """
+
+        def check(output):
+            if output.strip():
+                raise QMPError("GenericError", output.strip())
+            return output
+
+        d = self.execute("human-monitor-command",
+                         {"command-line": command_line})
+        return d.addCallback(check)
+
+
+class _QMPFactory(protocol.Factory):
+
+    def __init__(self, client):
+        self.client = client
+
+    def buildProtocol(self, addr):
+        proto = QMPProtocol(self.client.clock)
+        proto.name = self.client.name
+        proto.events = self.client.events
+        proto.latency = self.client.latency
+        return proto
+
+
+class QMPClient:
+    """The QMP connection of a virtual machine.
+
+    The events and the latency samples are kept by the client, so they
+    survive a reconnection, for example when the virtual machine is
+    restarted.
+    """
+
+    protocol = None
+    _connecting = False
+
+    def __init__(self, name, path, clock=None, endpoint_factory=None):
+        if clock is None:
+            from twisted.internet import reactor as clock
+        if endpoint_factory is None:
+            endpoint_factory = endpoints.UNIXClientEndpoint
+        self.name = name
+        self.path = path
+        self.clock = clock
+        self.endpoint_factory = endpoint_factory
+        self.events = observable.Observable(*EVENTS)
+        self.latency = collections.defaultdict(
+            lambda: collections.deque(maxlen=LATENCY_SAMPLES))
+        self._waiters = []
+
+    def connect(self, delays=CONNECT_DELAYS):
+        """Connect to the QMP socket, retrying while it does not exist.
+
+        @return: a deferred that fires with the L{QMPProtocol} when the
+            capabilities negotiation is completed.
+        """
+
+        if self.is_connected():
+            return defer.succeed(self.protocol)
+        d = defer.Deferred()
+        self._waiters.append(d)
+        if not self._connecting:
+            self._connecting = True
+            self._connect(iter(delays)).addBoth(self._connected)
+        return d
+
+    def _connected(self, result):
+        self._connecting = False
+        waiters, self._waiters = self._waiters, []
+        for d in waiters:
+            if not d.called:
+                if isinstance(result, failure.Failure):
+                    d.errback(result)
+                else:
+                    d.callback(result)
+
+    def _connect(self, delays):
+        endpoint = self.endpoint_factory(self.clock, self.path)
+        d = endpoints.connectProtocol(endpoint,
+                                      _QMPFactory(self).buildProtocol(None))
+
+        def connected(proto):
+            self.protocol = proto
+            proto.client = self
+            return proto.ready
+
+        def retry(fail):
+            fail.trap(error.ConnectError)
+            try:
+                delay = next(delays)
+            except StopIteration:
+                logger.error(connect_failed, name=self.name, path=self.path)
+                return fail
+            return task.deferLater(self.clock, delay, self._connect, delays)
+
+        def failed(fail):
+            self.protocol = None
+            return fail
+
+        return d.addCallbacks(connected, retry).addErrback(failed)
+
+    def disconnect(self):
+        proto, self.protocol = self.protocol, None
+        if proto is not None and proto.transport is not None:
+            proto.transport.loseConnection()
+
+    def connection_lost(self, proto):
+        if self.protocol is proto:
+            self.protocol = None
+
+    def is_connected(self):
+        return self.protocol is not None and self.protocol.ready.called
+
+    def _when_connected(self):
+        if self.protocol is not None and self.protocol.ready.called:
+            return defer.succeed(self.protocol)
+        if not self._connecting:
+            return defer.fail(NotConnectedError(self.path))
+
+        def not_connected(fail):
+            raise NotConnectedError(self.path)
+
+        return self.connect().addErrback(not_connected)
+
+    def execute(self, command, arguments=None):
+        """Execute a QMP command, waiting for the connection if needed.
+
+        @see: L{QMPProtocol.execute}
+        """
+
+        d = self._when_connected()
+        return d.addCallback(lambda proto: proto.execute(command, arguments))
+
+    def human_monitor_command(self, command_line):
+        d = self._when_connected()
+        return d.addCallback(
+            lambda proto: proto.human_monitor_command(command_line))
+
+    def latency_stats(self):
+        """Return a dict that maps every command to the tuple C{(count,
+        average, max)} of its latencies, in seconds."""
+
+        return dict((command, (len(s), sum(s) / len(s), max(s)))
+                    for command, s in self.latency.items() if s)
+
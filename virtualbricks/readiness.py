@@ -0,0 +1,169 @@
+# -*- test-case-name: virtualbricks.tests.test_readiness -*-
+# Virtualbricks - a vde/qemu gui written in python and GTK/Glade.
+# Copyright (C) 2018 Virtualbricks team
+
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+"""Probes that tell when a started brick is actually usable.
+
+A process is started as soon as fork/exec succeed, but a switch is usable
+only when its control socket accepts connections. The probes poll a
+condition with an exponential backoff, until it is true or a timeout
+expires.
+"""
+
+import errno
+import socket
+
+from twisted.internet import defer, endpoints, protocol
+
+from virtualbricks import errors
+
+
+__all__ = ["NotReadyError", "BACKOFF", "TIMEOUT", "poll", "socket_accepts",
+           "prompt_answers"]
+
+# Delays, in seconds, between two checks. The last one is repeated.
+BACKOFF = (0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5)
+# Seconds after which a brick that is not ready is considered failed.
+TIMEOUT = 30.0
+# Seconds to wait for the prompt after the connection.
+PROMPT_TIMEOUT = 1.0
+
+
+class NotReadyError(errors.Error):
+    """The brick did not become ready in time."""
+
+
+class _Poll:
+
+    call = None
+    checking = None
+
+    def __init__(self, check, timeout, clock, delays):
+        self.check = check
+        self.clock = clock
+        self.delays = iter(delays)
+        self.delay = None
+        self.deadline = clock.seconds() + timeout
+        self.done = defer.Deferred(self._cancel)
+
+    def start(self):
+        self._check()
+        return self.done
+
+    def _check(self):
+        self.call = None
+        self.checking = defer.maybeDeferred(self.check)
+        self.checking.addCallbacks(self._checked, self._failed)
+
+    def _checked(self, result):
+        self.checking = None
+        if self.done.called:
+            return
+        if result:
+            self.done.callback(result)
+            return
+        self.delay = next(self.delays, self.delay)
+        if self.clock.seconds() + self.delay > self.deadline:
+            self.done.errback(NotReadyError())
+        else:
+            self.call = self.clock.callLater(self.delay, self._check)
+
+    def _failed(self, fail):
+        self.checking = None
+        if not self.done.called:
+            self.done.errback(fail)
+
+    def _cancel(self, _):
+        if self.call is not None and self.call.active():
+            self.call.cancel()
+        if self.checking is not None:
+            self.checking.cancel()
+
+
+def poll(check, timeout=TIMEOUT, clock=None, delays=BACKOFF):
+    """Call C{check} until it returns a true value.
+
+    C{check} may return a deferred. The delay between two calls grows
+    following C{delays}.
+
+    @return: a cancellable deferred that fires with the result of C{check}
+        or fails with L{NotReadyError} after C{timeout} seconds.
+    """
+
+    if clock is None:
+        from twisted.internet import reactor as clock
+    return _Poll(check, timeout, clock, delays).start()
+
+
+def socket_accepts(path):
+    """Return C{True} if a unix socket is listening on C{path}."""
+
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.setblocking(False)
+    try:
+        sock.connect(path)
+    except socket.error as e:
+        # A full backlog means that somebody is listening
+        return e.errno in (errno.EAGAIN, errno.EINPROGRESS)
+    finally:
+        sock.close()
+    return True
+
+
+class _PromptProtocol(protocol.Protocol):
+
+    def __init__(self, prompt):
+        self.prompt = prompt
+        self.buffer = b""
+        self.answered = defer.Deferred()
+
+    def dataReceived(self, data):
+        self.buffer += data
+        if self.prompt.search(self.buffer) and not self.answered.called:
+            self.answered.callback(True)
+            self.transport.loseConnection()
+
+    def connectionLost(self, reason):
+        if not self.answered.called:
+            self.answered.callback(False)
+
+
+def prompt_answers(path, prompt, clock=None, timeout=PROMPT_TIMEOUT):
+    """Connect to a management socket and wait for the prompt.
+
+    @param prompt: a compiled bytes regex.
+    @return: a deferred that fires with C{True} if the prompt is received
+        within C{timeout} seconds, C{False} otherwise.
+    """
+
+    if clock is None:
+        from twisted.internet import reactor as clock
+    proto = _PromptProtocol(prompt)
+    endpoint = endpoints.UNIXClientEndpoint(clock, path)
+    d = endpoints.connectProtocol(endpoint, proto)
+
+    def connected(_):
+        call = clock.callLater(timeout, proto.transport.loseConnection)
+
+        def answered(result):
+            if call.active():
+                call.cancel()
+            return result
+
+        return proto.answered.addCallback(answered)
+
+    return d.addCallbacks(connected, lambda _: False)
@@ -0,0 +1,162 @@
+# -*- test-case-name: virtualbricks.tests.test_snapshot -*-
+# Virtualbricks - a vde/qemu gui written in python and GTK/Glade.
+# Copyright (C) 2018 Virtualbricks team
+
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+"""The binary snapshot of a project.
+
+When a project is saved, the state of the factory is written next to the
+project file too, in C{.project.snapshot}: the images, the events, the
+bricks with their options, the socks and the links, as plain tuples of
+strings serialized with C{marshal}. The snapshot starts with a header:
+
+    magic (8 bytes) | format (2 bytes) | marshal version (1 byte) |
+    sha256 of the project file (32 bytes)
+
+A snapshot is valid only if the format is the current one and if the hash
+matches the content of the project file, otherwise the project file is
+parsed as usual. The snapshot is a cache, it is never exported.
+"""
+
+import errno
+import hashlib
+import marshal
+import os
+import struct
+
+from virtualbricks import base, log
+
+
+__all__ = ["SUFFIX", "brick_links", "brick_socks", "digest", "dumps",
+           "filename", "loads", "read", "state", "write"]
+
+logger = log.Logger()
+cannot_write = log.Event("Cannot write the snapshot {path}")
+stale = log.Event("The snapshot {path} is stale, parsing the project")
+
+MAGIC = b"VBSNAP\x00\x01"
+FORMAT = 2
+SUFFIX = ".snapshot"
+_HEADER = struct.Struct(">8sHB32s")
+
+
+def filename(path):
+    """Return the path of the snapshot of the project file C{path}."""
+
+    return path + SUFFIX
+
+
+def digest(content):
+    """Return the hash of the content of a project file."""
+
+    return hashlib.sha256(content).digest()
+
+
+def state(factory):
+    """Return the state of C{factory} as a tuple C{(images, events, bricks,
+    socks, links)}, in the same order of the project file."""
+
+    images = [(image.name, image.path) for image in factory.disk_images]
+    events = [(event.name, base.saved_options(event))
+              for event in factory.events]
+    bricks = []
+    socks = []
+    links = []
+    for brick in factory.bricks:
+        bricks.append((brick.get_type(), brick.name,
+                       base.saved_options(brick)))
+        socks.extend((brick.name, ) + sock for sock in brick_socks(brick))
+        links.extend((brick.name, ) + link for link in brick_links(brick))
+    return images, events, bricks, socks, links
+
+
+def brick_socks(brick):
+    """Return the socks of C{brick} that are saved in the project, as
+    C{(nickname, model, mac)} tuples. Only the virtual machines save their
+    socks, the other bricks create them."""
+
+    if brick.get_type() != "Qemu":
+        return []
+    return [(sock.nickname, sock.model, sock.mac) for sock in brick.socks]
+
+
+def brick_links(brick):
+    """Return the plugs of C{brick} as C{(sockname, model, mac)} tuples."""
+
+    return [(plug.sock.nickname if plug.configured() else "", plug.model,
+             plug.mac) for plug in brick.plugs]
+
+
+def dumps(state, digest):
+    return _HEADER.pack(MAGIC, FORMAT, marshal.version, digest) + \
+        marshal.dumps(state)
+
+
+def loads(data, digest):
+    """Return the state saved in C{data} or C{None} if the snapshot is not
+    valid for the project file with hash C{digest}."""
+
+    try:
+        magic, format, version, expected = _HEADER.unpack_from(data)
+    except struct.error:
+        return None
+    # Check the header before looking at the body, the body is read only if
+    # it was written for this very project file.
+    if (magic != MAGIC or format != FORMAT or version != marshal.version or
+            expected != digest):
+        return None
+    try:
+        images, events, bricks, socks, links = marshal.loads(
+            data[_HEADER.size:])
+    except (EOFError, ValueError, TypeError):
+        return None
+    return images, events, bricks, socks, links
+
+
+def write(path, state):
+    """Write the snapshot of the project file C{path}, just saved from
+    C{state}. Nothing is logged, it can be called from a thread.
+
+    @raises: C{EnvironmentError} if the snapshot cannot be written.
+    """
+
+    snapshot = filename(path)
+    tmp = snapshot + ".tmp"
+    with open(path, "rb") as fp:
+        data = dumps(state, digest(fp.read()))
+    with open(tmp, "wb") as fp:
+        fp.write(data)
+    os.rename(tmp, snapshot)
+
+
+def read(path):
+    """Return the state saved in the snapshot of the project file C{path}
+    or C{None} if there is no valid snapshot."""
+
+    snapshot = filename(path)
+    try:
+        with open(path, "rb") as fp:
+            content = fp.read()
+        with open(snapshot, "rb") as fp:
+            data = fp.read()
+    except (IOError, OSError) as e:
+        if e.errno != errno.ENOENT:
+            logger.warn(stale, path=snapshot, hide_to_user=True)
+        return None
+    result = loads(data, digest(content))
+    if result is None:
+        logger.debug(stale, path=snapshot)
+    return result
@@ -0,0 +1,250 @@
+# -*- test-case-name: virtualbricks.tests.test_spawnserver -*-
+# Virtualbricks - a vde/qemu gui written in python and GTK/Glade.
+# Copyright (C) 2018 Virtualbricks team
+
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+"""The spawn server, a small process that starts the bricks.
+
+The main process holds GTK, the images and the whole engine, forking it to
+start a brick copies all its page tables. The spawn server is a fresh
+interpreter that imports only the standard library and starts the processes
+with C{posix_spawn} on behalf of the main process:
+
+    $ python -m virtualbricks.spawnserver SOCKET
+
+Every request is a connection to the unix socket C{SOCKET}. The client sends
+the stdin, stdout and stderr of the child (three file descriptors) and a
+JSON line C{{"executable": ..., "args": [...], "env": {...}}}. The server
+replies with C{pid PID} or with C{error ERRNO MESSAGE} and then, when the
+child exits, with C{exit STATUS}, where C{STATUS} is the status returned by
+C{waitpid}. The stdio of the child is passed directly to the client, only
+the control messages go through the socket.
+
+The server exits when its standard input is closed, that is when the main
+process exits.
+
+Keep this module free of imports outside of the standard library.
+"""
+
+import errno
+import json
+import os
+import select
+import signal
+import socket
+import sys
+
+
+__all__ = ["serve", "main"]
+
+# The file descriptors passed with a request: stdin, stdout, stderr.
+FDS = 3
+MAXLINE = 1 << 20
+
+
+def available():
+    """Return C{True} if the server can run on this platform."""
+
+    return (hasattr(os, "posix_spawnp") and hasattr(socket, "AF_UNIX") and
+            hasattr(socket.socket, "recvmsg"))
+
+
+def _ignored_signals():
+    # The children must start with the default dispositions, as when they
+    # are spawned by twisted; python ignores SIGPIPE for example.
+    ignored = []
+    for signo in signal.valid_signals():
+        try:
+            if signal.getsignal(signo) == signal.SIG_IGN:
+                ignored.append(signo)
+        except (OSError, ValueError):
+            pass
+    return ignored
+
+
+class _Request:
+
+    def __init__(self, sock):
+        self.sock = sock
+        self.buffer = b""
+        self.fds = []
+        self.pid = None
+
+    def fileno(self):
+        return self.sock.fileno()
+
+    def close_fds(self):
+        for fd in self.fds:
+            os.close(fd)
+        self.fds = []
+
+    def close(self):
+        self.close_fds()
+        self.sock.close()
+
+    def send(self, line):
+        try:
+            self.sock.sendall(line.encode("utf-8") + b"\n")
+        except OSError:
+            # The client is gone, the child keeps running
+            pass
+
+
+class Server:
+
+    def __init__(self, listener, control):
+        self.listener = listener
+        self.control = control
+        self.requests = []
+        self.children = {}
+        self.sigdef = _ignored_signals()
+        self.running = False
+
+    def _accept(self):
+        try:
+            sock, _ = self.listener.accept()
+        except OSError:
+            return
+        self.requests.append(_Request(sock))
+
+    def _read(self, request):
+        try:
+            data, ancdata, _, _ = request.sock.recvmsg(
+                65536, socket.CMSG_SPACE(FDS * 4), socket.MSG_CMSG_CLOEXEC)
+        except OSError:
+            data, ancdata = b"", []
+        for level, type, cdata in ancdata:
+            if level == socket.SOL_SOCKET and type == socket.SCM_RIGHTS:
+                cdata = cdata[:len(cdata) - len(cdata) % 4]
+                request.fds.extend(memoryview(cdata).cast("i"))
+        if not data:
+            self._drop(request)
+            return
+        request.buffer += data
+        if b"\n" in request.buffer:
+            line = request.buffer.split(b"\n", 1)[0]
+            self._spawn(request, line)
+        elif len(request.buffer) > MAXLINE:
+            request.send("error {0} request too long".format(errno.E2BIG))
+            self._drop(request)
+
+    def _drop(self, request):
+        self.requests.remove(request)
+        request.close()
+
+    def _spawn(self, request, line):
+        # Only one request per connection, stop reading from it
+        self.requests.remove(request)
+        try:
+            if len(request.fds) != FDS:
+                raise OSError(errno.EINVAL, "expected {0} file descriptors, "
+                              "got {1}".format(FDS, len(request.fds)))
+            message = json.loads(line.decode("utf-8"))
+            actions = [(os.POSIX_SPAWN_DUP2, fd, i)
+                       for i, fd in enumerate(request.fds)]
+            pid = os.posix_spawnp(message["executable"], message["args"],
+                                  message["env"], file_actions=actions,
+                                  setsigdef=self.sigdef, setsigmask=())
+        except OSError as e:
+            request.send("error {0} {1}".format(e.errno or 0, e.strerror or e))
+            request.close()
+        except (ValueError, KeyError, TypeError) as e:
+            request.send("error {0} {1}".format(errno.EINVAL, e))
+            request.close()
+        else:
+            request.close_fds()
+            request.pid = pid
+            self.children[pid] = request
+            request.send("pid {0}".format(pid))
+
+    def _reap(self):
+        while self.children:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                return
+            if pid == 0:
+                return
+            request = self.children.pop(pid, None)
+            if request is not None:
+                request.send("exit {0}".format(status))
+                request.close()
+
+    def serve(self):
+        wakeup_r, wakeup_w = os.pipe()
+        os.set_blocking(wakeup_w, False)
+        os.set_blocking(wakeup_r, False)
+        signal.set_wakeup_fd(wakeup_w)
+        # A handler is needed for the wakeup fd to be written
+        signal.signal(signal.SIGCHLD, lambda signo, frame: None)
+        self.running = True
+        while self.running:
+            readers = [self.listener, self.control, wakeup_r] + self.requests
+            try:
+                readable, _, _ = select.select(readers, [], [])
+            except InterruptedError:
+                continue
+            for reader in readable:
+                if reader is self.listener:
+                    self._accept()
+                elif reader is self.control:
+                    if not os.read(self.control.fileno(), 4096):
+                        self.running = False
+                elif reader == wakeup_r:
+                    try:
+                        while os.read(wakeup_r, 4096):
+                            pass
+                    except BlockingIOError:
+                        pass
+                else:
+                    self._read(reader)
+            self._reap()
+
+
+def serve(path, control=sys.stdin):
+    """Serve the requests on the unix socket C{path} until C{control} is
+    closed."""
+
+    try:
+        os.unlink(path)
+    except OSError as e:
+        if e.errno != errno.ENOENT:
+            raise
+    listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    listener.bind(path)
+    listener.listen(128)
+    try:
+        Server(listener, control).serve()
+    finally:
+        listener.close()
+        try:
+            os.unlink(path)
+        except OSError:
+            pass
+
+
+def main(argv=None):
+    if argv is None:
+        argv = sys.argv
+    if len(argv) != 2:
+        sys.stderr.write("usage: {0} SOCKET\n".format(argv[0]))
+        return 2
+    serve(argv[1])
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
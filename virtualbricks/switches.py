@@ -21,7 +21,7 @@ import os
 
 from twisted.internet import defer
 
-from virtualbricks import settings, bricks, log, errors
+from virtualbricks import settings, bricks, log, errors, readiness
 from virtualbricks._spawn import abspath_vde
 
 
@@ -46,9 +46,11 @@ class Switch(bricks.Brick):
 
     def set_name(self, name):
         self._name = name
+        self.factory.reindex(self)
         for so in self.socks:
             so.nickname = name + "_port"
             so.path = os.path.join(settings.VIRTUALBRICKS_HOME, name + ".ctl")
+            self.factory.reindex(so)
 
     name = property(bricks.Brick.get_name, set_name)
 
@@ -86,18 +88,30 @@ class Switch(bricks.Brick):
     def configured(self):
         return self.socks[0].has_valid_path()
 
+    def probe_ready(self):
+        """A switch is ready when its control socket accepts connections and
+        the management console answers with the prompt."""
+
+        ctl = os.path.join(self.path(), "ctl")
+        console = self.console()
+        prompt = self.process_protocol.prompt
+        d = readiness.poll(lambda: readiness.socket_accepts(ctl))
+        d.addCallback(lambda _: readiness.poll(
+            lambda: readiness.prompt_answers(console, prompt)))
+        return d
+
     # live-management callbacks
     def cbset_path(self, path):
         self.socks[0].path = path
 
     def cbset_fstp(self, arg=False):
-        self.send("fstp/setfstp %d\n" % bool(arg))
+        return self.send("fstp/setfstp %d\n" % bool(arg))
 
     def cbset_hub(self, arg=False):
-        self.send("port/sethub %d\n" % bool(arg))
+        return self.send("port/sethub %d\n" % bool(arg))
 
     def cbset_numports(self, arg="32"):
-        self.send("port/setnumports %s\n" % arg)
+        return self.send("port/setnumports %s\n" % arg)
 
 
 class SwitchWrapperConfig(bricks.Config):
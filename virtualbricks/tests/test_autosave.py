@@ -0,0 +1,219 @@
+# Virtualbricks - a vde/qemu gui written in python and GTK/Glade.
+# Copyright (C) 2018 Virtualbricks team
+
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+import os
+
+from twisted.trial import unittest
+from twisted.internet import defer, task
+from twisted.test import proto_helpers
+
+from virtualbricks import autosave, configfile, console
+from virtualbricks.tests import stubs, successResultOf
+
+
+class TestDirty(unittest.TestCase):
+
+    def setUp(self):
+        self.factory = stubs.Factory()
+        self.notified = []
+        self.factory.connect("project-changed", self.notified.append)
+
+    def test_changes(self):
+        """Adding a brick, setting a new value, renaming and connecting
+        make the project dirty."""
+
+        self.assertFalse(self.factory.is_dirty())
+        switch = self.factory.new_brick("switch", "sw")
+        vm = self.factory.new_brick("vm", "vm")
+        self.assertTrue(self.factory.is_dirty())
+        for change in (lambda: vm.set({"ram": 256}),
+                       lambda: vm.rename("vm1"),
+                       lambda: vm.connect(switch.socks[0]),
+                       lambda: vm.plugs[0].disconnect()):
+            self.factory.mark_clean()
+            change()
+            self.assertTrue(self.factory.is_dirty())
+
+    def test_same_value(self):
+        """Setting the same value does not change the project."""
+
+        vm = self.factory.new_brick("vm", "vm")
+        vm.set({"ram": 256})
+        self.factory.mark_clean()
+        vm.set({"ram": 256})
+        self.assertFalse(self.factory.is_dirty())
+
+    def test_notify_once(self):
+        """project-changed is emitted when the project becomes dirty."""
+
+        self.factory.new_brick("switch", "sw1")
+        self.factory.new_brick("switch", "sw2")
+        self.assertEqual(self.notified, [self.factory])
+        self.factory.mark_clean()
+        self.factory.new_brick("switch", "sw3")
+        self.assertEqual(len(self.notified), 2)
+
+    def test_mark_clean(self):
+        """The changes made after the state is taken are still dirty."""
+
+        self.factory.new_brick("switch", "sw1")
+        changes = self.factory.changes
+        self.factory.new_brick("switch", "sw2")
+        self.factory.mark_clean(changes)
+        self.assertTrue(self.factory.is_dirty())
+        self.factory.mark_clean()
+        self.factory.mark_clean(changes)
+        self.assertFalse(self.factory.is_dirty())
+
+    def test_save_restore(self):
+        """The project is clean after it is saved or restored."""
+
+        filename = self.mktemp()
+        self.factory.new_brick("switch", "sw")
+        configfile.save(self.factory, filename)
+        self.assertFalse(self.factory.is_dirty())
+        factory = stubs.Factory()
+        configfile.restore(factory, filename)
+        self.assertFalse(factory.is_dirty())
+
+
+class TestAutosaver(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = task.Clock()
+        self.factory = stubs.Factory()
+        self.filename = self.mktemp()
+        self.writes = []
+        self.autosaver = autosave.Autosaver(
+            self.factory, delay=5, max_delay=60, clock=self.clock,
+            filename=lambda: self.filename, defer_to_thread=self.write)
+        self.autosaver.start()
+        self.addCleanup(self.autosaver.stop)
+
+    def write(self, function, *args):
+        self.writes.append(args)
+        return defer.maybeDeferred(function, *args)
+
+    def test_not_dirty(self):
+        self.clock.advance(1000)
+        self.assertEqual(self.writes, [])
+        self.assertFalse(os.path.exists(self.filename))
+
+    def test_debounce(self):
+        """The project is saved when the changes settle."""
+
+        self.factory.new_brick("switch", "sw1")
+        self.clock.advance(4)
+        self.factory.new_brick("switch", "sw2")
+        self.clock.advance(4)
+        self.assertEqual(self.writes, [])
+        self.clock.advance(5)
+        self.assertEqual(len(self.writes), 1)
+        self.assertEqual(self.autosaver.saves, 1)
+        self.assertEqual(self.autosaver.latency.count, 1)
+        self.assertEqual(self.autosaver.blocking.count, 1)
+        self.assertFalse(self.factory.is_dirty())
+        with open(self.filename) as fp:
+            self.assertEqual(fp.read(), "[Switch:sw1]\n\n[Switch:sw2]\n\n")
+        self.clock.advance(1000)
+        self.assertEqual(len(self.writes), 1)
+
+    def test_max_delay(self):
+        """A project that keeps changing is saved every max_delay
+        seconds."""
+
+        for i in range(70):
+            self.factory.new_brick("switch", "sw{0}".format(i))
+            self.clock.advance(1)
+        self.assertEqual(len(self.writes), 1)
+
+    def test_change_during_write(self):
+        """The changes made during the write are saved later."""
+
+        pending = []
+        self.autosaver.defer_to_thread = lambda *args: pending.append(
+            defer.Deferred()) or pending[-1]
+        self.factory.new_brick("switch", "sw1")
+        self.clock.advance(5)
+        self.assertEqual(len(pending), 1)
+        self.factory.new_brick("switch", "sw2")
+        self.clock.advance(10)
+        self.assertEqual(len(pending), 1)
+        pending[0].callback(True)
+        self.assertTrue(self.factory.is_dirty())
+        self.clock.advance(5)
+        self.assertEqual(len(pending), 2)
+        pending[1].callback(True)
+        self.assertFalse(self.factory.is_dirty())
+
+    def test_stale_write(self):
+        """A save on the reactor is not overwritten by the older state the
+        autosave writes later."""
+
+        pending = []
+
+        def defer_to_thread(function, *args):
+            d = defer.Deferred()
+            pending.append((d, function, args))
+            return d
+
+        self.autosaver.defer_to_thread = defer_to_thread
+        self.factory.new_brick("switch", "sw1")
+        self.clock.advance(5)
+        self.factory.new_brick("switch", "sw2")
+        configfile.save(self.factory, self.filename)
+        d, function, args = pending[0]
+        d.callback(function(*args))
+        self.assertFalse(self.factory.is_dirty())
+        with open(self.filename) as fp:
+            self.assertEqual(fp.read(), "[Switch:sw1]\n\n[Switch:sw2]\n\n")
+
+    def test_failure(self):
+        self.autosaver.defer_to_thread = lambda *args: defer.fail(
+            IOError("disk full"))
+        self.factory.new_brick("switch", "sw1")
+        self.clock.advance(5)
+        self.assertEqual(self.autosaver.failures, 1)
+        self.assertTrue(self.factory.is_dirty())
+        self.assertEqual(len(self.flushLoggedErrors(IOError)), 1)
+
+    def test_stop(self):
+        """stop waits for the write in progress."""
+
+        pending = defer.Deferred()
+        self.autosaver.defer_to_thread = lambda *args: pending
+        self.factory.new_brick("switch", "sw1")
+        self.clock.advance(5)
+        d = self.autosaver.stop()
+        self.assertNoResult(d)
+        pending.callback(True)
+        successResultOf(self, d)
+        self.factory.new_brick("switch", "sw2")
+        self.clock.advance(1000)
+        self.assertEqual(self.clock.getDelayedCalls(), [])
+
+    def test_command(self):
+        self.factory.new_brick("switch", "sw1")
+        self.clock.advance(5)
+        self.factory.autosave = self.autosaver
+        protocol = console.VBProtocol(self.factory)
+        transport = proto_helpers.StringTransport()
+        protocol.makeConnection(transport)
+        transport.clear()
+        protocol.lineReceived(b"autosave")
+        lines = transport.value().decode().splitlines()
+        self.assertEqual(lines[0], "saves: 1, failures: 0, dirty: no")
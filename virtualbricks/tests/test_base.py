@@ -129,6 +129,31 @@ class TestConfig(unittest.TestCase):
         self.assertIsNot(cfg, self.config2)
         self.assertIs(cfg["obj"], self.config2["obj"])
 
+    def test_schema_shared(self):
+        """The schema is compiled once for every class."""
+
+        self.assertIs(Config2().parameters, self.config2.parameters)
+        self.assertIsNot(self.config1.parameters, self.config2.parameters)
+        self.assertIsInstance(self.config1.parameters["int"], base.String)
+        self.assertIsInstance(self.config2.parameters["int"], base.Integer)
+
+    def test_copy_on_write(self):
+        """Only the values that are set are stored in the configuration."""
+
+        self.assertEqual(list(self.config2.overrides()), [])
+        self.config2["int"] = 3
+        self.assertEqual(list(self.config2.overrides()), [("int", 3)])
+        self.assertEqual(Config2()["int"], 42)
+        self.config2["int"] = self.config2.parameters["int"].default
+        self.assertEqual(list(self.config2.overrides()), [])
+        self.assertEqual(self.config2, Config2())
+
+    def test_convert(self):
+        values = self.config2.convert([("int", "3"), ("bool", "")], None)
+        self.assertEqual(values, {"int": 3, "bool": False})
+        self.assertRaises(KeyError, self.config2.convert, [("nope", "")],
+                          None)
+
 
 class TestTypes(unittest.TestCase):
 
@@ -166,6 +191,25 @@ class TestTypes(unittest.TestCase):
         self.assertRaises(ValueError, spinfloat.from_string, "0.1")
 
 
+class TestListOf(unittest.TestCase):
+
+    def setUp(self):
+        self.param = base.ListOf(base.Integer(0))
+
+    def test_round_trip(self):
+        string = self.param.to_string([1, 2])
+        self.assertEqual(string, "['1', '2']")
+        self.assertEqual(self.param.from_string(string), [1, 2])
+        self.assertEqual(self.param.from_string("[]"), [])
+
+    def test_no_code(self):
+        """The list is parsed as a literal, not evaluated."""
+
+        for string in ("__import__('os').getcwd()", "[x for x in 'ab']",
+                       "'12'", "[1, 2]", "<map object at 0x7f>"):
+            self.assertRaises(ValueError, self.param.from_string, string)
+
+
 class TestBase(unittest.TestCase):
 
     def setUp(self):
@@ -22,9 +22,10 @@ import signal
 from twisted.trial import unittest
 from twisted.internet import error, defer
 from twisted.test import proto_helpers
+from twisted.python import failure
 
 from virtualbricks import errors, link, bricks
-from virtualbricks.tests import stubs, successResultOf
+from virtualbricks.tests import stubs, successResultOf, failureResultOf
 
 
 def kill(passthru, brick):
@@ -209,3 +210,90 @@ class TestVDEProcessProtocol(unittest.TestCase):
         self.assertEqual(len(self.proto.queue), 0)
         self.proto.data_received(self.PROMPT)
         self.assertTrue(self.transport.disconnecting)
+
+    def test_reply(self):
+        d = self.proto.send_command(self.CMD1)
+        self.proto.data_received(b"1000 Success\n\n" + self.PROMPT)
+        reply = successResultOf(self, d)
+        self.assertEqual((reply.command, reply.code, reply.message),
+                         (self.CMD1, 1000, "Success"))
+
+    def test_reply_data(self):
+        d = self.proto.send_command(b"port/print")
+        self.proto.data_received(b"0000 DATA END WITH '.'\nPort 0001\n"
+                                 b"Port 0002\n.\n1000 Success\n\n" +
+                                 self.PROMPT)
+        self.assertEqual(successResultOf(self, d).data,
+                         ["Port 0001", "Port 0002"])
+
+    def test_error(self):
+        d = self.proto.send_command(b"port/setnumports foo")
+        self.proto.data_received(b"1022 Invalid argument\n\n" + self.PROMPT)
+        err = failureResultOf(self, d, bricks.CommandError).value
+        self.assertEqual((err.code, err.message), (1022, "Invalid argument"))
+
+    def test_split_chunks(self):
+        """Replies and prompts may be split between chunks."""
+
+        d1 = self.proto.send_command(self.CMD1)
+        d2 = self.proto.send_command(self.CMD2)
+        self.proto.data_received(b"1000 Succ")
+        self.proto.data_received(b"ess\n\nvd")
+        self.assertNoResult(d1)
+        self.proto.data_received(b"e$ 1001 Operation not permitted\n\nvde$")
+        self.assertEqual(successResultOf(self, d1).code, 1000)
+        self.proto.data_received(b" ")
+        failureResultOf(self, d2, bricks.CommandError)
+
+    def test_pipeline(self):
+        """Up to PIPELINE_SIZE commands are written without waiting for the
+        replies."""
+
+        self.proto.PIPELINE_SIZE = 2
+        for i in range(3):
+            self.proto.send_command("cmd{0}\n".format(i))
+        self.assertEqual(self.transport.value(), b"cmd0\ncmd1\n")
+        self.proto.data_received(self.PROMPT)
+        self.assertEqual(self.transport.value(), b"cmd0\ncmd1\ncmd2\n")
+
+    def test_batch(self):
+        """A batch is written at once, regardless of the pipeline size."""
+
+        writes = []
+        self.patch(self.transport, "writeSequence", writes.append)
+        self.proto.PIPELINE_SIZE = 1
+        cmds = [b"port/setvlan " + str(i).encode() + b" 1"
+                for i in range(128)]
+        d = self.proto.send_batch(cmds)
+        self.assertEqual(writes, [[b for cmd in cmds for b in (cmd, b"\n")]])
+        self.proto.data_received((b"1000 Success\n\n" + self.PROMPT) * 128)
+        self.assertEqual([r.command for r in successResultOf(self, d)], cmds)
+
+    def test_batch_error(self):
+        """A batch fails with the first error."""
+
+        d = self.proto.send_batch([self.CMD1, self.CMD2])
+        self.proto.data_received(b"1000 Success\n\n" + self.PROMPT +
+                                 b"1022 Invalid argument\n\n" + self.PROMPT)
+        err = failureResultOf(self, d, bricks.CommandError).value
+        self.assertEqual(err.command, self.CMD2)
+
+    def test_chunk_without_newline(self):
+        """A chunk without a newline does not move back the start of the
+        search for the prompt."""
+
+        d = self.proto.send_command(self.CMD1)
+        self.proto.data_received(b"abc\nde")
+        self.assertEqual(self.proto._scan, 4)
+        self.proto.data_received(b"fg")
+        self.assertEqual(self.proto._scan, 4)
+        self.proto.data_received(b"\n" + self.PROMPT)
+        self.assertEqual(successResultOf(self, d).command, self.CMD1)
+        self.assertEqual(self.proto._scan, 0)
+
+    def test_process_ended(self):
+        """Pending commands fail when the process ends."""
+
+        d = self.proto.send_command(self.CMD1)
+        self.proto.processEnded(failure.Failure(error.ProcessDone(0)))
+        failureResultOf(self, d, error.ProcessDone)
@@ -0,0 +1,184 @@
+# Virtualbricks - a vde/qemu gui written in python and GTK/Glade.
+# Copyright (C) 2018 Virtualbricks team
+
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+import os
+
+from twisted.trial import unittest
+from twisted.internet import defer
+
+from virtualbricks import capabilities, settings
+from virtualbricks.tests import successResultOf, failureResultOf
+
+
+VERSION = b"QEMU emulator version 2.11.1\n"
+
+
+class _Run:
+
+    def __init__(self, code=0):
+        self.code = code
+        self.calls = []
+        self.pending = None
+
+    def __call__(self, executable, args, env):
+        self.calls.append(args)
+        if self.pending is not None:
+            d = defer.Deferred()
+            self.pending.append(d)
+            return d
+        return defer.succeed((VERSION if args == ["-version"] else b"",
+                              b"error", self.code))
+
+
+def touch(path, mode=0o755):
+    with open(path, "w"):
+        pass
+    os.chmod(path, mode)
+
+
+class TestResolve(unittest.TestCase):
+
+    def setUp(self):
+        self.bindir = self.mktemp()
+        os.mkdir(self.bindir)
+        self.vde_switch = os.path.join(self.bindir, "vde_switch")
+        touch(self.vde_switch)
+        self.filename = self.mktemp()
+        self.capabilities = capabilities.Capabilities(self.filename)
+
+    def test_resolve(self):
+        """The lookups are cached until they are invalidated."""
+
+        resolve = self.capabilities.resolve
+        self.assertEqual(resolve(self.bindir, "vde_switch"), self.vde_switch)
+        self.assertIs(resolve(self.bindir, "vde_plug"), None)
+        self.patch(os, "access", lambda *args: self.fail("not cached"))
+        self.assertEqual(resolve(self.bindir, "vde_switch"), self.vde_switch)
+        self.assertIs(resolve(self.bindir, "vde_plug"), None)
+        self.capabilities.invalidate()
+        self.assertRaises(self.failureException, resolve, self.bindir,
+                          "vde_switch")
+
+    def test_installed(self):
+        """An executable installed after a lookup is found, the directory
+        changed."""
+
+        self.assertIs(self.capabilities.resolve(self.bindir, "vde_plug"),
+                      None)
+        touch(os.path.join(self.bindir, "vde_plug"))
+        stat = os.stat(self.bindir)
+        os.utime(self.bindir, ns=(stat.st_atime_ns,
+                                  stat.st_mtime_ns + 10 ** 9))
+        self.assertEqual(self.capabilities.resolve(self.bindir, "vde_plug"),
+                         os.path.join(self.bindir, "vde_plug"))
+        os.remove(self.vde_switch)
+        self.assertIs(self.capabilities.resolve(self.bindir, "vde_switch"),
+                      None)
+
+    def test_search_path(self):
+        other = self.mktemp()
+        os.mkdir(other)
+        path = os.pathsep.join([other, self.bindir])
+        self.assertEqual(self.capabilities.resolve(path, "vde_switch"),
+                         self.vde_switch)
+
+    def test_persist(self):
+        """The lookups are saved and loaded if the directory did not
+        change."""
+
+        self.capabilities.resolve(self.bindir, "vde_switch")
+        self.capabilities.save()
+        self.assertTrue(os.path.exists(self.filename))
+        self.patch(os, "access", lambda *args: self.fail("not cached"))
+        loaded = capabilities.Capabilities(self.filename)
+        self.assertEqual(loaded.resolve(self.bindir, "vde_switch"),
+                         self.vde_switch)
+
+    def test_directory_changed(self):
+        self.capabilities.resolve(self.bindir, "vde_plug")
+        self.capabilities.save()
+        touch(os.path.join(self.bindir, "vde_plug"))
+        stat = os.stat(self.bindir)
+        os.utime(self.bindir, ns=(stat.st_atime_ns,
+                                  stat.st_mtime_ns + 10 ** 9))
+        loaded = capabilities.Capabilities(self.filename)
+        self.assertEqual(loaded.resolve(self.bindir, "vde_plug"),
+                         os.path.join(self.bindir, "vde_plug"))
+
+    def test_settings_changed(self):
+        """Changing vdepath or qemupath invalidates the lookups."""
+
+        self.patch(capabilities, "cache", self.capabilities)
+        self.capabilities.resolve(self.bindir, "vde_switch")
+        self.addCleanup(settings.set, "vdepath", settings.get("vdepath"))
+        settings.set("vdepath", self.bindir)
+        self.assertEqual(self.capabilities._directories, {})
+
+
+class TestProbe(unittest.TestCase):
+
+    def setUp(self):
+        self.qemu = os.path.abspath(self.mktemp())
+        touch(self.qemu)
+        self.filename = self.mktemp()
+        self.run = _Run()
+        self.capabilities = capabilities.Capabilities(self.filename, self.run)
+
+    def test_probe(self):
+        probe = successResultOf(self, self.capabilities.probe(self.qemu))
+        self.assertEqual(probe["version"], VERSION.decode())
+        self.assertEqual(sorted(probe), ["cpus", "devices", "machines",
+                                         "mtime", "version"])
+        self.assertEqual(self.run.calls, [args for _, args in
+                                          capabilities.PROBES])
+        successResultOf(self, self.capabilities.probe(self.qemu))
+        self.assertEqual(len(self.run.calls), 4)
+
+    def test_persist(self):
+        """The probes are saved, the binary is probed again if it
+        changes."""
+
+        self.capabilities.probe(self.qemu)
+        run = _Run()
+        loaded = capabilities.Capabilities(self.filename, run)
+        successResultOf(self, loaded.probe(self.qemu))
+        self.assertEqual(run.calls, [])
+        stat = os.stat(self.qemu)
+        os.utime(self.qemu, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+        successResultOf(self, loaded.probe(self.qemu))
+        self.assertEqual(len(run.calls), 4)
+
+    def test_concurrent(self):
+        """A binary is probed once even if it is requested many times."""
+
+        self.run.pending = []
+        d1 = self.capabilities.probe(self.qemu)
+        d2 = self.capabilities.probe(self.qemu)
+        self.assertEqual(len(self.run.calls), 4)
+        for d in self.run.pending:
+            d.callback((VERSION, b"", 0))
+        self.assertIs(successResultOf(self, d1),
+                      successResultOf(self, d2))
+
+    def test_failure(self):
+        self.run.code = 1
+        failureResultOf(self, self.capabilities.probe(self.qemu), OSError)
+        self.assertFalse(os.path.exists(self.filename))
+
+    def test_missing(self):
+        failureResultOf(self, self.capabilities.probe(self.mktemp()),
+                        OSError)
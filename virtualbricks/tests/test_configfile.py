@@ -68,8 +68,8 @@ class TestConfigFile(unittest.TestCase):
 
         self.assertEqual(configfile.__all__,
             ["BrickBuilder", "ConfigFile", "EventBuilder", "ImageBuilder",
-             "LinkBuilder", "SockBuilder", "log_events", "restore",
-             "safe_save", "save"])
+             "LinkBuilder", "SockBuilder", "log_events", "project_filename",
+             "restore", "safe_save", "save"])
 
     def test_exported_log_events(self):
         """
@@ -83,7 +83,9 @@ class TestConfigFile(unittest.TestCase):
              configfile.cannot_restore_backup, configfile.backup_restored,
              configfile.image_found, configfile.skip_image,
              configfile.skip_image_noa, configfile.config_dump,
-             configfile.open_project, configfile.config_save_error])
+             configfile.open_project, configfile.config_save_error,
+             configfile.cannot_load_line, configfile.cannot_load_snapshot,
+             configfile.snapshot_restored, configfile.journal_replayed])
 
     def test_restore_backup_does_not_exists(self):
         """Try to restore a backup that does not exists."""
@@ -273,6 +275,40 @@ class TestParser(unittest.TestCase):
         expected = tuple(line[:-1].split("|"))
         self.assertEqual(list(parser), [expected])
 
+    def test_line_numbers(self):
+        """The tokens are yielded with the line where they start."""
+
+        tokens = _configparser.Parser(CONFIG1).tokens()
+        self.assertEqual([lineno for lineno, _ in tokens], [2, 5, 12, 14, 16])
+
+    def test_section_complete(self):
+        """A section is yielded with all its options."""
+
+        _, section = next(_configparser.Parser(CONFIG1).tokens())
+        self.assertEqual(list(section),
+                         [("path", "/vimages/vtatpa.martin.qcow2")])
+
+    def test_read_once(self):
+        """The file is read once, the parser does not seek."""
+
+        fileobj = six.StringIO(CONFIG1)
+        fileobj.seek = fileobj.tell = lambda *args: self.fail("seek")
+        self.assertEqual(len(list(_configparser.Parser(fileobj))), 5)
+
+    def test_skip_line(self):
+        """The lines not understood are skipped and logged."""
+
+        observer = LoggingObserver()
+        self.addCleanup(_configparser.line_skipped.tap(
+            observer, _configparser.logger.publisher))
+        content = "[Switch:sw1]\nnumports=32\n*garbage*\n"
+        sections = list(_configparser.Parser(content))
+        self.assertEqual(len(sections), 1)
+        self.assertEqual(list(sections[0]), [("numports", "32")])
+        self.assertEqual(len(observer), 1)
+        self.assertEqual(observer[0]["lineno"], 3)
+        self.assertEqual(observer[0]["line"], "*garbage*")
+
 
 OLD_CONFIG_FILE = """
 [Project:/home/user/.virtualbricks.vbl]
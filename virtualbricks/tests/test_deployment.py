@@ -53,6 +53,7 @@ GUI_DATA_FILES = set([
     "help/delay.txt",
     "help/loss.txt",
     "importdialog.ui",
+    "jobs.ui",
     "listprojects.ui",
     "loadimagedialog.ui",
     "logging.ui",
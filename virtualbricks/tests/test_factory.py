@@ -15,11 +15,17 @@
 # with this program; if not, write to the Free Software Foundation, Inc.,
 # 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
 
+import os
+
 from twisted.trial import unittest
+from twisted.internet import defer, task
 
+from virtualbricks import power, virtualmachines
 from virtualbricks.tools import is_running
 from virtualbricks.tests import stubs, successResultOf
-from virtualbricks.errors import BrickRunningError
+from virtualbricks.errors import (BrickRunningError, ImageAlreadyInUseError,
+                                  InvalidNameError, InvalidTypeError,
+                                  NameAlreadyInUseError, NotConnectedError)
 
 
 class TestFactory(unittest.TestCase):
@@ -70,6 +76,19 @@ class TestFactory(unittest.TestCase):
         factory.del_brick(brick)
         self.assertEqual(factory.bricks, [])
 
+    def test_del_brick_socks(self):
+        """The socks of a deleted brick are removed, the others are kept."""
+
+        factory = stubs.Factory()
+        switch = factory.new_brick("switch", "sw")
+        vm = factory.new_brick("vm", "vm")
+        vm.add_sock()
+        factory.del_brick(vm)
+        self.assertEqual(factory.socks, switch.socks)
+        self.assertIs(factory.get_sock_by_name("vm_sock_eth0"), None)
+        factory.del_brick(switch)
+        self.assertEqual(factory.socks, [])
+
     def test_del_running_brick(self):
         """If the brick is running, it cannot be removed."""
 
@@ -79,3 +98,186 @@ class TestFactory(unittest.TestCase):
         self.assertRaises(BrickRunningError, factory.del_brick, brick)
         self.assertEqual(factory.bricks, [brick])
         self.assertTrue(is_running(brick))
+
+    def test_get_brick_by_name_after_rename(self):
+        """The name index follows the renames of the bricks."""
+
+        factory = stubs.Factory()
+        brick = factory.new_brick("stub", "test_brick")
+        brick.rename("renamed")
+        self.assertIs(factory.get_brick_by_name("renamed"), brick)
+        self.assertIs(factory.get_brick_by_name("test_brick"), None)
+        self.assertTrue(factory.is_in_use("renamed"))
+        self.assertFalse(factory.is_in_use("test_brick"))
+        factory.del_brick(brick)
+        self.assertIs(factory.get_brick_by_name("renamed"), None)
+        self.assertFalse(factory.is_in_use("renamed"))
+
+    def test_switch_rename_socks(self):
+        """Renaming a switch moves its socks under the new nickname."""
+
+        factory = stubs.Factory()
+        switch = factory.new_brick("switch", "sw")
+        sock = factory.get_sock_by_name("sw_port")
+        self.assertIs(sock, switch.socks[0])
+        switch.rename("sw2")
+        self.assertIs(factory.get_sock_by_name("sw2_port"), sock)
+        self.assertIs(factory.get_sock_by_name("sw_port"), None)
+        factory.del_brick(switch)
+        self.assertIs(factory.get_sock_by_name("sw2_port"), None)
+
+    def test_rename_event(self):
+        factory = stubs.Factory()
+        event = factory.new_event("test_event")
+        factory.rename_event(event, "renamed")
+        self.assertIs(factory.get_event_by_name("renamed"), event)
+        self.assertIs(factory.get_event_by_name("test_event"), None)
+        self.assertRaises(NameAlreadyInUseError, factory.new_brick, "stub",
+                          "renamed")
+
+    def test_image_index(self):
+        factory = stubs.Factory()
+        path = os.path.abspath(self.mktemp())
+        image = factory.new_disk_image("test_image", path)
+        self.assertIs(factory.get_image_by_path(path), image)
+        self.assertRaises(ImageAlreadyInUseError, factory.new_disk_image,
+                          "other", path)
+        image.name = "renamed"
+        self.assertIs(factory.get_image_by_name("renamed"), image)
+        self.assertIs(factory.get_image_by_name("test_image"), None)
+        factory.remove_disk_image(image)
+        self.assertIs(factory.get_image_by_name("renamed"), None)
+        self.assertIs(factory.get_image_by_path(path), None)
+
+    def test_vm_sock_index(self):
+        factory = stubs.Factory()
+        vm = factory.new_brick("vm", "vm")
+        sock = vm.add_sock()
+        self.assertIs(factory.get_sock_by_name("vm_sock_eth0"), sock.original)
+        other = factory.new_brick("vm", "other")
+        factory.connect_to(other, "vm_sock_eth0")
+        self.assertIs(other.plugs[0].sock, sock.original)
+
+
+class TestNewBricks(unittest.TestCase):
+
+    def setUp(self):
+        self.factory = stubs.Factory()
+        self.added = []
+        self.factory.connect("brick-added", self.added.append)
+        self.factory.connect("bricks-added", self.added.append)
+
+    def test_new_bricks(self):
+        """All the bricks are created and a single notification is sent."""
+
+        sw, vm1, vm2 = self.factory.new_bricks(
+            [("switch", "sw"), ("vm", "vm1"), ("vm", "vm2")],
+            [("vm1", "sw"), ("vm2", "sw_port")])
+        self.assertEqual(self.factory.bricks, [sw, vm1, vm2])
+        self.assertEqual(self.added, [[sw, vm1, vm2]])
+        self.assertIs(self.factory.get_brick_by_name("vm2"), vm2)
+        self.assertEqual([p.sock for p in vm1.plugs], [sw.socks[0]])
+        self.assertEqual([p.sock for p in vm2.plugs], [sw.socks[0]])
+
+    def test_link_existing(self):
+        sw = self.factory.new_brick("switch", "sw")
+        vm, = self.factory.new_bricks([("vm", "vm")], [("vm", "sw")])
+        self.assertIs(vm.plugs[0].sock, sw.socks[0])
+
+    def test_duplicate_names(self):
+        """Names are validated before creating any brick."""
+
+        self.factory.new_brick("switch", "sw")
+        del self.added[:]
+        for specs in ([("vm", "vm"), ("vm", "vm")], [("vm", "vm"),
+                                                     ("switch", "sw")]):
+            self.assertRaises(NameAlreadyInUseError, self.factory.new_bricks,
+                              specs)
+        self.assertRaises(InvalidTypeError, self.factory.new_bricks,
+                          [("vm", "vm"), ("nothing", "other")])
+        self.assertEqual(len(self.factory.bricks), 1)
+        self.assertEqual(self.added, [])
+
+    def test_invalid_endpoint(self):
+        """On invalid links no brick or sock is left in the factory."""
+
+        self.assertRaises(NotConnectedError, self.factory.new_bricks,
+                          [("switch", "sw"), ("vm", "vm")],
+                          [("vm", "nowhere")])
+        self.assertEqual(self.factory.bricks, [])
+        self.assertEqual(self.factory.socks, [])
+        self.assertIs(self.factory.get_sock_by_name("sw_port"), None)
+        self.assertRaises(InvalidNameError, self.factory.new_bricks,
+                          [("switch", "sw")], [("vm", "sw")])
+
+
+class TestCloneMany(unittest.TestCase):
+
+    def setUp(self):
+        self.factory = stubs.Factory()
+        self.switch = self.factory.new_brick("switch", "sw")
+        self.template = self.factory.new_brick("vm", "vm")
+        self.template.add_plug(self.switch.socks[0], model="e1000")
+        self.image = self.factory.new_disk_image("base", self.mktemp())
+        self.template.set_image("hda", self.image)
+        self.cows = []
+        self.patch(virtualmachines.Disk, "get_real_disk_name",
+                   lambda disk: self.cows.append(disk) or defer.succeed(""))
+        self.clock = task.Clock()
+
+    def test_clone_many(self):
+        d = self.factory.clone_many(self.template, 3, clock=self.clock)
+        clones = successResultOf(self, d).bricks
+        self.assertEqual([c.name for c in clones], ["vm_1", "vm_2", "vm_3"])
+        macs = set([self.template.plugs[0].mac])
+        for clone in clones:
+            plug, = clone.plugs
+            self.assertIs(plug.sock, self.switch.socks[0])
+            self.assertEqual(plug.model, "e1000")
+            macs.add(plug.mac)
+            self.assertIs(clone.config["hda"].image, self.image)
+            self.assertIs(clone.config["hda"].VM, clone)
+            self.assertTrue(clone.config["privatehda"])
+        self.assertEqual(len(macs), 4)
+        self.assertEqual([d.VM for d in self.cows], clones)
+
+    def test_unused_disks(self):
+        """The clones do not create the disks that the template does not
+        use."""
+
+        self.template.set({"ram": 512})
+        d = self.factory.clone_many(self.template, 2, clock=self.clock)
+        for clone in successResultOf(self, d).bricks:
+            self.assertEqual([disk.device for disk in clone.disks()], ["hda"])
+            self.assertEqual(clone.config["ram"], 512)
+
+    def test_rule(self):
+        other = self.factory.new_brick("switch", "sw2")
+        socks = [self.switch.socks[0], other.socks[0]]
+        d = self.factory.clone_many(self.template, 4, "worker{index}",
+                                    lambda i, plug: socks[(i - 1) % 2],
+                                    clock=self.clock)
+        clones = successResultOf(self, d).bricks
+        self.assertEqual([c.plugs[0].sock for c in clones], socks * 2)
+        self.assertIs(self.factory.get_brick_by_name("worker4"), clones[3])
+
+    def test_throughput(self):
+        self.patch(virtualmachines.Disk, "get_real_disk_name",
+                   lambda disk: task.deferLater(self.clock, 1, lambda: ""))
+        d = self.factory.clone_many(self.template, 4, clock=self.clock)
+        self.clock.pump([1, 1])
+        result = successResultOf(self, d)
+        self.assertEqual(result.elapsed, 1)
+        self.assertEqual(result.rate, 4)
+
+    def test_not_a_vm(self):
+        self.assertRaises(InvalidTypeError, self.factory.clone_many,
+                          self.switch, 2)
+
+    def test_poweron_all_overlays(self):
+        """poweron_all creates the COW images before starting the bricks."""
+
+        self.template.set({"privatehda": True})
+        self.patch(power, "poweron_all", lambda bricks, max_parallel:
+                   self.assertEqual(self.cows, [self.template.config["hda"]]))
+        successResultOf(self, self.factory.poweron_all())
@@ -0,0 +1,181 @@
+# Virtualbricks - a vde/qemu gui written in python and GTK/Glade.
+# Copyright (C) 2018 Virtualbricks team
+
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+import io
+import os
+
+from twisted.trial import unittest
+
+from virtualbricks import imageinfo
+from virtualbricks.imageinfo import ImageFormat
+
+
+BACKING = b"/images/base.img"
+GiB = 1 << 30
+
+
+def qcow2(snapshots=()):
+    table = b""
+    for id_str, name in snapshots:
+        entry = imageinfo.QCOW2_SNAPSHOT.pack(0, 0, len(id_str), len(name),
+                                              1000, 0, 42, 1024, 0)
+        entry += id_str + name
+        table += entry.ljust((len(entry) + 7) & ~7, b"\x00")
+    header = imageinfo.QCOW2_HEADER.pack(
+        b"QFI\xfb", 3, 104, len(BACKING), 16, 10 * GiB, 0, 0, 0, 0, 0,
+        len(snapshots), 512)
+    return (header.ljust(104, b"\x00") + BACKING).ljust(512, b"\x00") + table
+
+
+def qcow():
+    header = imageinfo.QCOW_HEADER.pack(b"QFI\xfb", 1, 48, len(BACKING), 0,
+                                        GiB, 12, 9)
+    return header.ljust(48, b"\x00") + BACKING
+
+
+def qed():
+    header = imageinfo.QED_HEADER.pack(b"QED\x00", 65536, 4, 1, 1, 0, 0, 0,
+                                       2 * GiB, 64, len(BACKING))
+    return header + BACKING
+
+
+def vmdk():
+    descriptor = b'# Disk DescriptorFile\nparentFileNameHint="base.vmdk"\n'
+    header = imageinfo.VMDK_HEADER.pack(b"KDMV", 1, 3, 2 * GiB // 512, 128,
+                                        1, 1)
+    return header.ljust(512, b"\x00") + descriptor.ljust(512, b"\x00")
+
+
+def vdi():
+    return imageinfo.VDI_HEADER.pack(
+        b"<<< Oracle VM VirtualBox Disk Image >>>\n", 0xbeda107f, 0x00010001,
+        400, 1, 0, b"", 512, 1024, 0, 0, 0, 512, 0, 4 * GiB, 1 << 20)
+
+
+def vpc():
+    footer = imageinfo.VPC_FOOTER.pack(b"conectix", 2, 0x00010000, 512, 0,
+                                       b"qemu", 0, b"Wi2k", GiB, GiB)
+    parent = "base.vhd".encode("utf-16-be")
+    dynamic = imageinfo.VPC_DYNAMIC.pack(b"cxsparse", 2 ** 64 - 1, 1536,
+                                         0x00010000, 512, 2 << 20, 0,
+                                         b"\x00" * 16, 0, 0, parent)
+    return footer.ljust(512, b"\x00") + dynamic
+
+
+class TestReadInfo(unittest.TestCase):
+
+    def read(self, data):
+        return imageinfo.read_info(io.BytesIO(data))
+
+    def test_qcow2(self):
+        info = self.read(qcow2([(b"1", b"virtualbricks"), (b"2", b"other")]))
+        self.assertEqual(info.format, ImageFormat.QCOW2)
+        self.assertEqual(info.version, 3)
+        self.assertEqual(info.virtual_size, 10 * GiB)
+        self.assertEqual(info.cluster_size, 65536)
+        self.assertEqual(info.backing_file, BACKING.decode())
+        self.assertEqual([(s.id, s.name) for s in info.snapshots],
+                         [("1", "virtualbricks"), ("2", "other")])
+        self.assertEqual(info.snapshots[0].vm_state_size, 1024)
+
+    def test_qcow(self):
+        info = self.read(qcow())
+        self.assertEqual((info.format, info.virtual_size, info.cluster_size,
+                          info.backing_file),
+                         (ImageFormat.QCOW, GiB, 4096, BACKING.decode()))
+
+    def test_qed(self):
+        info = self.read(qed())
+        self.assertEqual((info.format, info.virtual_size, info.cluster_size,
+                          info.backing_file),
+                         (ImageFormat.QED, 2 * GiB, 65536, BACKING.decode()))
+
+    def test_vmdk(self):
+        info = self.read(vmdk())
+        self.assertEqual((info.format, info.virtual_size, info.cluster_size,
+                          info.backing_file),
+                         (ImageFormat.VMDK, 2 * GiB, 65536, "base.vmdk"))
+
+    def test_vmdk_descriptor(self):
+        info = self.read(b'# Disk DescriptorFile\nversion=1\n'
+                         b'RW 2048 SPARSE "disk-s001.vmdk"\n'
+                         b'RW 2048 SPARSE "disk-s002.vmdk"\n')
+        self.assertEqual((info.format, info.virtual_size, info.backing_file),
+                         (ImageFormat.VMDK, 2 * 2048 * 512, None))
+
+    def test_vdi(self):
+        info = self.read(vdi())
+        self.assertEqual((info.format, info.virtual_size, info.cluster_size),
+                         (ImageFormat.VDI, 4 * GiB, 1 << 20))
+
+    def test_vpc(self):
+        info = self.read(vpc())
+        self.assertEqual((info.format, info.virtual_size, info.cluster_size,
+                          info.backing_file),
+                         (ImageFormat.VPC, GiB, 2 << 20, "base.vhd"))
+
+    def test_fixed_vpc(self):
+        """Fixed VPC images have the footer only at the end."""
+
+        footer = imageinfo.VPC_FOOTER.pack(b"conectix", 2, 0x00010000,
+                                           2 ** 64 - 1, 0, b"qemu", 0, b"Wi2k",
+                                           4096, 4096)
+        info = self.read(b"\x00" * 4096 + footer.ljust(512, b"\x00"))
+        self.assertEqual((info.format, info.virtual_size, info.backing_file),
+                         (ImageFormat.VPC, 4096, None))
+
+    def test_raw(self):
+        info = self.read(b"\x00" * 4096)
+        self.assertEqual((info.format, info.virtual_size, info.backing_file),
+                         (ImageFormat.RAW, 4096, None))
+
+    def test_truncated(self):
+        """Truncated or corrupted headers do not raise errors."""
+
+        info = self.read(qcow2()[:20])
+        self.assertEqual(info.format, ImageFormat.QCOW2)
+        self.assertIs(info.backing_file, None)
+
+
+class TestCache(unittest.TestCase):
+
+    def setUp(self):
+        self.path = self.mktemp()
+        with open(self.path, "wb") as fp:
+            fp.write(qcow2())
+        self.addCleanup(imageinfo.clear_cache)
+
+    def test_cached(self):
+        calls = []
+        read_info = imageinfo.read_info
+        self.patch(imageinfo, "read_info",
+                   lambda fp: calls.append(fp) or read_info(fp))
+        info = imageinfo.info(self.path)
+        self.assertIs(imageinfo.info(self.path), info)
+        self.assertEqual(len(calls), 1)
+
+    def test_invalidate(self):
+        """The cache is invalidated if the file changes."""
+
+        self.assertEqual(imageinfo.backing_file(self.path), BACKING.decode())
+        with open(self.path, "wb") as fp:
+            fp.write(qcow())
+        os.utime(self.path, (0, 0))
+        self.assertEqual(imageinfo.info(self.path).format, ImageFormat.QCOW)
+
+    def test_missing(self):
+        self.assertRaises(IOError, imageinfo.info, self.mktemp())
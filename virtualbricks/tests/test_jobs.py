@@ -0,0 +1,184 @@
+# Virtualbricks - a vde/qemu gui written in python and GTK/Glade.
+# Copyright (C) 2018 Virtualbricks team
+
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+from twisted.trial import unittest
+from twisted.internet import defer, error, task
+from twisted.python import failure
+from twisted.test import proto_helpers
+
+from virtualbricks import console, jobs
+from virtualbricks.tests import stubs, successResultOf, failureResultOf
+
+
+class _Transport:
+
+    def __init__(self):
+        self.signals = []
+
+    def signalProcess(self, signal):
+        self.signals.append(signal)
+
+
+class _Reactor(task.Clock):
+
+    def __init__(self):
+        task.Clock.__init__(self)
+        self.spawned = []
+
+    def spawnProcess(self, proto, executable, args, env, path):
+        transport = _Transport()
+        self.spawned.append((proto, args, transport))
+        return transport
+
+
+def exit(proto, code=0, signal=None):
+    if code == 0 and signal is None:
+        reason = error.ProcessDone(0)
+    else:
+        reason = error.ProcessTerminated(code, signal)
+    proto.processEnded(failure.Failure(reason))
+
+
+class TestJobManager(unittest.TestCase):
+
+    def setUp(self):
+        self.reactor = _Reactor()
+        self.manager = jobs.JobManager(slots=2, io_slots=1, history=3,
+                                       reactor=self.reactor)
+
+    def test_run(self):
+        d = self.manager.run("qemu-img", ["info", "disk"], {})
+        [(proto, args, _)] = self.reactor.spawned
+        self.assertEqual(args, ["qemu-img", "info", "disk"])
+        proto.outReceived(b"out")
+        proto.errReceived(b"err")
+        exit(proto, 1)
+        self.assertEqual(successResultOf(self, d), (b"out", b"err", 1))
+        [job] = self.manager.history
+        self.assertEqual(job.state, jobs.FAILED)
+        self.assertEqual(self.manager.running(), [])
+
+    def test_slots(self):
+        """No more than C{slots} jobs run, no more than C{io_slots} of them
+        are I/O bound."""
+
+        first = self.manager.submit("tar", io=True)
+        second = self.manager.submit("tar", io=True)
+        third = self.manager.submit("qemu-img", io=False)
+        self.assertEqual(self.manager.running(), [first, third])
+        self.assertEqual(second.state, jobs.QUEUED)
+        exit(self.reactor.spawned[0][0])
+        self.assertEqual(first.state, jobs.DONE)
+        self.assertEqual(second.state, jobs.RUNNING)
+
+    def test_priority(self):
+        self.manager.configure(1, 1)
+        self.manager.submit("tar")
+        low = self.manager.submit("tar", priority=jobs.LOW)
+        high = self.manager.submit("tar", priority=jobs.HIGH)
+        self.assertEqual(self.manager.queued(), [high, low])
+
+    def test_progress(self):
+        job = self.manager.submit("qemu-img", ["commit", "-p", "disk"])
+        changes = []
+        self.manager.connect("job-changed", lambda j: changes.append(
+            j.progress))
+        proto = self.reactor.spawned[0][0]
+        proto.outReceived(b"    (0.00/100%)\r    (12.")
+        self.assertEqual(job.progress, 0.0)
+        proto.outReceived(b"50/100%)\r")
+        self.assertEqual(job.progress, 12.5)
+        exit(proto)
+        self.assertEqual(job.progress, 100.0)
+        self.assertEqual(changes, [0.0, 12.5, 100.0])
+
+    def test_cancel_queued(self):
+        self.manager.configure(1, 1)
+        self.manager.submit("tar")
+        job = self.manager.submit("tar")
+        self.manager.cancel(job.id)
+        self.assertEqual(job.state, jobs.CANCELLED)
+        failureResultOf(self, job.deferred, defer.CancelledError)
+        self.assertEqual(len(self.reactor.spawned), 1)
+
+    def test_cancel_running(self):
+        """A running job is terminated, then killed if it does not exit."""
+
+        job = self.manager.submit("tar")
+        proto, _, transport = self.reactor.spawned[0]
+        job.deferred.cancel()
+        self.assertEqual(transport.signals, ["TERM"])
+        failureResultOf(self, job.deferred, defer.CancelledError)
+        self.reactor.advance(jobs.KILL_DELAY)
+        self.assertEqual(transport.signals, ["TERM", "KILL"])
+        exit(proto, None, 9)
+        self.assertEqual(job.state, jobs.CANCELLED)
+
+    def test_killed(self):
+        job = self.manager.submit("tar")
+        exit(self.reactor.spawned[0][0], None, 9)
+        failureResultOf(self, job.deferred, error.ProcessTerminated)
+        self.assertEqual(job.state, jobs.FAILED)
+
+    def test_history(self):
+        removed = []
+        self.manager.connect("job-removed", removed.append)
+        submitted = [self.manager.submit("qemu-img", io=False)
+                     for _ in range(4)]
+        # Only two slots, the others are spawned when the first ones exit
+        for proto, _, _ in self.reactor.spawned:
+            exit(proto)
+        self.assertEqual(list(self.manager.history), submitted[1:])
+        self.assertEqual(removed, submitted[:1])
+        self.assertRaises(KeyError, self.manager.get, submitted[0].id)
+
+    def test_spawn_error(self):
+        def spawnProcess(*args):
+            raise OSError("no such file")
+
+        self.reactor.spawnProcess = spawnProcess
+        job = self.manager.submit("tar")
+        failureResultOf(self, job.deferred, OSError)
+        self.assertEqual(job.state, jobs.FAILED)
+        self.flushLoggedErrors(OSError)
+
+
+class TestJobsCommand(unittest.TestCase):
+
+    def setUp(self):
+        self.reactor = _Reactor()
+        self.factory = stubs.Factory()
+        self.factory.jobs = jobs.JobManager(reactor=self.reactor)
+        self.protocol = console.VBProtocol(self.factory)
+        self.transport = proto_helpers.StringTransport()
+        self.protocol.makeConnection(self.transport)
+        self.transport.clear()
+
+    def test_list(self):
+        self.factory.jobs.submit("qemu-img", ["commit", "-p", "disk"])
+        self.protocol.lineReceived(b"jobs")
+        lines = self.transport.value().decode().splitlines()
+        self.assertEqual(lines[2].split("\t"),
+                         ["1", "running", "-", "0.0",
+                          "qemu-img commit -p disk"])
+
+    def test_cancel(self):
+        job = self.factory.jobs.submit("tar")
+        self.protocol.lineReceived(b"jobs cancel 1")
+        self.assertTrue(job.cancelling)
+        self.protocol.lineReceived(b"jobs cancel 2")
+        self.assertIn(b"No such job: 2", self.transport.value())
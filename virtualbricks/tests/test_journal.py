@@ -0,0 +1,347 @@
+# Virtualbricks - a vde/qemu gui written in python and GTK/Glade.
+# Copyright (C) 2018 Virtualbricks team
+
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+import os
+
+import six
+from twisted.trial import unittest
+from twisted.internet import defer, task
+from twisted.python import filepath
+
+from virtualbricks import autosave, configfile, journal, snapshot
+from virtualbricks.tests import stubs, successResultOf
+
+
+def dump(factory):
+    sio = six.StringIO()
+    configfile.ConfigFile().save_to(factory, sio)
+    return sio.getvalue()
+
+
+def sync(function, *args):
+    return defer.maybeDeferred(function, *args)
+
+
+class TestReplay(unittest.TestCase):
+
+    state = ([("disk", "/disk")],
+             [("ev", [("delay", "5")])],
+             [("Switch", "sw", []), ("Qemu", "vm", [("ram", "256")])],
+             [("vm", "vm_sock_eth0", "e1000", "00:11:22:33:44:55")],
+             [("vm", "sw_port", "rtl8139", "00:11:22:33:44:66")])
+
+    def test_no_records(self):
+        self.assertEqual(journal.replay(self.state, []), self.state)
+
+    def test_brick(self):
+        """A brick record replaces the brick, its socks and its links."""
+
+        records = [("brick", "vm", "Qemu", [("ram", "512")], [],
+                    [("", "e1000", "00:11:22:33:44:77")])]
+        images, events, bricks, socks, links = journal.replay(self.state,
+                                                              records)
+        self.assertEqual(bricks, [("Switch", "sw", []),
+                                  ("Qemu", "vm", [("ram", "512")])])
+        self.assertEqual(socks, [])
+        self.assertEqual(links, [("vm", "", "e1000", "00:11:22:33:44:77")])
+
+    def test_remove(self):
+        records = [("remove", "vm"), ("remove", "ev"), ("remove", "disk")]
+        self.assertEqual(journal.replay(self.state, records),
+                         ([], [], [("Switch", "sw", [])], [], []))
+
+    def test_replace_kind(self):
+        """The names are unique, a new event replaces the brick with the same
+        name."""
+
+        records = [("event", "sw", []), ("image", "ev", "/ev")]
+        images, events, bricks, _, _ = journal.replay(self.state, records)
+        self.assertEqual(images, [("disk", "/disk"), ("ev", "/ev")])
+        self.assertEqual(events, [("sw", [])])
+        self.assertEqual(bricks, [("Qemu", "vm", [("ram", "256")])])
+
+    def test_idempotent(self):
+        """Replaying the records already applied does not change the
+        state."""
+
+        records = [("brick", "sw2", "Switch", [], [], []), ("remove", "ev"),
+                   ("brick", "vm", "Qemu", [], [], [("sw2_port", "", "")])]
+        state = journal.replay(self.state, records)
+        self.assertEqual(journal.replay(state, records), state)
+
+
+class TestJournal(unittest.TestCase):
+
+    def setUp(self):
+        self.factory = stubs.Factory()
+        image = self.mktemp()
+        open(image, "w").close()
+        self.factory.new_disk_image("disk", image)
+        event = self.factory.new_event("ev")
+        event.set({"delay": 5})
+        self.switch = self.factory.new_brick("switch", "sw")
+        self.vm = self.factory.new_brick("vm", "vm")
+        self.vm.add_sock("00:11:22:33:44:55", "e1000")
+        self.vm.connect(self.switch.socks[0], "00:11:22:33:44:66", "rtl8139")
+        self.fp = filepath.FilePath(self.mktemp())
+        self.config = configfile.ConfigFile()
+        self.config.save(self.factory, self.fp)
+        self.clock = task.Clock()
+        self.full = []
+        self.journal = self.open()
+
+    def open(self, **kwds):
+        j = journal.Journal(self.factory, journal.filename(self.fp.path),
+                            on_full=lambda: self.full.append(True),
+                            clock=self.clock, defer_to_thread=sync, **kwds)
+        j.open()
+        return j
+
+    def restore(self, fp=None):
+        factory = stubs.Factory()
+        self.config.restore(factory, fp or self.fp)
+        return factory
+
+    def assertRestored(self):
+        """The project restored with the journal is the same project
+        restored after a save."""
+
+        self.clock.advance(journal.DELAY)
+        fp = filepath.FilePath(self.mktemp())
+        configfile.ConfigFile().write(fp, snapshot.state(self.factory))
+        self.assertEqual(dump(self.restore()), dump(self.restore(fp)))
+
+    def test_open(self):
+        self.assertIs(self.factory.journal, self.journal)
+        successResultOf(self, self.journal.close())
+        self.assertIs(self.factory.journal, None)
+
+    def test_group_commit(self):
+        """The changes made within the delay are written at once."""
+
+        self.vm.set({"ram": 512})
+        self.factory.new_brick("switch", "sw2")
+        self.switch.set({"numports": 64})
+        self.assertFalse(os.path.exists(self.journal.path))
+        self.clock.advance(journal.DELAY)
+        self.assertEqual(self.journal.commits, 1)
+        self.assertEqual(self.journal.records, 3)
+        self.assertEqual(self.journal.size,
+                         os.path.getsize(self.journal.path))
+        self.assertEqual([record[:2] for record in
+                          journal.read(self.journal.path)],
+                         [("brick", "vm"), ("brick", "sw2"), ("brick", "sw")])
+
+    def test_options(self):
+        self.vm.set({"ram": 512})
+        event = self.factory.get_event_by_name("ev")
+        event.set({"delay": 10})
+        self.assertRestored()
+
+    def test_new_and_removed(self):
+        switch = self.factory.new_brick("switch", "sw2")
+        self.vm.connect(switch.socks[0], "00:11:22:33:44:77", "e1000")
+        self.factory.del_event(self.factory.get_event_by_name("ev"))
+        self.factory.new_event("ev2")
+        self.assertRestored()
+        self.factory.del_brick(switch)
+        self.assertRestored()
+
+    def test_rename(self):
+        """The links to the socks of a renamed brick are updated and the old
+        name can be used again."""
+
+        self.switch.rename("sw2")
+        self.assertRestored()
+        self.factory.new_brick("switch", "sw")
+        self.assertRestored()
+
+    def test_rename_in_place(self):
+        """A renamed brick keeps its place."""
+
+        self.switch.rename("sw2")
+        self.clock.advance(journal.DELAY)
+        self.assertEqual([record[0] for record in
+                          journal.read(self.journal.path)],
+                         ["rename", "brick", "brick"])
+        bricks = self.restore().bricks
+        self.assertEqual([brick.name for brick in bricks], ["sw2", "vm"])
+
+    def test_rename_swap(self):
+        """Two bricks can swap their names, their places may change."""
+
+        self.switch.rename("tmp")
+        self.vm.rename("sw")
+        self.switch.rename("vm")
+        self.clock.advance(journal.DELAY)
+        factory = self.restore()
+        self.assertEqual(
+            sorted((brick.name, brick.get_type()) for brick in factory.bricks),
+            [("sw", "Qemu"), ("vm", "Switch")])
+        self.assertEqual(snapshot.brick_links(factory.get_brick_by_name("sw")),
+                         snapshot.brick_links(self.vm))
+
+    def test_disconnect(self):
+        self.vm.plugs[0].disconnect()
+        self.assertRestored()
+
+    def test_text(self):
+        """Without the snapshot the journal is replayed on the project
+        file."""
+
+        self.vm.set({"ram": 512})
+        self.factory.new_brick("switch", "sw2")
+        os.remove(snapshot.filename(self.fp.path))
+        self.assertRestored()
+
+    def test_dirty(self):
+        """A project with a journal is restored dirty, the project file is
+        behind."""
+
+        self.assertFalse(self.restore().is_dirty())
+        self.vm.set({"ram": 512})
+        self.clock.advance(journal.DELAY)
+        self.assertTrue(self.restore().is_dirty())
+
+    def test_torn(self):
+        """A torn record at the end of the journal is discarded."""
+
+        self.vm.set({"ram": 512})
+        self.clock.advance(journal.DELAY)
+        size = self.journal.size
+        with open(self.journal.path, "ab") as fp:
+            fp.write(journal.encode(("remove", "sw"))[:-1])
+        self.assertEqual(len(journal.read(self.journal.path)), 1)
+        self.assertEqual(self.open().size, size)
+        self.assertEqual(os.path.getsize(self.journal.path), size)
+        self.assertRestored()
+
+    def test_not_a_journal(self):
+        with open(self.journal.path, "wb") as fp:
+            fp.write(b"garbage")
+        self.assertEqual(journal.read(self.journal.path), [])
+        j = self.open()
+        self.vm.set({"ram": 512})
+        self.assertEqual(self.factory.journal, j)
+        self.assertRestored()
+
+    def test_compact(self):
+        """The compaction keeps the changes recorded after the mark."""
+
+        self.vm.set({"ram": 512})
+        self.journal.mark()
+        state = snapshot.state(self.factory)
+        self.switch.set({"numports": 64})
+        self.clock.advance(journal.DELAY)
+        self.config.write(self.fp, state)
+        successResultOf(self, self.journal.compact())
+        self.assertEqual([record[:2] for record in
+                          journal.read(self.journal.path)],
+                         [("brick", "sw")])
+        self.assertEqual(self.journal.size,
+                         os.path.getsize(self.journal.path))
+        self.assertRestored()
+
+    def test_compact_pending(self):
+        """The changes not written yet are appended after the compaction."""
+
+        self.journal.mark()
+        self.config.save(self.factory, self.fp)
+        self.vm.set({"ram": 512})
+        self.journal.compact()
+        self.assertEqual(journal.read(self.journal.path), [])
+        self.assertRestored()
+
+    def test_full(self):
+        self.journal.size_limit = 0
+        self.vm.set({"ram": 512})
+        self.clock.advance(journal.DELAY)
+        self.assertEqual(self.full, [True])
+
+    def test_failure(self):
+        """If the changes cannot be written the project must be saved."""
+
+        self.journal.defer_to_thread = lambda *args: defer.fail(
+            IOError("disk full"))
+        self.vm.set({"ram": 512})
+        self.clock.advance(journal.DELAY)
+        self.assertEqual(self.full, [True])
+        self.assertEqual(len(self.flushLoggedErrors(IOError)), 1)
+
+    def test_reset(self):
+        """Closing the project closes the journal, the bricks are not
+        removed from the journal."""
+
+        self.vm.set({"ram": 512})
+        self.factory.reset()
+        self.assertIs(self.factory.journal, None)
+        self.assertEqual(self.clock.getDelayedCalls(), [])
+        self.assertEqual(len(journal.read(self.journal.path)), 1)
+
+
+class TestAutosave(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = task.Clock()
+        self.factory = stubs.Factory()
+        self.filename = self.mktemp()
+        self.autosaver = autosave.Autosaver(
+            self.factory, clock=self.clock, filename=lambda: self.filename,
+            defer_to_thread=sync, use_journal=True)
+        self.autosaver.start()
+        self.addCleanup(self.autosaver.stop)
+
+    def test_journal(self):
+        """The changes are written to the journal, not to the project
+        file."""
+
+        self.factory.new_brick("switch", "sw")
+        self.clock.advance(1000)
+        self.assertEqual(self.factory.journal.records, 1)
+        self.assertEqual(self.autosaver.saves, 0)
+        self.assertFalse(os.path.exists(self.filename))
+
+    def test_full(self):
+        """The project is saved and the journal compacted when the journal
+        grows."""
+
+        self.factory.journal.size_limit = 0
+        self.factory.new_brick("switch", "sw")
+        self.clock.advance(journal.DELAY)
+        self.assertEqual(self.autosaver.saves, 1)
+        self.assertFalse(self.factory.is_dirty())
+        self.assertEqual(journal.read(journal.filename(self.filename)), [])
+        factory = stubs.Factory()
+        configfile.restore(factory, self.filename)
+        self.assertEqual(dump(factory), dump(self.factory))
+
+    def test_stop(self):
+        """stop closes the journal."""
+
+        self.factory.new_brick("switch", "sw")
+        successResultOf(self, self.autosaver.stop())
+        self.assertIs(self.factory.journal, None)
+        self.assertEqual(len(journal.read(journal.filename(self.filename))),
+                         1)
+
+    def test_without_journal(self):
+        """The project is saved as usual when the journal is closed."""
+
+        successResultOf(self, self.factory.journal.close())
+        self.factory.new_brick("switch", "sw")
+        self.clock.advance(autosave.DELAY)
+        self.assertEqual(self.autosaver.saves, 1)
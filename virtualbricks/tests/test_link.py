@@ -36,6 +36,11 @@ class TestPlug(unittest.TestCase):
         log.addObserver(self.log.append)
         self.addCleanup(log.removeObserver, self.log.append)
 
+    def test_slots(self):
+        """There is a plug for every network card, they have no __dict__."""
+
+        self.assertFalse(hasattr(self.plug, "__dict__"))
+
     def test_connected(self):
         result = []
         self.plug.connected().addErrback(result.append)
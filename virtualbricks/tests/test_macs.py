@@ -0,0 +1,94 @@
+# Virtualbricks - a vde/qemu gui written in python and GTK/Glade.
+# Copyright (C) 2018 Virtualbricks team
+
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+import six
+from twisted.trial import unittest
+
+from virtualbricks import configfile, macs
+from virtualbricks.tests import stubs
+
+
+class TestMacAllocator(unittest.TestCase):
+
+    def test_parse_format(self):
+        self.assertEqual(macs.parse("00:aa:01:02:03:ff"), 0x00aa010203ff)
+        self.assertEqual(macs.format_mac(0x00aa010203ff), "00:aa:01:02:03:ff")
+        for invalid in "00:aa:01:02:03", "zz:aa:01:02:03:04", None:
+            self.assertRaises(ValueError, macs.parse, invalid)
+
+    def test_allocate(self):
+        allocator = macs.MacAllocator()
+        mac = allocator.allocate()
+        self.assertTrue(mac.startswith("00:aa:"))
+        self.assertIn(mac, allocator)
+        allocator.release(mac)
+        self.assertNotIn(mac, allocator)
+
+    def test_no_collisions(self):
+        allocator = macs.MacAllocator(seed=42)
+        first = macs.MacAllocator(seed=42).allocate()
+        self.assertTrue(allocator.reserve(first))
+        addresses = allocator.allocate_many(1000)
+        self.assertNotIn(first, addresses)
+        self.assertEqual(len(set(addresses)), 1000)
+        self.assertEqual(len(allocator), 1001)
+
+    def test_deterministic(self):
+        self.assertEqual(macs.MacAllocator(seed=1).allocate_many(10),
+                         macs.MacAllocator(seed=1).allocate_many(10))
+        self.assertNotEqual(macs.MacAllocator(seed=1).allocate_many(10),
+                            macs.MacAllocator(seed=2).allocate_many(10))
+
+    def test_reserve_all(self):
+        allocator = macs.MacAllocator()
+        mac = "00:11:22:33:44:55"
+        self.assertEqual(allocator.reserve_all([mac, "invalid", mac]),
+                         set([mac]))
+        self.assertFalse(allocator.reserve(mac))
+        self.flushLoggedErrors()
+
+
+CONFIG = """[Qemu:vm]
+
+sock|vm|vm_sock_eth0|rtl8139|00:aa:00:00:00:01
+link|vm|_hostonly|rtl8139|00:aa:00:00:00:02
+"""
+
+
+class TestFactoryMacs(unittest.TestCase):
+
+    def setUp(self):
+        self.factory = stubs.Factory()
+
+    def test_restore_reserve(self):
+        """The addresses in the project are reserved before the restore."""
+
+        configfile.ConfigFile().restore_from(self.factory,
+                                             six.StringIO(CONFIG))
+        self.assertIn("00:aa:00:00:00:01", self.factory.macs)
+        self.assertIn("00:aa:00:00:00:02", self.factory.macs)
+
+    def test_plugs(self):
+        vm = self.factory.new_brick("vm", "vm")
+        plug = vm.add_plug(None)
+        sock = vm.add_sock("00:aa:00:00:00:01")
+        self.assertIn(plug.mac, self.factory.macs)
+        self.assertIn(sock.mac, self.factory.macs)
+        vm.remove_plug(plug)
+        self.assertNotIn(plug.mac, self.factory.macs)
+        self.factory.del_brick(vm)
+        self.assertEqual(len(self.factory.macs), 0)
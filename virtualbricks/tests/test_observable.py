@@ -0,0 +1,112 @@
+# Virtualbricks - a vde/qemu gui written in python and GTK/Glade.
+# Copyright (C) 2018 Virtualbricks team
+
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+from twisted.trial import unittest
+from twisted.internet import task
+
+from virtualbricks import observable
+from virtualbricks.tests import stubs
+
+
+class TestBatch(unittest.TestCase):
+
+    def setUp(self):
+        self.observable = observable.Observable("changed", "removed")
+        self.received = []
+        for name in "changed", "removed":
+            self.observable.add_observer(name, self.received.append, (), {})
+
+    def test_no_batch(self):
+        self.observable.notify("changed", 1)
+        self.observable.notify("changed", 1)
+        self.assertEqual(self.received, [1, 1])
+
+    def test_coalesce(self):
+        """While batching, notifications are deduplicated per emitter and
+        delivered at the end in the order of arrival."""
+
+        with observable.batch(self.observable) as batch:
+            self.observable.notify("changed", 1)
+            self.observable.notify("changed", 2)
+            self.observable.notify("changed", 1)
+            self.observable.notify("removed", 1)
+            self.assertEqual(self.received, [])
+        self.assertEqual(self.received, [1, 2, 1])
+        self.assertEqual(batch.suppressed, 1)
+
+    def test_nested(self):
+        with observable.batch(self.observable):
+            with observable.batch(self.observable):
+                self.observable.notify("changed", 1)
+            self.assertEqual(self.received, [])
+        self.assertEqual(self.received, [1])
+
+    def test_commit_without_batch(self):
+        self.assertRaises(RuntimeError, self.observable.commit_batch)
+
+    def test_exception(self):
+        """Pending notifications are delivered even if the batch fails."""
+
+        try:
+            with observable.batch(self.observable):
+                self.observable.notify("changed", 1)
+                raise ValueError()
+        except ValueError:
+            pass
+        self.assertEqual(self.received, [1])
+        self.assertFalse(self.observable.is_batching())
+
+    def test_debounce(self):
+        clock = task.Clock()
+        with observable.batch(self.observable, 1, clock):
+            self.observable.notify("changed", 1)
+        self.assertEqual(self.received, [])
+        clock.advance(0.5)
+        with observable.batch(self.observable, 1, clock):
+            self.observable.notify("changed", 1)
+        clock.advance(0.9)
+        self.assertEqual(self.received, [])
+        clock.advance(0.1)
+        self.assertEqual(self.received, [1])
+        self.assertFalse(self.observable.is_batching())
+
+
+class TestFactoryBatch(unittest.TestCase):
+
+    def setUp(self):
+        self.factory = stubs.Factory()
+        self.changed = []
+        self.factory.changed.connect(self.changed.append)
+
+    def test_batch(self):
+        brick = self.factory.new_brick("_stub", "test")
+        with self.factory.batch() as batch:
+            for i in range(10):
+                brick.set({"a": str(i)})
+        self.assertEqual(self.changed, [brick])
+        self.assertEqual(batch.suppressed, 9)
+
+    def test_restore(self):
+        """During the restore the notifications are delivered at the end."""
+
+        brick = self.factory.new_brick("_stub", "test")
+        self.factory.set_restore(True)
+        brick.set({"a": "1"})
+        brick.set({"a": "2"})
+        self.assertEqual(self.changed, [])
+        self.factory.set_restore(False)
+        self.assertEqual(self.changed, [brick])
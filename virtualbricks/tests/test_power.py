@@ -0,0 +1,243 @@
+# Virtualbricks - a vde/qemu gui written in python and GTK/Glade.
+# Copyright (C) 2018 Virtualbricks team
+
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+from twisted.internet import defer, task
+
+from virtualbricks import bricks, errors, power
+from virtualbricks.tests import unittest, stubs, successResultOf
+
+
+class PowerBrick(bricks.Brick):
+
+    type = "Power"
+    poweroff_signal = None
+
+    def __init__(self, factory, name):
+        bricks.Brick.__init__(self, factory, name)
+        self.starting = None
+        self.stopping = None
+        self.signals = []
+
+    def poweron(self):
+        self.starting = defer.Deferred()
+        return self.starting
+
+    def poweroff(self):
+        self.stopping = defer.Deferred()
+        return self.stopping
+
+    def send_signal(self, signal):
+        self.signals.append(signal)
+
+    def exit(self):
+        self.proc = None
+        self.stopping.callback((self, None))
+
+    def plug_into(self, other):
+        plug = self.factory.new_plug(self)
+        self.plugs.append(plug)
+        plug.connect(self.factory.new_sock(other))
+
+
+class TestPoweronAll(unittest.TestCase):
+
+    def setUp(self):
+        self.factory = stubs.Factory()
+        self.factory.register_brick_type(PowerBrick, "power")
+        self.clock = task.Clock()
+
+    def new(self, name):
+        return self.factory.new_brick("power", name)
+
+    def test_dependencies_first(self):
+        """A brick is started only when its dependencies are running."""
+
+        switch = self.new("switch")
+        vm = self.new("vm")
+        vm.plug_into(switch)
+        d = power.poweron_all([vm], clock=self.clock)
+        self.assertIsNot(switch.starting, None)
+        self.assertIs(vm.starting, None)
+        self.clock.advance(2)
+        switch.starting.callback(switch)
+        self.assertIsNot(vm.starting, None)
+        self.clock.advance(3)
+        vm.starting.callback(vm)
+        results = successResultOf(self, d)
+        self.assertEqual(results, [(switch, 2, None), (vm, 3, None)])
+
+    def test_parallel(self):
+        """Independent bricks are started in parallel, up to a limit."""
+
+        vms = [self.new("vm{0}".format(i)) for i in range(5)]
+        d = power.poweron_all(vms, max_parallel=2, clock=self.clock)
+
+        def starting():
+            return [vm for vm in vms
+                    if vm.starting is not None and not vm.starting.called]
+
+        self.assertEqual(len(starting()), 2)
+        while starting():
+            self.assertTrue(len(starting()) <= 2)
+            vm = starting()[0]
+            vm.starting.callback(vm)
+        self.assertEqual(len(successResultOf(self, d)), 5)
+
+    def test_failure_skip_dependents(self):
+        switch = self.new("switch")
+        vm = self.new("vm")
+        vm.plug_into(switch)
+        d = power.poweron_all([vm], clock=self.clock)
+        switch.starting.errback(errors.BadConfigError())
+        self.assertIs(vm.starting, None)
+        results = dict((r.brick, r.failure) for r in successResultOf(self, d))
+        results[switch].trap(errors.BadConfigError)
+        results[vm].trap(errors.BadConfigError)
+        self.flushLoggedErrors(errors.BadConfigError)
+
+    def test_loop(self):
+        """Bricks in a loop are not started."""
+
+        vm1 = self.new("vm1")
+        vm2 = self.new("vm2")
+        vm3 = self.new("vm3")
+        vm1.plug_into(vm2)
+        vm2.plug_into(vm1)
+        vm3.plug_into(vm1)
+        d = power.poweron_all(self.factory.bricks, clock=self.clock)
+        self.assertEqual([vm1.starting, vm2.starting, vm3.starting],
+                         [None] * 3)
+        results = successResultOf(self, d)
+        self.assertEqual(len(results), 3)
+        for result in results:
+            result.failure.trap(errors.LinkLoopError)
+
+    def test_self_plugged(self):
+        """A brick plugged to itself does not depend on itself."""
+
+        vm = self.new("vm")
+        vm.plug_into(vm)
+        self.assertEqual(power.dependency_graph([vm]), {vm: set()})
+
+    def test_sort(self):
+        switch = self.new("switch")
+        vm1 = self.new("vm1")
+        vm2 = self.new("vm2")
+        vm1.plug_into(switch)
+        vm2.plug_into(vm1)
+        waves, looped = power.sort(power.dependency_graph([vm2]))
+        self.assertEqual(waves, [[switch], [vm1], [vm2]])
+        self.assertEqual(looped, set())
+
+    def test_factory_poweron_all(self):
+        brick = self.factory.new_brick("_stub", "stub")
+        results = successResultOf(self, self.factory.poweron_all())
+        self.assertEqual([r.brick for r in results], [brick])
+        self.assertIsNot(brick.proc, None)
+
+
+class TestPoweroffAll(unittest.TestCase):
+
+    def setUp(self):
+        self.factory = stubs.Factory()
+        self.factory.register_brick_type(PowerBrick, "power")
+        self.clock = task.Clock()
+
+    def new(self, name):
+        brick = self.factory.new_brick("power", name)
+        brick.proc = bricks.FakeProcess(brick)
+        return brick
+
+    def test_graceful(self):
+        brick = self.new("brick")
+        d = power.poweroff(brick, 10, 5, self.clock)
+        self.clock.advance(3)
+        brick.exit()
+        self.assertEqual(successResultOf(self, d), (brick, 3, None, True))
+        self.assertEqual(brick.signals, [])
+        self.assertEqual(self.clock.getDelayedCalls(), [])
+
+    def test_escalation(self):
+        """If the brick does not stop, send SIGTERM and then SIGKILL."""
+
+        brick = self.new("brick")
+        d = power.poweroff(brick, 10, 5, self.clock)
+        self.clock.advance(10)
+        self.assertEqual(brick.signals, ["TERM"])
+        self.clock.advance(5)
+        self.assertEqual(brick.signals, ["TERM", "KILL"])
+        brick.exit()
+        self.assertEqual(successResultOf(self, d), (brick, 15, "KILL", True))
+
+    def test_terminated(self):
+        """A brick that is stopped with a SIGTERM reports it and receives a
+        SIGKILL if it does not exit."""
+
+        brick = self.new("brick")
+        brick.poweroff_signal = "TERM"
+        d = power.poweroff(brick, 10, 5, self.clock)
+        self.clock.advance(3)
+        brick.exit()
+        self.assertEqual(successResultOf(self, d), (brick, 3, "TERM", True))
+        brick = self.new("brick2")
+        brick.poweroff_signal = "TERM"
+        d = power.poweroff(brick, 10, 5, self.clock)
+        self.clock.advance(10)
+        self.assertEqual(brick.signals, ["KILL"])
+        brick.exit()
+        self.assertEqual(successResultOf(self, d), (brick, 10, "KILL", True))
+
+    def test_straggler(self):
+        brick = self.new("brick")
+        d = power.poweroff(brick, 10, 5, self.clock)
+        self.clock.pump([10, 5, 5])
+        self.assertEqual(successResultOf(self, d), (brick, 20, "KILL", False))
+        self.flushLoggedErrors()
+
+    def test_consumers_first(self):
+        """Bricks are stopped after the bricks that depend on them."""
+
+        switch = self.new("switch")
+        vm1 = self.new("vm1")
+        vm2 = self.new("vm2")
+        vm1.plug_into(switch)
+        vm2.plug_into(switch)
+        d = power.poweroff_all(self.factory.bricks, clock=self.clock)
+        self.assertIs(switch.stopping, None)
+        self.assertIsNot(vm1.stopping, None)
+        self.assertIsNot(vm2.stopping, None)
+        vm1.exit()
+        self.assertIs(switch.stopping, None)
+        vm2.exit()
+        self.assertIsNot(switch.stopping, None)
+        switch.exit()
+        results = successResultOf(self, d)
+        self.assertEqual([r.brick for r in results], [vm1, vm2, switch])
+
+    def test_per_type_timeout(self):
+        brick = self.new("brick")
+        d = power.poweroff_all([brick], timeouts={"Power": 1}, clock=self.clock)
+        self.clock.advance(1)
+        self.assertEqual(brick.signals, ["TERM"])
+        brick.exit()
+        self.assertEqual(successResultOf(self, d)[0].signal, "TERM")
+
+    def test_skip_not_running(self):
+        brick = self.factory.new_brick("power", "brick")
+        d = power.poweroff_all([brick], clock=self.clock)
+        self.assertEqual(successResultOf(self, d), [])
+        self.assertIs(brick.stopping, None)
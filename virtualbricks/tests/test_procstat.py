@@ -0,0 +1,222 @@
+# Virtualbricks - a vde/qemu gui written in python and GTK/Glade.
+# Copyright (C) 2018 Virtualbricks team
+
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+
+import os
+
+from twisted.trial import unittest
+from twisted.internet import task
+from twisted.test import proto_helpers
+
+from virtualbricks import bricks, console, procstat
+from virtualbricks.tests import stubs
+
+
+STAT = ("{pid} (qemu system) S {ppid} 1 1 0 -1 4194560 100 0 0 0 {utime} "
+        "{stime} 0 0 20 0 3 0 100 1000000 500 18446744073709551615\n")
+STATUS = ("Name:\tqemu\nVmRSS:\t{rss} kB\nvoluntary_ctxt_switches:\t{vcs}\n"
+          "nonvoluntary_ctxt_switches:\t{ncs}\n")
+IO = "rchar: 0\nwchar: 0\nread_bytes: {read}\nwrite_bytes: {write}\n"
+SCHED = ("qemu (1, #threads: 3)\n"
+         "---------------------------------------------------------\n"
+         "se.sum_exec_runtime                          :  {runtime:.6f}\n")
+
+
+class FakeProc:
+
+    def __init__(self, root):
+        self.root = root
+
+    def write(self, pid, ppid=1, utime=0, stime=0, rss=1024, vcs=0, ncs=0,
+              read=0, write=0, runtime=None, io=True):
+        base = os.path.join(self.root, str(pid))
+        if not os.path.isdir(base):
+            os.makedirs(base)
+        files = {"stat": STAT.format(**locals()),
+                 "status": STATUS.format(**locals())}
+        if io:
+            files["io"] = IO.format(**locals())
+        elif os.path.exists(os.path.join(base, "io")):
+            os.remove(os.path.join(base, "io"))
+        if runtime is not None:
+            files["sched"] = SCHED.format(runtime=runtime)
+        for name, content in files.items():
+            with open(os.path.join(base, name), "w") as fp:
+                fp.write(content)
+
+
+class SudoBrick(stubs.StubBrick):
+
+    def needsudo(self):
+        return True
+
+
+def running(brick, pid):
+    brick.proc = bricks.FakeProcess(brick)
+    brick.proc.pid = pid
+    return brick
+
+
+class TestReadSample(unittest.TestCase):
+
+    def setUp(self):
+        self.proc = FakeProc(self.mktemp())
+
+    def test_stat(self):
+        """Without sched, the cpu time is read from stat."""
+
+        self.proc.write(10, utime=150, stime=50, rss=2048, vcs=3, ncs=4,
+                        read=10, write=20)
+        sample = procstat.read_sample(10, self.proc.root)
+        self.assertEqual(sample, (200.0 / procstat.CLK_TCK, 2048 * 1024, 3,
+                                  4, 10, 20))
+
+    def test_sched(self):
+        self.proc.write(10, utime=150, runtime=1234.5)
+        self.assertEqual(procstat.read_sample(10, self.proc.root).cpu_time,
+                         1.2345)
+
+    def test_no_io(self):
+        """The I/O counters of processes of other users are not readable."""
+
+        self.proc.write(10, io=False)
+        sample = procstat.read_sample(10, self.proc.root)
+        self.assertEqual((sample.read_bytes, sample.write_bytes),
+                         (None, None))
+
+    def test_not_exists(self):
+        self.assertRaises(OSError, procstat.read_sample, 10, self.proc.root)
+
+
+class TestSampler(unittest.TestCase):
+
+    def setUp(self):
+        self.proc = FakeProc(self.mktemp())
+        self.factory = stubs.Factory()
+        self.factory.register_brick_type(SudoBrick, "sudo")
+        self.clock = task.Clock()
+        self.now = 0.0
+        self.sampler = procstat.Sampler(self.factory, 2, 3, self.clock,
+                                        self.proc.root, lambda: self.now)
+
+    def test_rates(self):
+        brick = running(self.factory.new_brick("_stub", "sw"), 10)
+        self.proc.write(10, runtime=0, vcs=10, read=0, write=0)
+        self.sampler.start()
+        first = self.sampler.latest(brick)
+        self.assertEqual((first.cpu_percent, first.rss), (None, 1024 * 1024))
+        self.proc.write(10, runtime=500, vcs=30, read=4096, write=8192)
+        self.clock.advance(2)
+        stats = self.sampler.latest(brick)
+        self.assertEqual(stats.cpu_percent, 25.0)
+        self.assertEqual(stats.switches_rate, 10.0)
+        self.assertEqual((stats.read_rate, stats.write_rate), (2048, 4096))
+        self.assertEqual(len(self.sampler.stats(brick)), 2)
+        self.sampler.stop()
+        self.assertEqual(self.clock.getDelayedCalls(), [])
+
+    def test_window(self):
+        brick = running(self.factory.new_brick("_stub", "sw"), 10)
+        self.proc.write(10)
+        self.sampler.start()
+        self.clock.pump([2] * 5)
+        self.assertEqual(len(self.sampler.stats(brick)), 3)
+        self.sampler.stop()
+
+    def test_sudo_children(self):
+        """The resources of the children of sudo are accounted to the
+        brick."""
+
+        brick = running(self.factory.new_brick("sudo", "tap"), 10)
+        self.proc.write(10, rss=100)
+        self.proc.write(11, ppid=10, rss=200)
+        self.proc.write(12, ppid=11, rss=300)
+        self.proc.write(13, rss=400)
+        self.sampler.sample()
+        stats = self.sampler.latest(brick)
+        self.assertEqual(sorted(stats.pids), [10, 11, 12])
+        self.assertEqual(stats.rss, 600 * 1024)
+
+    def test_stopped_bricks(self):
+        brick = running(self.factory.new_brick("_stub", "sw"), 10)
+        self.proc.write(10)
+        self.sampler.sample()
+        self.assertEqual(len(self.sampler.top()), 1)
+        brick.proc = None
+        self.sampler.sample()
+        self.assertEqual(self.sampler.top(), [])
+        self.assertIs(self.sampler.latest(brick), None)
+
+    def test_top(self):
+        bricks = [running(self.factory.new_brick("_stub", "b%d" % i), 10 + i)
+                  for i in range(3)]
+        for i in range(3):
+            self.proc.write(10 + i, runtime=0)
+        self.sampler.sample()
+        for i, runtime in enumerate([100, 300, 200]):
+            self.proc.write(10 + i, runtime=runtime)
+        self.clock.advance(1)
+        self.sampler.sample()
+        self.assertEqual([b for b, _ in self.sampler.top(limit=2)],
+                         [bricks[1], bricks[2]])
+
+    def test_bounded_cost(self):
+        """If sampling is slow, the interval is raised."""
+
+        def timer():
+            self.now += 0.1
+            return self.now
+
+        self.sampler.timer = timer
+        self.sampler.sample()
+        self.assertAlmostEqual(self.sampler.cost[-1], 0.1)
+        self.assertAlmostEqual(self.sampler.interval,
+                               0.1 / procstat.MAX_OVERHEAD)
+        self.flushLoggedErrors()
+
+
+class TestTopCommand(unittest.TestCase):
+
+    def test_top(self):
+        factory = stubs.Factory()
+        proc = FakeProc(self.mktemp())
+        factory.sampler = procstat.Sampler(factory, clock=task.Clock(),
+                                           proc=proc.root)
+        running(factory.new_brick("_stub", "sw"), 10)
+        proc.write(10, rss=2048)
+        protocol = console.VBProtocol(factory)
+        transport = proto_helpers.StringTransport()
+        protocol.makeConnection(transport)
+        transport.clear()
+        protocol.lineReceived(b"top")
+        lines = transport.value().decode().splitlines()
+        self.assertEqual(lines[2].split("\t"),
+                         ["10", "-", "2048", "-", "-", "-", "sw"])
+        self.assertTrue(factory.sampler.is_running())
+        factory.sampler.stop()
+
+    def test_invalid_limit(self):
+        factory = stubs.Factory()
+        factory.sampler = procstat.Sampler(factory, clock=task.Clock())
+        protocol = console.VBProtocol(factory)
+        transport = proto_helpers.StringTransport()
+        protocol.makeConnection(transport)
+        transport.clear()
+        protocol.lineReceived(b"top abc")
+        self.assertEqual(transport.value().decode().splitlines()[0],
+                         "Invalid limit 'abc', usage: top [limit]")
+        self.assertFalse(factory.sampler.is_running())
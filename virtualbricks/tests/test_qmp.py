@@ -0,0 +1,281 @@
+# Virtualbricks - a vde/qemu gui written in python and GTK/Glade.
+# Copyright (C) 2018 Virtualbricks team
+
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+
+import json
+
+from twisted.trial import unittest
+from twisted.internet import defer, error, task
+from twisted.test import proto_helpers
+
+from virtualbricks import qmp
+from virtualbricks.tests import (stubs, successResultOf, failureResultOf)
+
+
+GREETING = b'{"QMP": {"version": {}, "capabilities": []}}'
+
+
+def connect(clock=None):
+    proto = qmp.QMPProtocol(clock or task.Clock())
+    transport = proto_helpers.StringTransport()
+    proto.makeConnection(transport)
+    return proto, transport
+
+
+def sent(transport):
+    lines = transport.value().splitlines()
+    transport.clear()
+    return [json.loads(line.decode("utf-8")) for line in lines]
+
+
+def reply(proto, request_id, value=None, error=None):
+    message = {"id": request_id}
+    if error is not None:
+        message["error"] = error
+    else:
+        message["return"] = {} if value is None else value
+    proto.dataReceived(json.dumps(message).encode("utf-8") + b"\r\n")
+
+
+def negotiate(proto, transport):
+    proto.dataReceived(GREETING + b"\r\n")
+    request = sent(transport)[0]
+    reply(proto, request["id"])
+
+
+class TestQMPProtocol(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = task.Clock()
+        self.proto, self.transport = connect(self.clock)
+
+    def test_negotiation(self):
+        """Commands are queued until the capabilities are negotiated."""
+
+        d = self.proto.execute("query-status")
+        self.assertEqual(self.transport.value(), b"")
+        self.proto.dataReceived(GREETING + b"\r\n")
+        self.assertEqual(sent(self.transport),
+                         [{"execute": "qmp_capabilities", "id": 1}])
+        reply(self.proto, 1)
+        self.assertIs(successResultOf(self, self.proto.ready), self.proto)
+        self.assertEqual(sent(self.transport),
+                         [{"execute": "query-status", "id": 2}])
+        reply(self.proto, 2, {"status": "running"})
+        self.assertEqual(successResultOf(self, d), {"status": "running"})
+
+    def test_replies_out_of_order(self):
+        negotiate(self.proto, self.transport)
+        d1 = self.proto.execute("stop")
+        d2 = self.proto.execute("device_del", {"id": "usb0"})
+        requests = sent(self.transport)
+        self.assertEqual(requests[1]["arguments"], {"id": "usb0"})
+        reply(self.proto, requests[1]["id"], "second")
+        self.assertNoResult(d1)
+        self.assertEqual(successResultOf(self, d2), "second")
+        reply(self.proto, requests[0]["id"], "first")
+        self.assertEqual(successResultOf(self, d1), "first")
+
+    def test_error(self):
+        negotiate(self.proto, self.transport)
+        d = self.proto.execute("device_del", {"id": "usb0"})
+        reply(self.proto, sent(self.transport)[0]["id"],
+              error={"class": "DeviceNotFound", "desc": "no usb0"})
+        err = failureResultOf(self, d, qmp.QMPError).value
+        self.assertEqual((err.error_class, err.desc),
+                         ("DeviceNotFound", "no usb0"))
+
+    def test_human_monitor_command_error(self):
+        """Any output of a human monitor command is an error."""
+
+        negotiate(self.proto, self.transport)
+        d1 = self.proto.human_monitor_command("savevm vb")
+        d2 = self.proto.human_monitor_command("loadvm vb")
+        requests = sent(self.transport)
+        self.assertEqual(requests[0]["arguments"],
+                         {"command-line": "savevm vb"})
+        reply(self.proto, requests[0]["id"], "")
+        reply(self.proto, requests[1]["id"], "Error: no snapshot\r\n")
+        self.assertEqual(successResultOf(self, d1), "")
+        failureResultOf(self, d2, qmp.QMPError)
+
+    def test_latency(self):
+        negotiate(self.proto, self.transport)
+        d = self.proto.execute("stop")
+        self.clock.advance(0.25)
+        reply(self.proto, sent(self.transport)[0]["id"])
+        successResultOf(self, d)
+        self.assertEqual(list(self.proto.latency["stop"]), [0.25])
+
+    def test_events(self):
+        received = []
+        self.proto.events.add_observer("SHUTDOWN", received.append, (), {})
+        negotiate(self.proto, self.transport)
+        self.proto.dataReceived(
+            b'{"event": "SHUTDOWN", "data": {"guest": true}, '
+            b'"timestamp": {"seconds": 10, "microseconds": 500000}}\r\n'
+            b'{"event": "NIC_RX_FILTER_CHANGED"}\r\n')
+        self.assertEqual(received,
+                         [qmp.QMPEvent("SHUTDOWN", {"guest": True}, 10.5)])
+
+    def test_connection_lost(self):
+        """Pending and queued commands fail when the connection is lost."""
+
+        d1 = self.proto.execute("stop")
+        self.proto.dataReceived(GREETING + b"\r\n")
+        self.proto.connectionLost(error.ConnectionDone())
+        failureResultOf(self, d1, error.ConnectionDone)
+        failureResultOf(self, self.proto.ready, error.ConnectionDone)
+
+    def test_bad_message(self):
+        negotiate(self.proto, self.transport)
+        self.proto.dataReceived(b"not json\r\n")
+        self.proto.dataReceived(b'{"id": 42, "return": {}}\r\n')
+
+
+class _Endpoint:
+
+    def __init__(self, client, protos):
+        self.client = client
+        self.protos = protos
+
+    def connect(self, factory):
+        if not self.protos:
+            return defer.fail(error.ConnectError())
+        proto = self.protos.pop(0)
+        proto.makeConnection(proto_helpers.StringTransport())
+        return defer.succeed(proto)
+
+
+class TestQMPClient(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = task.Clock()
+        self.protos = []
+        self.attempts = 0
+
+        def endpoint_factory(clock, path):
+            self.attempts += 1
+            return _Endpoint(self, self.protos)
+
+        self.client = qmp.QMPClient("vm", "/tmp/vm.qmp", self.clock,
+                                    endpoint_factory)
+
+    def test_not_connected(self):
+        failureResultOf(self, self.client.execute("stop"),
+                        qmp.NotConnectedError)
+
+    def test_retry(self):
+        """The client retries while the socket does not exist."""
+
+        d = self.client.connect(delays=(1, 2))
+        self.assertEqual(self.attempts, 1)
+        self.clock.advance(1)
+        self.assertEqual(self.attempts, 2)
+        self.clock.advance(2)
+        self.assertEqual(self.attempts, 3)
+        failureResultOf(self, d, error.ConnectError)
+        self.flushLoggedErrors()
+
+    def test_execute_while_connecting(self):
+        d = self.client.connect(delays=(1,))
+        proto = qmp.QMPProtocol(self.clock)
+        self.protos.append(proto)
+        result = self.client.execute("stop")
+        self.clock.advance(1)
+        negotiate(proto, proto.transport)
+        self.assertIs(successResultOf(self, d), proto)
+        self.assertIs(self.client.protocol, proto)
+        self.assertEqual(sent(proto.transport)[0]["execute"], "stop")
+        reply(proto, 2)
+        self.assertEqual(successResultOf(self, result), {})
+
+    def test_connection_lost(self):
+        """The client forgets the protocol when the connection is lost."""
+
+        proto = qmp.QMPProtocol(self.clock)
+        self.protos.append(proto)
+        d = self.client.connect()
+        negotiate(proto, proto.transport)
+        successResultOf(self, d)
+        proto.connectionLost(error.ConnectionDone())
+        self.assertIs(self.client.protocol, None)
+        self.assertFalse(self.client.is_connected())
+
+    def test_latency_stats(self):
+        self.client.latency["stop"].extend([0.1, 0.3])
+        self.assertEqual(self.client.latency_stats(),
+                         {"stop": (2, 0.2, 0.3)})
+
+
+class TestVirtualMachineQMP(unittest.TestCase):
+
+    def setUp(self):
+        self.factory = stubs.Factory()
+        self.vm = stubs.VirtualMachineStub(self.factory, "vm")
+        self.proto, self.transport = connect()
+
+    def attach(self):
+        negotiate(self.proto, self.transport)
+        self.vm.qmp.protocol = self.proto
+
+    def test_fallback_to_monitor(self):
+        """Without QMP, the powerdown is sent to the human monitor."""
+
+        successResultOf(self, self.vm.system_powerdown())
+        self.assertEqual(self.vm.sended, ["system_powerdown\n"])
+
+    def test_powerdown(self):
+        self.attach()
+        d = self.vm.system_powerdown()
+        request = sent(self.transport)[0]
+        self.assertEqual(request["execute"], "system_powerdown")
+        reply(self.proto, request["id"])
+        successResultOf(self, d)
+        self.assertEqual(self.vm.sended, [])
+
+    def test_poweroff_error(self):
+        """If qemu refuses the powerdown the error is logged and poweroff
+        waits for the process to exit."""
+
+        self.attach()
+        self.vm.proc = object()
+        self.addCleanup(setattr, self.vm, "proc", None)
+        self.vm._exited_d = exited = defer.Deferred()
+        d = self.vm.poweroff()
+        request = sent(self.transport)[0]
+        self.assertEqual(request["execute"], "system_powerdown")
+        reply(self.proto, request["id"], error={"class": "GenericError",
+                                                "desc": "not supported"})
+        self.assertEqual(len(self.flushLoggedErrors(qmp.QMPError)), 1)
+        self.assertNoResult(d)
+        exited.callback((self.vm, None))
+        successResultOf(self, d)
+
+    def test_usb_hotplug(self):
+        self.attach()
+        self.vm.proc = object()
+        self.vm.config["usbdevlist"] = ["0000:0001"]
+        self.vm.update_usbdevlist(["1d6b:0002"])
+        requests = sorted(sent(self.transport), key=lambda r: r["execute"])
+        self.assertEqual(requests[0]["execute"], "device_add")
+        self.assertEqual(requests[0]["arguments"],
+                         {"driver": "usb-host", "id": "usb-1d6b-0002",
+                          "vendorid": "0x1d6b", "productid": "0x0002"})
+        self.assertEqual(requests[1]["execute"], "device_del")
+        self.assertEqual(requests[1]["arguments"], {"id": "usb-0000-0001"})
+        self.vm.proc = None
@@ -0,0 +1,179 @@
+# Virtualbricks - a vde/qemu gui written in python and GTK/Glade.
+# Copyright (C) 2018 Virtualbricks team
+
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+
+import os
+import shutil
+import socket
+import tempfile
+
+from twisted.trial import unittest
+from twisted.internet import defer, task, protocol, reactor, error
+from twisted.python import failure
+
+from virtualbricks import bricks, errors, readiness
+from virtualbricks.tests import stubs, successResultOf, failureResultOf
+
+
+class TestPoll(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = task.Clock()
+        self.checks = []
+
+    def check(self, results):
+        def check():
+            self.checks.append(self.clock.seconds())
+            return results.pop(0)
+        return check
+
+    def test_backoff(self):
+        d = readiness.poll(self.check([False, False, False, "ok"]), 10,
+                           self.clock, (1, 2))
+        self.clock.pump([1, 2, 2])
+        self.assertEqual(successResultOf(self, d), "ok")
+        self.assertEqual(self.checks, [0, 1, 3, 5])
+
+    def test_deferred_check(self):
+        d1 = defer.Deferred()
+        d = readiness.poll(self.check([d1]), 10, self.clock)
+        self.assertNoResult(d)
+        d1.callback(True)
+        self.assertTrue(successResultOf(self, d))
+
+    def test_timeout(self):
+        d = readiness.poll(lambda: False, 3, self.clock, (1, ))
+        self.clock.pump([1, 1, 1])
+        failureResultOf(self, d, readiness.NotReadyError)
+        self.assertEqual(self.clock.getDelayedCalls(), [])
+
+    def test_cancel(self):
+        d = readiness.poll(lambda: False, 3, self.clock, (1, ))
+        d.cancel()
+        failureResultOf(self, d, defer.CancelledError)
+        self.assertEqual(self.clock.getDelayedCalls(), [])
+
+
+class TestSocketProbes(unittest.TestCase):
+
+    def setUp(self):
+        # The path of a unix socket must be short
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        self.path = os.path.join(tmpdir, "sock")
+
+    def test_socket_accepts(self):
+        self.assertFalse(readiness.socket_accepts(self.path))
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.addCleanup(sock.close)
+        sock.bind(self.path)
+        self.assertFalse(readiness.socket_accepts(self.path))
+        sock.listen(1)
+        self.assertTrue(readiness.socket_accepts(self.path))
+
+    def test_prompt_answers(self):
+        factory = protocol.Factory.forProtocol(protocol.Protocol)
+        factory.protocol = lambda: _Greeter(b"VDE switch\n\nvde$ ")
+        port = reactor.listenUNIX(self.path, factory)
+        self.addCleanup(port.stopListening)
+        d = readiness.prompt_answers(self.path,
+                                     bricks.VDEProcessProtocol.prompt)
+        return d.addCallback(self.assertTrue)
+
+    def test_no_socket(self):
+        d = readiness.prompt_answers(self.path,
+                                     bricks.VDEProcessProtocol.prompt)
+        return d.addCallback(self.assertFalse)
+
+
+class _Greeter(protocol.Protocol):
+
+    def __init__(self, greeting):
+        self.greeting = greeting
+
+    def connectionMade(self):
+        self.transport.write(self.greeting)
+
+
+class SlowBrick(stubs.StubBrick):
+
+    ready = None
+
+    def probe_ready(self):
+        self.ready = defer.Deferred()
+        return self.ready
+
+
+class TestBrickReadiness(unittest.TestCase):
+
+    def setUp(self):
+        self.brick = SlowBrick(stubs.Factory(), "slow")
+        self.brick._started_d = self.started = defer.Deferred()
+        self.brick._exited_d = defer.Deferred()
+        self.brick.proc = bricks.FakeProcess(self.brick)
+
+    def test_poweron_at_readiness(self):
+        """The poweron deferred fires when the brick is ready."""
+
+        self.brick.process_started(self.brick.proc)
+        self.assertNoResult(self.started)
+        self.brick.ready.callback(None)
+        self.assertIs(successResultOf(self, self.started), self.brick)
+        self.assertIsNot(self.brick.time_to_ready, None)
+
+    def test_not_ready(self):
+        """If the brick is not ready the process is stopped."""
+
+        signals = []
+        self.brick.proc.signal_process = signals.append
+        self.brick.process_started(self.brick.proc)
+        self.brick.ready.errback(readiness.NotReadyError())
+        failureResultOf(self, self.started, readiness.NotReadyError)
+        self.assertEqual(signals, ["TERM"])
+        self.flushLoggedErrors(readiness.NotReadyError)
+
+    def test_exit_before_ready(self):
+        """If the process exits, the probe is cancelled and poweron fails
+        with the exit status."""
+
+        self.brick.process_started(self.brick.proc)
+        d = bricks.Brick.poweron(self.brick)
+        status = failure.Failure(error.ProcessTerminated(1))
+        self.brick.process_ended(self.brick.proc, status)
+        for d in self.started, d:
+            err = failureResultOf(self, d, errors.BrickError).value
+            self.assertIs(err.status, status)
+        self.assertIn("exit code 1", str(err))
+
+    def test_poweron_while_starting(self):
+        """poweron on a brick not ready yet waits for the probe."""
+
+        self.brick.process_started(self.brick.proc)
+        d = bricks.Brick.poweron(self.brick)
+        self.assertNoResult(d)
+        self.brick.ready.callback(None)
+        self.assertIs(successResultOf(self, d), self.brick)
+        self.assertIs(successResultOf(self, bricks.Brick.poweron(self.brick)),
+                      self.brick)
+
+    def test_poweron_while_starting_fails(self):
+        self.brick.process_started(self.brick.proc)
+        d = bricks.Brick.poweron(self.brick)
+        self.brick.ready.errback(readiness.NotReadyError())
+        failureResultOf(self, self.started, readiness.NotReadyError)
+        failureResultOf(self, d, readiness.NotReadyError)
+        self.flushLoggedErrors(readiness.NotReadyError)
@@ -0,0 +1,126 @@
+# Virtualbricks - a vde/qemu gui written in python and GTK/Glade.
+# Copyright (C) 2018 Virtualbricks team
+
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+import os
+
+import six
+from twisted.trial import unittest
+from twisted.python import filepath
+
+from virtualbricks import configfile, project, snapshot, _configparser
+from virtualbricks.tests import stubs, LoggingObserver
+
+
+def dump(factory):
+    sio = six.StringIO()
+    configfile.ConfigFile().save_to(factory, sio)
+    return sio.getvalue()
+
+
+def no_parser(fileobj):
+    raise AssertionError("the project file is parsed")
+
+
+class TestSnapshot(unittest.TestCase):
+
+    def setUp(self):
+        self.factory = stubs.Factory()
+        image = self.mktemp()
+        open(image, "w").close()
+        self.factory.new_disk_image("disk", image)
+        event = self.factory.new_event("ev")
+        event.set({"delay": 5})
+        switch = self.factory.new_brick("switch", "sw")
+        vm = self.factory.new_brick("vm", "vm")
+        vm.set({"ram": 256})
+        vm.add_sock("00:11:22:33:44:55", "e1000")
+        vm.connect(switch.socks[0], "00:11:22:33:44:66", "rtl8139")
+        self.fp = filepath.FilePath(self.mktemp())
+        self.config = configfile.ConfigFile()
+
+    def restore(self):
+        factory = stubs.Factory()
+        self.config.restore(factory, self.fp)
+        return factory
+
+    def test_save(self):
+        """The snapshot is written when the project is saved."""
+
+        self.config.save(self.factory, self.fp)
+        self.assertTrue(os.path.exists(snapshot.filename(self.fp.path)))
+
+    def test_restore(self):
+        """A valid snapshot is restored without parsing the project."""
+
+        self.config.save(self.factory, self.fp)
+        observer = LoggingObserver()
+        self.addCleanup(configfile.snapshot_restored.tap(
+            observer, configfile.logger.publisher))
+        self.patch(_configparser, "Parser", no_parser)
+        factory = self.restore()
+        self.assertEqual(dump(factory), dump(self.factory))
+        self.assertEqual(len(observer), 1)
+        self.assertEqual(observer[0]["count"], 2)
+
+    def test_stale(self):
+        """If the project file changes the snapshot is ignored."""
+
+        self.config.save(self.factory, self.fp)
+        with self.fp.open("a") as fp:
+            fp.write(b"[Switch:sw2]\n")
+        factory = self.restore()
+        self.assertIsNot(factory.get_brick_by_name("sw2"), None)
+
+    def test_missing(self):
+        self.config.save(self.factory, self.fp)
+        os.remove(snapshot.filename(self.fp.path))
+        self.assertEqual(dump(self.restore()), dump(self.factory))
+
+    def test_broken(self):
+        """If the snapshot cannot be loaded the project file is parsed."""
+
+        self.config.save(self.factory, self.fp)
+        images, events, bricks, socks, links = snapshot.state(self.factory)
+        links.append(("nobody", "sw_port", "", ""))
+        with open(self.fp.path, "rb") as fp:
+            digest = snapshot.digest(fp.read())
+        with open(snapshot.filename(self.fp.path), "wb") as fp:
+            fp.write(snapshot.dumps((images, events, bricks, socks, links),
+                                    digest))
+        factory = self.restore()
+        self.assertEqual(dump(factory), dump(self.factory))
+        self.flushLoggedErrors(AttributeError)
+
+    def test_loads(self):
+        """The header is checked before the body is loaded."""
+
+        state = snapshot.state(self.factory)
+        digest = snapshot.digest(b"content")
+        data = snapshot.dumps(state, digest)
+        self.assertEqual(snapshot.loads(data, digest), state)
+        self.assertIs(snapshot.loads(data, snapshot.digest(b"other")), None)
+        self.assertIs(snapshot.loads(data[:10], digest), None)
+        self.assertIs(snapshot.loads(data[:-1], digest), None)
+        self.patch(snapshot, "FORMAT", snapshot.FORMAT + 1)
+        self.assertIs(snapshot.loads(data, digest), None)
+
+    def test_not_exported(self):
+        manager = project.ProjectManager(self.mktemp())
+        prj = manager.get_project("test")
+        prj.create()
+        prj.save(self.factory)
+        self.assertEqual([fp.basename() for fp in prj.files()], [".project"])
@@ -0,0 +1,164 @@
+# Virtualbricks - a vde/qemu gui written in python and GTK/Glade.
+# Copyright (C) 2018 Virtualbricks team
+
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+import os
+import shutil
+import socket
+import subprocess
+import tempfile
+
+from twisted.trial import unittest
+from twisted.internet import defer, error, protocol, reactor, task
+
+from virtualbricks import _spawn, spawnserver
+
+
+class _Protocol(protocol.ProcessProtocol):
+
+    def __init__(self, data=b""):
+        self.data = data
+        self.out = b""
+        self.ended = defer.Deferred()
+
+    def connectionMade(self):
+        self.transport.write(self.data)
+        self.transport.closeStdin()
+
+    def outReceived(self, data):
+        self.out += data
+
+    def processEnded(self, reason):
+        self.ended.callback(reason.value)
+
+
+class _Reactor:
+
+    def __init__(self):
+        self.spawned = []
+
+    def spawnProcess(self, proto, executable, args, env, path):
+        self.spawned.append((executable, args, path))
+
+    def adoptStreamConnection(self, fileno, family, factory):
+        return reactor.adoptStreamConnection(fileno, family, factory)
+
+
+class TestSpawnServer(unittest.TestCase):
+
+    if not spawnserver.available():
+        skip = "posix_spawn not available"
+
+    @defer.inlineCallbacks
+    def setUp(self):
+        # The path of a unix socket is short, do not use mktemp()
+        tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp)
+        self.server = _spawn.SpawnServer(reactor)
+        self.server.start(os.path.join(tmp, "spawn.sock"))
+        self.addCleanup(self.server.stop)
+        while not os.path.exists(self.server.path):
+            yield task.deferLater(reactor, 0.01, lambda: None)
+
+    @defer.inlineCallbacks
+    def test_stdio(self):
+        proto = _Protocol(b"hello")
+        proc = self.server.spawnProcess(proto, "cat", ["cat"], os.environ)
+        self.assertIsInstance(proc, _spawn.RemoteProcess)
+        self.assertTrue(proc.pid > 0)
+        reason = yield proto.ended
+        self.assertIsInstance(reason, error.ProcessDone)
+        self.assertEqual(proto.out, b"hello")
+        self.assertIs(proc.pid, None)
+        self.assertEqual(self.server.spawned, 1)
+
+    @defer.inlineCallbacks
+    def test_exit_code(self):
+        proto = _Protocol()
+        self.server.spawnProcess(proto, "sh", ["sh", "-c", "exit 3"],
+                                 os.environ)
+        reason = yield proto.ended
+        self.assertIsInstance(reason, error.ProcessTerminated)
+        self.assertEqual(reason.exitCode, 3)
+
+    @defer.inlineCallbacks
+    def test_signal(self):
+        proto = _Protocol()
+        proc = self.server.spawnProcess(proto, "sleep", ["sleep", "10"],
+                                        os.environ)
+        proc.signalProcess("TERM")
+        reason = yield proto.ended
+        self.assertIsInstance(reason, error.ProcessTerminated)
+        self.assertEqual(reason.signal, 15)
+        self.assertRaises(error.ProcessExitedAlready, proc.signalProcess,
+                          "TERM")
+
+    def test_not_found(self):
+        """The spawn errors are raised, as the ones of posix_spawn."""
+
+        self.assertRaises(OSError, self.server.spawnProcess, _Protocol(),
+                          "/nonexistent", ["nonexistent"], os.environ)
+
+
+class TestFallback(unittest.TestCase):
+
+    def test_not_started(self):
+        """Until the server is started the processes are spawned by the
+        reactor."""
+
+        fake = _Reactor()
+        server = _spawn.SpawnServer(fake)
+        server.spawnProcess(_Protocol(), "cat", ["cat"], {})
+        self.assertEqual(fake.spawned, [("cat", ["cat"], None)])
+
+    def test_path(self):
+        """The server does not change directory, the reactor does."""
+
+        fake = _Reactor()
+        server = _spawn.SpawnServer(fake)
+        server.is_running = lambda: True
+        server.spawnProcess(_Protocol(), "cat", ["cat"], {}, "/")
+        self.assertEqual(fake.spawned, [("cat", ["cat"], "/")])
+
+    @defer.inlineCallbacks
+    def test_slow_server(self):
+        """If the server does not reply in time the reactor spawns the
+        process and the child spawned later by the server is terminated."""
+
+        tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp)
+        listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.addCleanup(listener.close)
+        listener.bind(os.path.join(tmp, "spawn.sock"))
+        listener.listen(1)
+        fake = _Reactor()
+        server = _spawn.SpawnServer(fake)
+        server.path = listener.getsockname()
+        server.is_running = lambda: True
+        server.reply_timeout = 0.01
+        server.spawnProcess(_Protocol(), "cat", ["cat"], {})
+        self.assertEqual(fake.spawned, [("cat", ["cat"], None)])
+        late = subprocess.Popen(["sleep", "10"])
+        self.addCleanup(late.wait)
+        self.addCleanup(late.kill)
+        conn, _ = listener.accept()
+        self.addCleanup(conn.close)
+        conn.sendall("pid {0}\n".format(late.pid).encode())
+        for _ in range(500):
+            if late.poll() is not None:
+                break
+            yield task.deferLater(reactor, 0.01, lambda: None)
+        self.assertEqual(late.returncode, -15)
@@ -15,10 +15,10 @@
 # with this program; if not, write to the Free Software Foundation, Inc.,
 # 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
 
+import io
 import os
 import os.path
 import struct
-import six
 
 from virtualbricks import tools
 from virtualbricks.tests import unittest
@@ -68,30 +68,36 @@ class TestTools(unittest.TestCase):
             self.assertFalse(os.path.isfile(filename))
 
     def test_backing_file_from_cow(self):
-        sio = six.StringIO(COW_HEADER[8:])
+        sio = io.BytesIO(COW_HEADER[8:])
         backing_file = tools.get_backing_file_from_cow(sio)
-        self.assertEqual(backing_file, HELLO)
+        self.assertEqual(backing_file, HELLO.decode())
 
     def test_backing_file_from_qcow0(self):
-        sio = six.StringIO(QCOW_HEADER0[8:])
+        sio = io.BytesIO(QCOW_HEADER0[8:])
         backing_file = tools.get_backing_file_from_qcow(sio)
         self.assertEqual(backing_file, "")
 
     def test_backing_file_from_qcow(self):
-        sio = six.StringIO(QCOW_HEADER)
+        sio = io.BytesIO(QCOW_HEADER)
         sio.seek(8)
         backing_file = tools.get_backing_file_from_qcow(sio)
-        self.assertEqual(backing_file, HELLO)
+        self.assertEqual(backing_file, HELLO.decode())
 
     def test_backing_file(self):
         for header in COW_HEADER, QCOW_HEADER, QCOW_HEADER2:
-            sio = six.StringIO(header)
+            sio = io.BytesIO(header)
             backing_file = tools.get_backing_file(sio)
             self.assertEqual(backing_file, "/hello/backingfile")
 
-        sio = six.StringIO(UNKNOWN_HEADER)
+        sio = io.BytesIO(UNKNOWN_HEADER)
         self.assertRaises(tools.UnknowTypeError, tools.get_backing_file, sio)
 
+    def test_image_type(self):
+        self.assertEqual(tools.image_type(QCOW_HEADER2),
+                         tools.ImageFormat.QCOW2)
+        self.assertEqual(tools.image_type(UNKNOWN_HEADER),
+                         tools.ImageFormat.UNKNOWN)
+
     def test_fmtsize(self):
         """Basic fmtusage."""
 
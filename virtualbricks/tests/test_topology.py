@@ -0,0 +1,100 @@
+# Virtualbricks - a vde/qemu gui written in python and GTK/Glade.
+# Copyright (C) 2018 Virtualbricks team
+
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+from twisted.trial import unittest
+
+from virtualbricks import virtualmachines
+from virtualbricks.tests import stubs
+from virtualbricks.tests.test_power import PowerBrick
+
+
+class TestGraph(unittest.TestCase):
+
+    def setUp(self):
+        self.factory = stubs.Factory()
+        self.factory.register_brick_type(PowerBrick, "power")
+        self.graph = self.factory.graph
+
+    def new(self, name):
+        return self.factory.new_brick("power", name)
+
+    def test_connect_disconnect(self):
+        switch = self.new("switch")
+        vm = self.new("vm")
+        self.assertEqual(self.graph.neighbours(vm), [])
+        vm.plug_into(switch)
+        self.assertEqual(self.graph.dependencies(vm), [switch])
+        self.assertEqual(self.graph.dependents(switch), [vm])
+        self.assertEqual(self.graph.neighbours(switch), [vm])
+        vm.plugs[0].disconnect()
+        self.assertEqual(self.graph.neighbours(vm), [])
+        self.assertEqual(self.graph.incoming(switch), [])
+
+    def test_hostonly(self):
+        """Links to the host-only network are not part of the graph."""
+
+        vm = self.factory.new_brick("vm", "vm")
+        vm.add_plug(virtualmachines.hostonly_sock)
+        self.assertEqual(self.graph.links(vm), [])
+
+    def test_del_brick(self):
+        """Deleting a brick disconnects the plugs connected to its socks."""
+
+        switch = self.new("switch")
+        vm = self.new("vm")
+        vm.plug_into(switch)
+        self.factory.del_brick(switch)
+        self.assertNotIn(switch, self.graph)
+        self.assertIs(vm.plugs[0].sock, None)
+        self.assertEqual(self.graph.neighbours(vm), [])
+
+    def test_components(self):
+        sw1, sw2, vm1, vm2, vm3 = [self.new(n) for n in
+                                   ("sw1", "sw2", "vm1", "vm2", "vm3")]
+        vm1.plug_into(sw1)
+        vm2.plug_into(sw1)
+        vm3.plug_into(sw2)
+        self.assertEqual(self.graph.component(vm1), set([sw1, vm1, vm2]))
+        self.assertEqual(sorted(len(c) for c in self.graph.components()),
+                         [2, 3])
+
+    def test_shortest_path(self):
+        sw1, sw2, wire, vm1, vm2 = [self.new(n) for n in
+                                    ("sw1", "sw2", "wire", "vm1", "vm2")]
+        vm1.plug_into(sw1)
+        wire.plug_into(sw1)
+        wire.plug_into(sw2)
+        vm1.plug_into(sw2)
+        self.assertEqual(self.graph.shortest_path(vm1, sw2), [vm1, sw2])
+        self.assertEqual(self.graph.shortest_path(wire, vm1),
+                         [wire, sw1, vm1])
+        self.assertIs(self.graph.shortest_path(vm1, vm2), None)
+
+    def test_find_cycle(self):
+        vm1, vm2, vm3 = [self.new(n) for n in ("vm1", "vm2", "vm3")]
+        vm1.plug_into(vm1)
+        vm1.plug_into(vm2)
+        self.assertIs(self.graph.find_cycle(), None)
+        vm2.plug_into(vm3)
+        vm3.plug_into(vm1)
+        self.assertEqual(self.graph.find_cycle([vm1]), [vm1, vm2, vm3])
+        self.assertTrue(self.graph.has_cycle())
+
+    def test_version(self):
+        version = self.graph.version
+        self.new("vm")
+        self.assertTrue(self.graph.version > version)
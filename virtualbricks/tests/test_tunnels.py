@@ -0,0 +1,122 @@
+# Virtualbricks - a vde/qemu gui written in python and GTK/Glade.
+# Copyright (C) 2018 Virtualbricks team
+
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+
+import os
+import stat
+
+from twisted.trial import unittest
+from twisted.internet import defer, error
+
+from virtualbricks import bricks, tunnels, settings
+from virtualbricks.tests import stubs, successResultOf, failureResultOf
+
+
+class TestTunnelKey(unittest.TestCase):
+
+    def test_key(self):
+        """The key is the output of echo <password> | sha1sum."""
+
+        self.assertEqual(tunnels.key("abc"),
+                         b"03cfd743661f07975fa2f1220c5194cbaff48451  -\n")
+
+    def test_write_key(self):
+        path = self.mktemp()
+        tunnels.write_key(path, "abc")
+        with open(path, "rb") as fp:
+            self.assertEqual(fp.read(), tunnels.key("abc"))
+        self.assertEqual(stat.S_IMODE(os.stat(path).st_mode), 0o600)
+
+    def test_args(self):
+        factory = stubs.Factory()
+        tunnel = factory.new_brick("tunnell", "tunnel")
+        path = os.path.abspath(self.mktemp())
+        tunnel.key_path = lambda: path
+        tunnel.prog = lambda: "vde_cryptcab"
+        d = tunnel.args()
+        d.addCallback(self.assertEqual,
+                      ["vde_cryptcab", "-P", path, "-p", "7667"])
+        return d
+
+
+class TestTapInterface(unittest.TestCase):
+
+    def setUp(self):
+        self.factory = stubs.Factory()
+        self.tap = self.factory.new_brick("tap", "tap0")
+        self.tap.needsudo = lambda: False
+        self.commands = []
+        self.results = []
+
+    def spawn(self, exe, args, env):
+        self.commands.append([exe] + list(args))
+        d = defer.Deferred()
+        self.results.append(d)
+        return d
+
+    def test_off(self):
+        d = self.tap.configure_interface(run=self.spawn)
+        self.assertIs(successResultOf(self, d), self.tap)
+        self.assertEqual(self.commands, [])
+
+    def test_manual(self):
+        """The commands are run one after the other."""
+
+        self.tap.set({"mode": "manual", "gw": "10.0.0.254"})
+        d = self.tap.configure_interface(run=self.spawn)
+        self.assertEqual(self.commands, [["/sbin/ifconfig", "tap0",
+                                          "10.0.0.1", "netmask",
+                                          "255.255.255.0"]])
+        self.results[0].callback(("", "", 0))
+        self.assertEqual(self.commands[1], ["/sbin/route", "add", "default",
+                                            "gw", "10.0.0.254", "dev",
+                                            "tap0"])
+        self.results[1].callback(("", "", 0))
+        self.assertIs(successResultOf(self, d), self.tap)
+
+    def test_sudo(self):
+        self.tap.needsudo = lambda: True
+        self.tap.set({"mode": "dhcp"})
+        self.tap.configure_interface(run=self.spawn)
+        self.assertEqual(self.commands,
+                         [[settings.get("sudo"), "--", "dhclient", "tap0"]])
+
+    def test_failure(self):
+        self.tap.set({"mode": "dhcp"})
+        d = self.tap.configure_interface(run=self.spawn)
+        self.results[0].callback(("", "no such device", 1))
+        failureResultOf(self, d, error.ProcessTerminated)
+        self.flushLoggedErrors()
+
+    def test_ready_when_configured(self):
+        """The tap is ready, and poweron fires, when the interface is
+        configured."""
+
+        self.tap.set({"mode": "dhcp"})
+        configure = self.tap.configure_interface
+        self.tap.configure_interface = lambda: configure(run=self.spawn)
+        self.tap._started_d = started = defer.Deferred()
+        self.tap._exited_d = defer.Deferred()
+        self.tap.proc = bricks.FakeProcess(self.tap)
+        self.addCleanup(setattr, self.tap, "proc", None)
+        self.tap.process_started(self.tap.proc)
+        d = self.tap.poweron()
+        self.assertNoResult(started)
+        self.assertNoResult(d)
+        self.results[0].callback(("", "", 0))
+        self.assertIs(successResultOf(self, started), self.tap)
+        self.assertIs(successResultOf(self, d), self.tap)
@@ -24,7 +24,7 @@ from twisted.trial import unittest
 from twisted.internet import defer
 
 from virtualbricks import (link, virtualmachines as vm, errors, settings,
-                           configfile, tools)
+                           configfile, tools, imageinfo)
 from virtualbricks.tests import (stubs, test_link, successResultOf,
                                  failureResultOf, TEST_DATA_PATH)
 
@@ -37,6 +37,8 @@ def disks(vm):
 ARGS = ["true", "-m", "64", "-smp", "1", "@@DRIVESARGS@@", "-name", "vm",
         "-net", "none", "-mon", "chardev=mon", "-chardev",
         "socket,id=mon,path=/home/marco/.virtualbricks/vm.mgmt,server,nowait",
+        "-mon", "chardev=qmp,mode=control", "-chardev",
+        "socket,id=qmp,path=/home/marco/.virtualbricks/vm.qmp,server,nowait",
         "-mon", "chardev=mon_cons", "-chardev", "stdio,id=mon_cons,signal=off"]
 
 
@@ -107,6 +109,19 @@ class TestVirtualMachine(unittest.TestCase):
         self.assertIs(sock.model, model)
         self.assertEqual(self.factory.socks, [sock.original])
 
+    def test_lazy_disks(self):
+        """The disks are created when they are used."""
+
+        self.assertEqual([disk.device for disk in self.vm.disks()], ["hda"])
+        self.assertEqual(self.vm.config.get("hdb"), "")
+        self.assertEqual(len(list(self.vm.disks())), 1)
+        disk = self.vm.config["hdb"]
+        self.assertIsInstance(disk, vm.Disk)
+        self.assertIs(disk.VM, self.vm)
+        self.assertIs(self.vm.config["hdb"], disk)
+        self.assertEqual([disk.device for disk in self.vm.disks()],
+                         ["hda", "hdb"])
+
     def test_get_disk_args(self):
         disk = DiskStub(self.vm, "hda")
         self.vm.config["hda"] = disk
@@ -252,7 +267,6 @@ class FULL:
 class DiskStub(vm.Disk):
 
     _basefolder = None
-    sync_cmd = "false"
 
     def get_basefolder(self):
         if self._basefolder is not None:
@@ -296,14 +310,25 @@ class TestDisk(unittest.TestCase):
 
         def eb(failure):
             failure.trap(RuntimeError)
-            failure.value.args[0].startswith("sync failed")
+            self.assertTrue(failure.value.args[0].startswith("sync failed"))
+
+        d = self.disk._sync(("", "", 0), "/montypython/cow")
+        return d.addCallbacks(cb, eb)
 
-        return self.disk._sync(("", "", 0)).addCallbacks(cb, eb)
+    def test_sync(self):
+        """Only the new image is flushed to disk."""
+
+        cowname = self.mktemp()
+        open(cowname, "w").close()
+        synced = []
+        self.patch(tools, "fsync", synced.append)
+        d = self.disk._sync(("", "", 0), cowname)
+        return d.addCallback(lambda _: self.assertEqual(synced, [cowname]))
 
     def test_check_base(self):
         err = self.assertRaises(IOError, self.disk._check_base, "/montypython")
         self.assertEqual(err.errno, errno.ENOENT)
-        self.patch(tools, "get_backing_file", lambda _: NULL())
+        self.patch(imageinfo, "backing_file", lambda _: NULL())
         self.disk._create_cow = lambda _: defer.succeed(None)
         self.disk.image = ImageStub()
         cowname = self.mktemp()
@@ -312,7 +337,7 @@ class TestDisk(unittest.TestCase):
         result = []
         self.disk._check_base(cowname).addCallback(result.append)
         self.assertEqual(result, [cowname])
-        self.patch(tools, "get_backing_file", lambda _: FULL())
+        self.patch(imageinfo, "backing_file", lambda _: FULL())
         del result[:]
         cowname = self.mktemp()
         fp = open(cowname, "w")
@@ -0,0 +1,124 @@
+# Virtualbricks - a vde/qemu gui written in python and GTK/Glade.
+# Copyright (C) 2018 Virtualbricks team
+
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+
+import threading
+
+from twisted.trial import unittest
+from twisted.internet import task
+from twisted.test import proto_helpers
+
+from virtualbricks import console, watchdog
+from virtualbricks.tests import stubs
+
+
+class TestHistogram(unittest.TestCase):
+
+    def test_buckets(self):
+        histogram = watchdog.Histogram((0.01, 0.1))
+        for value in 0.001, 0.01, 0.05, 0.5:
+            histogram.add(value)
+        self.assertEqual(histogram.buckets(),
+                         [(0.01, 2), (0.1, 1), (None, 1)])
+        self.assertEqual(histogram.max, 0.5)
+        self.assertAlmostEqual(histogram.mean(), 0.561 / 4)
+
+    def test_percentile(self):
+        histogram = watchdog.Histogram((0.01, 0.1))
+        for i in range(98):
+            histogram.add(0.005)
+        histogram.add(0.05)
+        histogram.add(3)
+        self.assertEqual(histogram.percentile(50), 0.01)
+        self.assertEqual(histogram.percentile(99), 0.1)
+        self.assertEqual(histogram.percentile(100), 3)
+
+    def test_empty(self):
+        histogram = watchdog.Histogram()
+        self.assertEqual(histogram.percentile(99), 0.0)
+        self.assertEqual(histogram.mean(), 0.0)
+
+
+class TestWatchdog(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = task.Clock()
+        self.now = 100.0
+        self.dog = watchdog.Watchdog(0.5, 0.1, self.clock, lambda: self.now)
+        self.dog._main_thread = threading.current_thread().ident
+        self.dog._last_beat = self.now
+        self.events = []
+        self.addCleanup(watchdog.stall_detected.tap(self.events.append,
+                                                    watchdog.logger.publisher))
+
+    def tick(self, lag=0.0):
+        self.now += 0.1 + lag
+        self.dog._tick(self.now - lag)
+
+    def test_lag(self):
+        self.tick(0.003)
+        self.tick()
+        self.assertEqual(self.dog.histogram.count, 2)
+        self.assertAlmostEqual(self.dog.histogram.max, 0.003)
+        self.assertEqual(self.events, [])
+        self.dog._call.cancel()
+
+    def test_stall(self):
+        """The helper captures the stack of a blocked reactor, the stall is
+        logged when the reactor runs again."""
+
+        self.now += 0.7
+        self.dog.check()
+        self.assertIn("test_stall", self.dog._captured[1])
+        self.dog._tick(self.now - 0.6)
+        self.assertEqual(self.dog.stalls, 1)
+        [event] = self.events
+        self.assertAlmostEqual(event["duration"], 0.6)
+        self.assertIn("test_stall", event["stack"])
+        self.dog._call.cancel()
+
+    def test_no_capture_in_time(self):
+        """The helper does not capture if the reactor is ticking."""
+
+        self.now += 0.3
+        self.dog.check()
+        self.assertIs(self.dog._captured, None)
+
+    def test_start_stop(self):
+        dog = watchdog.Watchdog(0.5, 0.1, self.clock)
+        dog.start()
+        self.assertTrue(dog.is_running())
+        self.clock.advance(0.1)
+        self.assertEqual(dog.histogram.count, 1)
+        dog.stop()
+        self.assertFalse(dog.is_running())
+        self.assertEqual(self.clock.getDelayedCalls(), [])
+
+
+class TestLagCommand(unittest.TestCase):
+
+    def test_lag(self):
+        factory = stubs.Factory()
+        factory.watchdog.histogram.add(0.003)
+        protocol = console.VBProtocol(factory)
+        transport = proto_helpers.StringTransport()
+        protocol.makeConnection(transport)
+        transport.clear()
+        protocol.lineReceived(b"lag")
+        lines = transport.value().decode().splitlines()
+        self.assertTrue(lines[0].startswith("ticks: 1, stalls: 0"))
+        self.assertEqual(lines[1].split(), ["<=", "5ms", "1"])
@@ -20,9 +20,10 @@ try:
 except ImportError:
     mock = None
 from twisted.trial import unittest
+from twisted.internet import defer
 
-from virtualbricks import wires, link, settings
-from virtualbricks.tests import stubs, skipUnless
+from virtualbricks import bricks, wires, link, settings
+from virtualbricks.tests import stubs, skipUnless, failureResultOf
 
 
 class TestNetemu(unittest.TestCase):
@@ -100,3 +101,18 @@ class TestNetemu(unittest.TestCase):
         self.netemu.cbset_delay.assert_called_once_with(1)
         self.netemu.cbset_delayr.assert_called_once_with(2)
         self.netemu.send.assert_called_once_with("delay 1\n")
+
+    def test_live_management_error(self):
+        """An error of a command fails the symmetric setting once."""
+
+        self.netemu.config["delaysymm"] = False
+
+        def send(cmd):
+            if cmd.startswith("delay RL"):
+                return defer.fail(bricks.CommandError(cmd, 1022,
+                                                      "Invalid argument"))
+            return defer.succeed(None)
+
+        self.netemu.send = send
+        d = self.netemu.cbset_delaysymm(False)
+        failureResultOf(self, d, bricks.CommandError)
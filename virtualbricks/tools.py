@@ -20,24 +20,29 @@
 import os
 import sys
 import errno
-from pathlib import Path
 import random
 import re
 import functools
 import tempfile
 import struct
+import io
 
-from virtualbricks import log
+from virtualbricks import log, imageinfo
+from virtualbricks.imageinfo import ImageFormat
 
 from twisted.internet import utils
-from twisted.python import constants
 
 logger = log.Logger()
 ksm_error = log.Event("Can not change ksm state. (failed command: {cmd})")
 
 
 def random_mac():
-    random.seed()
+    """Return a random MAC address.
+
+    The address is not checked against the ones in use, see
+    L{virtualbricks.macs.MacAllocator} for that.
+    """
+
     return "00:aa:{0:02x}:{1:02x}:{2:02x}:{3:02x}".format(
         random.getrandbits(8), random.getrandbits(8), random.getrandbits(8),
         random.getrandbits(8))
@@ -74,15 +79,14 @@ def stack_trace():
 
 
 def _check_missing(default_paths, files):
+    from virtualbricks import capabilities
+
     if not default_paths:
-        default_paths = os.environ.get('PATH', '.').split(':')
-    elif isinstance(default_paths, str):
-        default_paths = [default_paths]
+        default_paths = ""
+    elif not isinstance(default_paths, str):
+        default_paths = os.pathsep.join(map(str, default_paths))
     for filename in files:
-        for directory in default_paths:
-            if os.access(Path(directory, filename), os.X_OK):
-                break
-        else:
+        if capabilities.cache.resolve(default_paths, filename) is None:
             yield filename
 
 
@@ -156,68 +160,77 @@ class Tempfile:
                 raise
 
 
-GENERIC_HEADER_FMT = ">II"
-_L = struct.calcsize(GENERIC_HEADER_FMT)
-COW_MAGIC = 0x4f4f4f4d # OOOM
 COW_SIZE = 1024
-QCOW_MAGIC = 0x514649fb  # \xfbIFQ
 QCOW_HEADER_FMT = ">QI"
-COWD_MAGIC = 0x44574f43  # COWD
-VMDK_MAGIC = 0x564d444b  # KDMV
-QED_MAGIC = 0x00444551  # \0DEQ
-VDI_HEADER_FMT = "<64cI"
-VDI_SIGNATURE = 0xbeda107f
-_VDI_L = struct.calcsize(VDI_HEADER_FMT)
-VPC_HEADER_FMT = "<8c"
-VPC_CREATOR = "conectix"
-_VPC_L = struct.calcsize(VPC_HEADER_FMT)
-CLOOP_MAGIC = """#!/bin/sh
-#V2.0 Format
-modprobe cloop file=$0 && mount -r -t iso9660 /dev/cloop $1
-"""
-CLOOP_HEADER_FMT = "{0}c".format(len(CLOOP_MAGIC))
-_CLOOP_L = struct.calcsize(CLOOP_HEADER_FMT)
-_MAX_HEADER = max(_L, _VDI_L, _VPC_L, _CLOOP_L)
-
 
 
 def get_backing_file_from_cow(fp):
     data = fp.read(COW_SIZE)
-    return data.rstrip("\x00")
+    return data.rstrip(b"\x00").decode("utf-8", "replace")
 
 
 def get_backing_file_from_qcow(fp):
-    offset, size = struct.unpack(QCOW_HEADER_FMT, fp.read(12).encode("utf-8"))
+    offset, size = struct.unpack(QCOW_HEADER_FMT, fp.read(12))
     if size == 0:
         return ""
     else:
         fp.seek(offset)
-        return fp.read(size)
+        return fp.read(size).decode("utf-8", "replace")
 
 
 class UnknowTypeError(Exception):
     pass
 
-#struct.error: unpack requires a bytes object of length 8 ... tried encode but not working
+
 def get_backing_file(fp):
-    data = fp.read(8)
-    magic, version = struct.unpack(GENERIC_HEADER_FMT, data)
-    if magic == COW_MAGIC:
-        return get_backing_file_from_cow(fp)
-    elif magic == QCOW_MAGIC and version in (1, 2, 3):
-        return get_backing_file_from_qcow(fp)
-    raise UnknowTypeError()
+    """Return the backing file of an image open in binary mode.
+
+    See L{virtualbricks.imageinfo} for the other formats and for a cached
+    version.
+    """
+
+    image = imageinfo.read_info(fp)
+    if image.format not in (ImageFormat.COW, ImageFormat.QCOW,
+                            ImageFormat.QCOW2):
+        raise UnknowTypeError()
+    return image.backing_file or ""
 
 
 def backing_files_for(files):
     for file in files:
         try:
-            with open(file) as fp:
-                yield get_backing_file(fp)
+            yield get_backing_file_from_path(file)
         except UnknowTypeError:
             pass
 
 
+def get_backing_file_from_path(path):
+    image = imageinfo.info(path)
+    if image.format not in (ImageFormat.COW, ImageFormat.QCOW,
+                            ImageFormat.QCOW2):
+        raise UnknowTypeError()
+    return image.backing_file or ""
+
+
+def fsync(path):
+    """Flush to disk the content of a file and its entry in the directory.
+
+    Unlike the sync(1) command it does not flush all the dirty pages of the
+    host, only the ones of the file.
+    """
+
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+    fd = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
 def fmtsize(size):
     if size < 10240:
         return "{0} B".format(size)
@@ -302,59 +315,17 @@ def copyTo(self, destination, followLinks=True):
         raise OSError(errno.ENOENT, "No such file or directory")
 
 
-class DummyDict(dict):
-
-    __slots__ = ["value"]
-
-    def __init__(self, value):
-        self.value = value
-
-    def __getitem__(self, name):
-        return self.value
-
-
-class ImageFormat(constants.Names):
-
-    RAW = constants.NamedConstant()
-    QCOW2 = constants.NamedConstant()
-    QED = constants.NamedConstant()
-    QCOW = constants.NamedConstant()
-    COW = constants.NamedConstant()
-    VDI = constants.NamedConstant()
-    VMDK = constants.NamedConstant()
-    VPC = constants.NamedConstant()
-    CLOOP = constants.NamedConstant()
-    UNKNOWN = constants.NamedConstant()
-
-
-_type_map = {
-    COW_MAGIC: {1: ImageFormat.COW},
-    QCOW_MAGIC: {1: ImageFormat.QCOW, 2: ImageFormat.QCOW2},
-    COWD_MAGIC: {1: ImageFormat.VMDK},
-    VMDK_MAGIC: {1: ImageFormat.VMDK},
-    QED_MAGIC: DummyDict(ImageFormat.QED)
-}
+def _known(format):
+    # imageinfo takes any unknown file for raw, as qemu-img does
+    return ImageFormat.UNKNOWN if format is ImageFormat.RAW else format
 
 
 def image_type(data):
-    magic, version = struct.unpack(GENERIC_HEADER_FMT, data[:_L])
-    try:
-        return _type_map[magic][version]
-    except KeyError:
-        pass
-    _, signature = struct.unpack(VDI_HEADER_FMT, data[:_VDI_L])
-    if signature == VDI_SIGNATURE:
-        return ImageFormat.VDI
-    if struct.unpack(VPC_HEADER_FMT, data[:_VPC_L]) == VPC_CREATOR:
-        return ImageFormat.VPC
-    if struct.unpack(CLOOP_HEADER_FMT, data[:_CLOOP_L]) == CLOOP_MAGIC:
-        return ImageFormat.CLOOP
-    return ImageFormat.UNKNOWN
+    return _known(imageinfo.read_info(io.BytesIO(data)).format)
 
 
 def image_type_from_file(filename):
-    with open(filename) as fp:
-        return image_type(fp.read(_MAX_HEADER))
+    return _known(imageinfo.info(filename).format)
 
 
 def dispose(obj):
@@ -0,0 +1,220 @@
+# -*- test-case-name: virtualbricks.tests.test_topology -*-
+# Virtualbricks - a vde/qemu gui written in python and GTK/Glade.
+# Copyright (C) 2018 Virtualbricks team
+
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+"""The graph of the connections between the bricks.
+
+There is an edge from brick A to brick B for each plug of A connected to a
+sock of B: A depends on B. The graph is kept up to date by the factory and by
+the plugs, so that the questions about the topology do not need to walk all
+the bricks.
+"""
+
+import collections
+
+
+__all__ = ["Graph"]
+
+
+def _is_edge(plug):
+    sock = plug.sock
+    return (sock is not None and sock.mode != "hostonly" and
+            sock.brick is not None)
+
+
+class Graph:
+
+    def __init__(self):
+        # brick -> {plug: brick}, ordered by connection time
+        self._out = {}
+        self._in = {}
+        # Incremented at every change, useful to invalidate caches
+        self.version = 0
+
+    def __contains__(self, brick):
+        return brick in self._out
+
+    def __iter__(self):
+        return iter(self._out)
+
+    def __len__(self):
+        return len(self._out)
+
+    def clear(self):
+        self._out.clear()
+        self._in.clear()
+        self.version += 1
+
+    def add(self, brick):
+        if brick not in self._out:
+            self._out[brick] = collections.OrderedDict()
+            self._in[brick] = collections.OrderedDict()
+            self.version += 1
+
+    def remove(self, brick):
+        """Remove the brick and all its edges.
+
+        @return: the plugs of the other bricks that were connected to the
+            socks of C{brick}.
+        """
+
+        if brick not in self._out:
+            return []
+        incoming = list(self._in.pop(brick))
+        for plug, dst in self._out.pop(brick).items():
+            if dst in self._in:
+                self._in[dst].pop(plug, None)
+        for plug in incoming:
+            self._out.get(plug.brick, {}).pop(plug, None)
+        self.version += 1
+        return incoming
+
+    def link(self, plug):
+        """Add the edge of a plug just connected to a sock."""
+
+        if _is_edge(plug):
+            src, dst = plug.brick, plug.sock.brick
+            self.add(src)
+            self.add(dst)
+            self._out[src][plug] = dst
+            self._in[dst][plug] = src
+            self.version += 1
+
+    def unlink(self, plug):
+        """Remove the edge of a plug, before it is disconnected."""
+
+        dst = self._out.get(plug.brick, {}).pop(plug, None)
+        if dst is not None:
+            self._in[dst].pop(plug, None)
+            self.version += 1
+
+    def links(self, brick):
+        """Return the connected plugs of C{brick}."""
+
+        return list(self._out.get(brick, ()))
+
+    def incoming(self, brick):
+        """Return the plugs connected to the socks of C{brick}."""
+
+        return list(self._in.get(brick, ()))
+
+    def dependencies(self, brick):
+        """Return the bricks C{brick} is plugged into, itself excluded."""
+
+        return [dst for dst in _unique(self._out.get(brick, {}).values())
+                if dst is not brick]
+
+    def dependents(self, brick):
+        """Return the bricks plugged into C{brick}, itself excluded."""
+
+        return [src for src in _unique(self._in.get(brick, {}).values())
+                if src is not brick]
+
+    def neighbours(self, brick):
+        return _unique(self.dependencies(brick) + self.dependents(brick))
+
+    def component(self, brick):
+        """Return the set of the bricks connected, directly or not, to
+        C{brick}, C{brick} included."""
+
+        seen = set([brick])
+        stack = [brick]
+        while stack:
+            for neighbour in self.neighbours(stack.pop()):
+                if neighbour not in seen:
+                    seen.add(neighbour)
+                    stack.append(neighbour)
+        return seen
+
+    def components(self):
+        """Return the list of the connected components."""
+
+        seen = set()
+        components = []
+        for brick in self._out:
+            if brick not in seen:
+                component = self.component(brick)
+                seen.update(component)
+                components.append(component)
+        return components
+
+    def shortest_path(self, source, target):
+        """Return the shortest list of bricks that connects C{source} to
+        C{target}, ignoring the direction of the links, or C{None} if they
+        are not connected."""
+
+        if source not in self._out or target not in self._out:
+            return None
+        parents = {source: None}
+        queue = collections.deque([source])
+        while queue:
+            brick = queue.popleft()
+            if brick is target:
+                path = []
+                while brick is not None:
+                    path.append(brick)
+                    brick = parents[brick]
+                return path[::-1]
+            for neighbour in self.neighbours(brick):
+                if neighbour not in parents:
+                    parents[neighbour] = brick
+                    queue.append(neighbour)
+        return None
+
+    def find_cycle(self, bricks=None):
+        """Return a list of bricks that form a loop of dependencies, the
+        first brick depends on the second and so on, or C{None} if there are
+        no loops. A brick plugged into itself is not a loop.
+
+        @param bricks: look for loops reachable from these bricks, by
+            default from all the bricks.
+        """
+
+        WHITE, GREY, BLACK = 0, 1, 2
+        color = dict.fromkeys(self._out, WHITE)
+        for root in (self._out if bricks is None else bricks):
+            if color.get(root, BLACK) != WHITE:
+                continue
+            color[root] = GREY
+            path = [root]
+            stack = [iter(self.dependencies(root))]
+            while stack:
+                for dep in stack[-1]:
+                    if color[dep] == GREY:
+                        return path[path.index(dep):]
+                    if color[dep] == WHITE:
+                        color[dep] = GREY
+                        path.append(dep)
+                        stack.append(iter(self.dependencies(dep)))
+                        break
+                else:
+                    color[path.pop()] = BLACK
+                    stack.pop()
+        return None
+
+    def has_cycle(self, bricks=None):
+        return self.find_cycle(bricks) is not None
+
+
+def _unique(iterable):
+    seen = set()
+    result = []
+    for item in iterable:
+        if item not in seen:
+            seen.add(item)
+            result.append(item)
+    return result
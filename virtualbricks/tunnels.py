@@ -16,19 +16,44 @@
 # with this program; if not, write to the Free Software Foundation, Inc.,
 # 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
 
+import hashlib
 import os
 
+from twisted.internet import threads
+
 from virtualbricks import bricks, link, log
 from virtualbricks._spawn import abspath_vde
 
 
 logger = log.Logger()
-pwdgen_exit = log.Event("Command pwdgen exited with {code}")
+key_written = log.Event("Tunnel key written in {path}")
 
 if False:  # pyflakes
     _ = str
 
 
+def key(password):
+    """Return the content of the key file of vde_cryptcab.
+
+    It is the output of C{echo <password> | sha1sum}.
+    """
+
+    digest = hashlib.sha1(password.encode("utf-8") + b"\n").hexdigest()
+    return "{0}  -\n".format(digest).encode("ascii")
+
+
+def write_key(path, password):
+    """Write the key file, readable only by the user, and flush it to
+    disk."""
+
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    try:
+        os.write(fd, key(password))
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
 class TunnelListenConfig(bricks.Config):
 
     parameters = {"password": bricks.String(""),
@@ -66,19 +91,16 @@ class TunnelListen(bricks.Brick):
     def configured(self):
         return bool(self.plugs[0].sock)
 
+    def key_path(self):
+        return "/tmp/tunnel_%s.key" % self.name
+
     def args(self):
-        # TODO: port to utils.getProcessOutput
-        pwdgen = "echo %s | sha1sum >/tmp/tunnel_%s.key && sync" % (
-            self.config["password"], self.name)
-        exitstatus = os.system(pwdgen)
-        logger.info(pwdgen_exit, code=exitstatus)
-        res = []
-        res.append(self.prog())
-        res.append("-P")
-        res.append("/tmp/tunnel_%s.key" % self.name)
-        for arg in self.build_cmd_line():
-            res.append(arg)
-        return res
+        path = self.key_path()
+        d = threads.deferToThread(write_key, path, self.config["password"])
+        d.addCallback(lambda _: logger.info(key_written, path=path))
+        d.addCallback(lambda _: [self.prog(), "-P", path] +
+                      list(self.build_cmd_line()))
+        return d
 
     #def post_poweroff(self):
     #    os.unlink("/tmp/tunnel_%s.key" % self.name)
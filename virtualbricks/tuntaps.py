@@ -19,9 +19,17 @@
 import os
 from collections import OrderedDict as odict
 
-from virtualbricks import bricks, link, settings
+from twisted.internet import defer, error, utils
+
+from virtualbricks import bricks, link, settings, log
 from virtualbricks._spawn import abspath_vde
 
+
+logger = log.Logger()
+configure_iface = log.Event("Configuring {name}: {args()}")
+configure_failed = log.Event("Cannot configure {name}: {args()} exited with "
+                             "{code}\n{err}")
+
 if False:  # pyflakes
     _ = str
 
@@ -107,32 +115,50 @@ class Tap(PrivilegedBrick):
     def configured(self):
         return bool(self.plugs[0].sock)
 
-    def post_poweron(self):
-        # XXX: fixme
-        self.start_related_events(on=True)
-        if self.config["mode"] == 'dhcp':
-            if self.needsudo():
-                os.system(settings.get('sudo') + ' "dhclient ' + self.name
-                          + '"')
-            else:
-                os.system('dhclient ' + self.name)
-        elif self.config["mode"] == 'manual':
+    def probe_ready(self):
+        """The tap is ready when the interface is configured."""
+
+        return self.configure_interface()
+
+    def interface_commands(self):
+        """Return the commands that configure the interface, they are run in
+        order."""
+
+        if self.config["mode"] == "dhcp":
+            return [["dhclient", self.name]]
+        elif self.config["mode"] == "manual":
+            commands = [["/sbin/ifconfig", self.name, self.config["ip"],
+                         "netmask", self.config["nm"]]]
+            if self.config["gw"]:
+                commands.append(["/sbin/route", "add", "default", "gw",
+                                 self.config["gw"], "dev", self.name])
+            return commands
+        return []
+
+    def configure_interface(self, _=None, run=utils.getProcessOutputAndValue):
+        """Configure the interface with asynchronous processes.
+
+        @return: a deferred that fires with the brick or fails with
+            L{error.ProcessTerminated} if a command fails.
+        """
+
+        d = defer.succeed(None)
+        for args in self.interface_commands():
             if self.needsudo():
-                    # XXX Ugly, can't we ioctls?
-                    os.system(settings.get('sudo') + ' "/sbin/ifconfig ' +
-                              self.name + ' ' + self.config["ip"] + ' netmask ' +
-                              self.config["nm"] + '"')
-                    if (len(self.config["gw"]) > 0):
-                        os.system(settings.get('sudo') +
-                                  ' "/sbin/route add default gw ' +
-                                  self.config["gw"] + ' dev ' + self.name +
-                                  '"')
-            else:
-                    os.system('/sbin/ifconfig ' + self.name + ' ' +
-                              self.config["ip"] + ' netmask ' +
-                              self.config["nm"])
-                    if (len(self.config["gw"]) > 0):
-                        os.system('/sbin/route add default gw ' +
-                                  self.config["gw"] + ' dev ' + self.name)
-        else:
-            return
+                args = [settings.get("sudo"), "--"] + args
+            d.addCallback(self._run, args, run)
+        return d.addCallback(lambda _: self)
+
+    def _run(self, _, args, run):
+        logger.info(configure_iface, name=self.name,
+                    args=lambda: " ".join(args))
+        d = run(args[0], args[1:], os.environ)
+
+        def check(result):
+            out, err, code = result
+            if code != 0:
+                logger.error(configure_failed, name=self.name, code=code,
+                             err=err, args=lambda: " ".join(args))
+                raise error.ProcessTerminated(code)
+
+        return d.addCallback(check)
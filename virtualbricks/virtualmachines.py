@@ -23,11 +23,11 @@ import datetime
 import shutil
 import itertools
 
-from twisted.internet import utils, defer
+from twisted.internet import defer, threads
 
 from virtualbricks import (errors, tools, settings, bricks, log, project,
-                           observable)
-from virtualbricks._spawn import getQemuOutputAndValue, abspath_qemu
+                           observable, imageinfo, qmp, readiness, jobs)
+from virtualbricks._spawn import abspath_qemu
 
 
 if False:
@@ -39,6 +39,11 @@ new_cow = log.Event("Creating a new private COW from {base} image.")
 invalid_base = log.Event("{cowname} private cow found with a different base "
                          "image ({base}): moving it in {path}")
 powerdown = log.Event("Sending powerdown to {vm}")
+powerdown_failed = log.Event("Cannot send powerdown to {vm}")
+qmp_unavailable = log.Event("QMP not available on {vm}, sending {command} to "
+                            "the monitor")
+qmp_failed = log.Event("Cannot connect to the QMP socket of {vm}")
+usb_failed = log.Event("Cannot {action} usb device {device} on {vm}")
 update_usb = log.Event("update_usbdevlist: old {old} - new {new}")
 own_err = log.Event("plug {plug} does not belong to {brick}")
 acquire_lock = log.Event("Aquiring disk locks")
@@ -47,6 +52,8 @@ release_lock = log.Event("Releasing disk locks")
 
 class UsbDevice:
 
+    __slots__ = ("ID", "desc")
+
     def __init__(self, ID, desc=""):
         self.ID = ID
         self.desc = desc
@@ -81,9 +88,12 @@ class UsbDevice:
 
 
 class Wrapper:
+    """Forward the attributes, read or written, to the original object."""
+
+    __slots__ = ("original", )
 
     def __init__(self, original):
-        self.__dict__["original"] = original
+        object.__setattr__(self, "original", original)
 
     def __getattr__(self, name):
         try:
@@ -93,31 +103,30 @@ class Wrapper:
                 self, name))
 
     def __setattr__(self, name, value):
-        if name in self.__dict__:
-            self.__dict__[name] = value
+        if name == "original":
+            object.__setattr__(self, name, value)
         else:
-            for klass in self.__class__.__mro__:
-                if name in klass.__dict__:
-                    self.__dict__[name] = value
-                    break
-            else:
-                setattr(self.original, name, value)
+            setattr(self.original, name, value)
 
 
 class VMPlug(Wrapper):
 
-    def __init__(self, plug):
+    __slots__ = ()
+
+    def __init__(self, plug, mac=None):
         Wrapper.__init__(self, plug)
         self.model = "rtl8139"
-        self.mac = tools.random_mac()
+        self.mac = mac or tools.random_mac()
 
 
 class VMSock(Wrapper):
 
-    def __init__(self, sock):
+    __slots__ = ()
+
+    def __init__(self, sock, mac=None):
         Wrapper.__init__(self, sock)
         self.model = "rtl8139"
-        self.mac = tools.random_mac()
+        self.mac = mac or tools.random_mac()
 
     def connect(self, endpoint):
         return
@@ -215,6 +224,15 @@ class Image:
     def exists(self):
         return os.path.exists(self.path)
 
+    def info(self):
+        """Return the L{imageinfo.ImageInfo} of the image or C{None} if it
+        cannot be read."""
+
+        try:
+            return imageinfo.info(self.path)
+        except (IOError, OSError):
+            return None
+
     def acquire(self, disk):
         if self.master in (None, disk):
             self.master = disk
@@ -243,6 +261,12 @@ class Image:
             return repr(self.master)
         elif format_string == "s":
             return self.get_size()
+        elif format_string == "f":
+            info = self.info()
+            return info.format.name.lower() if info else ""
+        elif format_string == "v":
+            info = self.info()
+            return tools.fmtsize(info.virtual_size) if info else ""
         raise ValueError("invalid format string " + repr(format_string))
 
 
@@ -258,8 +282,7 @@ def move(src, dst):
 
 class Disk:
 
-    sync_cmd = "sync"
-    image = None
+    __slots__ = ("VM", "device", "image")
 
     @property
     def cow(self):
@@ -276,6 +299,7 @@ class Disk:
     def __init__(self, VM, dev):
         self.VM = VM
         self.device = dev
+        self.image = None
 
     def _virtio_args_cb(self, disk_name):
         return ["-drive", "file={0},if=virtio".format(disk_name)]
@@ -308,20 +332,20 @@ class Disk:
     def _get_base(self):
         return self.image.path
 
-    def _sync(self, ret):
+    def _sync(self, ret, cowname):
 
-        def complain_on_error(ret):
-            out, err, code = ret
-            if code != 0:
-                raise RuntimeError("sync failed\n%s" % err)
+        def complain_on_error(fail):
+            fail.trap(OSError)
+            raise RuntimeError("sync failed\n%s" % fail.value)
 
         out, err, code = ret
         if code != 0:
             raise RuntimeError("Cannot create private COW\n%s" % err)
 
-        exit = utils.getProcessOutputAndValue(self.sync_cmd, env=os.environ)
-        exit.addCallback(complain_on_error)
-        return exit
+        # Flush only the new image, not the whole page cache of the host.
+        d = threads.deferToThread(tools.fsync, cowname)
+        d.addErrback(complain_on_error)
+        return d
 
     def _create_cow(self, cowname):
         if abspath_qemu('qemu-img', return_relative=False) is None:
@@ -331,14 +355,15 @@ class Disk:
         logger.info(new_cow, base=self._get_base())
         args = ["create", "-b", self._get_base(), "-f",
                 settings.get("cowfmt"), cowname]
-        exit = getQemuOutputAndValue("qemu-img", args, os.environ)
-        exit.addCallback(self._sync)
+        # Creating an overlay only writes its header: it is not I/O bound and
+        # the virtual machine is waiting for it.
+        exit = jobs.qemu_img(args, priority=jobs.HIGH, io=False).deferred
+        exit.addCallback(self._sync, cowname)
         exit.addCallback(lambda _: cowname)
         return exit
 
     def _check_base(self, cowname):
-        with open(cowname) as fp:
-            backing_file = tools.get_backing_file(fp)
+        backing_file = imageinfo.backing_file(cowname)
         if backing_file == self._get_base():
             return defer.succeed(cowname)
         else:
@@ -385,7 +410,6 @@ class Disk:
 
     def __deepcopy__(self, memo):
         new = type(self)(self.VM, self.device)
-        new.sync_cmd = self.sync_cmd
         if self.image is not None:
             new.set_image(self.image)
         return new
@@ -494,6 +518,13 @@ VM_COMMAND_BUILDER = {
 
 
 class DefaultDevice:
+    """The default of the disk parameters, a device without an image.
+
+    The L{Disk} of a device is created only when it is needed, see
+    L{VirtualMachineConfig}.
+    """
+
+    image = None
 
     def __ne__(self, other):
         if isinstance(other, Disk):
@@ -503,6 +534,16 @@ class DefaultDevice:
     def __eq__(self, other):
         return not self != other
 
+    def __hash__(self):
+        return id(self)
+
+    # A singleton
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        return self
+
 
 default_device = DefaultDevice()
 
@@ -533,8 +574,17 @@ class UsbDeviceParameter(bricks.String):
         return str(in_object)
 
 
+DEVICES = ("hda", "hdb", "hdc", "hdd", "fda", "fdb", "mtdblock")
+
+
 class VirtualMachineConfig(bricks.Config):
+    """The configuration of a virtual machine.
 
+    The L{Disk} of a device is created the first time the device is read,
+    most virtual machines use one or two of the seven devices.
+    """
+
+    vm = None
     parameters = {"name": bricks.String(""),
 
                   # boot options
@@ -621,6 +671,18 @@ class VirtualMachineConfig(bricks.Config):
                   "stdout": bricks.String(""),
                   "loadvm": bricks.String("")}
 
+    def __missing__(self, name):
+        default = self._defaults[name]
+        if default is default_device and self.vm is not None:
+            disk = Disk(self.vm, name)
+            dict.__setitem__(self, name, disk)
+            return disk
+        return default
+
+
+def _usb_id(device):
+    return "usb-" + str(device).replace(":", "-")
+
 
 def _get_nick(link):
     if hasattr(link, "sock"):
@@ -632,6 +694,7 @@ class VirtualMachine(bricks.Brick):
 
     type = "Qemu"
     term_command = "unixterm"
+    poweroff_signal = None
     command_builder = VM_COMMAND_BUILDER
     config_factory = VirtualMachineConfig
     process_protocol = bricks.Process
@@ -643,8 +706,8 @@ class VirtualMachine(bricks.Brick):
         self.image_changed = observable.Event(self._observable,
                                               "image-changed")
         self.config["name"] = name
-        for dev in "hda", "hdb", "hdc", "hdd", "fda", "fdb", "mtdblock":
-            self.config[dev] = Disk(self, dev)
+        self.config.vm = self
+        self.qmp = qmp.QMPClient(name, self.qmp_path())
 
     def poweron(self, snapshot=""):
         def acquire(passthru):
@@ -670,8 +733,11 @@ class VirtualMachine(bricks.Brick):
             return defer.succeed((self, self._last_status))
         elif not any((kill, term)):
             self.logger.info(powerdown, vm=self)
-            self.send("system_powerdown\n")
-            return self._exited_d
+            exited = self._exited_d
+            d = self.system_powerdown()
+            d.addErrback(self.logger.failure_eb, powerdown_failed,
+                         vm=self.name)
+            return exited
         if term:
             return bricks.Brick.poweroff(self)
         else:
@@ -686,10 +752,76 @@ class VirtualMachine(bricks.Brick):
 
     def update_usbdevlist(self, dev):
         self.logger.debug(update_usb, old=self.config["usbdevlist"], new=dev)
-        for device in set(dev) - set(self.config["usbdevlist"]):
-            self.send("usb_add host:{0}\n".format(device))
-        # FIXME: Don't know how to remove old devices, due to the ugly syntax
-        # of usb_del command.
+        if self.proc is None:
+            return defer.succeed(None)
+        old = set(self.config["usbdevlist"])
+        dl = [self.usb_add(device) for device in set(dev) - old]
+        dl.extend(self.usb_del(device) for device in old - set(dev))
+        return defer.DeferredList(dl)
+
+    # QMP operations
+
+    def qmp_path(self):
+        return "%s/%s.qmp" % (settings.VIRTUALBRICKS_HOME, self.name)
+
+    def process_started(self, proc):
+        self.qmp.name = self.name
+        self.qmp.path = self.qmp_path()
+        bricks.Brick.process_started(self, proc)
+
+    def probe_ready(self):
+        """A virtual machine is ready when the QMP socket accepts commands or,
+        if QMP is not available, when the monitor socket accepts
+        connections."""
+
+        def fallback(fail):
+            if fail.check(defer.CancelledError):
+                return fail
+            self.logger.failure(qmp_failed, fail, vm=self.name)
+            console = self.console()
+            return readiness.poll(lambda: readiness.socket_accepts(console))
+
+        return self.qmp.connect().addErrback(fallback)
+
+    def process_ended(self, proc, status):
+        self.qmp.disconnect()
+        bricks.Brick.process_ended(self, proc, status)
+
+    def _execute(self, command):
+        """Execute a QMP command without arguments, fall back to the human
+        monitor on stdin if the QMP socket is not connected."""
+
+        def fallback(fail):
+            fail.trap(qmp.NotConnectedError)
+            self.logger.warn(qmp_unavailable, vm=self.name, command=command)
+            self.send(command + "\n")
+
+        return self.qmp.execute(command).addErrback(fallback)
+
+    def system_powerdown(self):
+        return self._execute("system_powerdown")
+
+    def system_reset(self):
+        return self._execute("system_reset")
+
+    def savevm(self, name="virtualbricks"):
+        return self.qmp.human_monitor_command("savevm " + name)
+
+    def loadvm(self, name="virtualbricks"):
+        return self.qmp.human_monitor_command("loadvm " + name)
+
+    def usb_add(self, device):
+        vendor, product = str(device).split(":")
+        d = self.qmp.execute("device_add", {
+            "driver": "usb-host", "id": _usb_id(device),
+            "vendorid": "0x" + vendor, "productid": "0x" + product})
+        return d.addErrback(self.logger.failure_eb, usb_failed, action="add",
+                            device=device, vm=self.name)
+
+    def usb_del(self, device):
+        d = self.qmp.execute("device_del", {"id": _usb_id(device)})
+        return d.addErrback(self.logger.failure_eb, usb_failed,
+                            action="remove", device=device, vm=self.name)
 
     def configured(self):
         # return all([p.configured() for p in self.plugs])
@@ -793,35 +925,44 @@ class VirtualMachine(bricks.Brick):
         res.extend(["-mon", "chardev=mon", "-chardev",
                     "socket,id=mon,path=%s,server,nowait" %
                     self.console(),
+                    "-mon", "chardev=qmp,mode=control", "-chardev",
+                    "socket,id=qmp,path=%s,server,nowait" %
+                    self.qmp_path(),
                     "-mon", "chardev=mon_cons", "-chardev",
                     "stdio,id=mon_cons,signal=off"])
         return res
 
     def add_sock(self, mac=None, model=None):
-        s = self.factory.new_sock(self)
-        sock = VMSock(s)
         vlan = len(self.plugs) + len(self.socks)
+        s = self.factory.new_sock(self, "{0}_sock_eth{1}".format(self.name,
+                                                                 vlan))
+        sock = VMSock(s, self._reserve_mac(mac))
         sock.path = "{0}/{1.brick.name}_sock_eth{2}[]".format(
             settings.VIRTUALBRICKS_HOME, sock, vlan)
-        sock.nickname = "{0.brick.name}_sock_eth{1}".format(sock, vlan)
         self.socks.append(sock)
-        if mac:
-            sock.mac = mac
         if model:
             sock.model = model
         return sock
 
     def add_plug(self, sock, mac=None, model=None):
-        plug = VMPlug(self.factory.new_plug(self))
+        plug = VMPlug(self.factory.new_plug(self), self._reserve_mac(mac))
         self.plugs.append(plug)
         if sock:
             plug.connect(sock)
-        if mac:
-            plug.mac = mac
         if model:
             plug.model = model
         return plug
 
+    def _reserve_mac(self, mac):
+        if mac:
+            try:
+                self.factory.macs.reserve(mac)
+            except ValueError:
+                # Not a valid address, let qemu complain about it
+                pass
+            return mac
+        return self.factory.macs.allocate()
+
     def connect(self, sock, *args):
         self.add_plug(sock, *args)
 
@@ -833,10 +974,12 @@ class VirtualMachine(bricks.Brick):
                 self.plugs.remove(plug)
         except ValueError:
             self.logger.error(own_err, plug=plug, brick=self)
+        else:
+            self.factory.macs.release(plug.mac)
+            self.factory.mark_dirty(self)
 
-    def commit_disks(self, args):
-        # XXX: fixme
-        self.send("commit all\n")
+    def commit_disks(self, args=None):
+        return self.qmp.human_monitor_command("commit all")
 
     def acquire(self):
         """Acquire locks on images if needed."""
@@ -858,8 +1001,12 @@ class VirtualMachine(bricks.Brick):
             disk.release()
 
     def disks(self):
-        for hd in "hda", "hdb", "hdc", "hdd", "fda", "fdb", "mtdblock":
-            yield self.config[hd]
+        """Yield the disks that are in use, the others have no image."""
+
+        for hd in DEVICES:
+            disk = dict.get(self.config, hd)
+            if disk is not None:
+                yield disk
 
     def set_image(self, disk, image):
         self.config[disk].image = image
@@ -870,7 +1017,26 @@ class VirtualMachine(bricks.Brick):
         disk.VM = self
 
     cbset_hda = cbset_hdb = cbset_hdc = cbset_hdd = cbset_fda = cbset_fdb = \
-            cbset_mtblock = set_vm
+            cbset_mtdblock = set_vm
+
+
+def create_overlays(vms):
+    """Create the private COW images of the virtual machines in advance.
+
+    The images that already exist are checked as they would be at poweron.
+    The qemu-img processes are run by the job manager, that limits how many
+    run at the same time.
+
+    @return: a deferred that fires with the list of the paths of the images,
+        or fails with the first error.
+    """
+
+    dl = [disk.get_real_disk_name() for vm in vms
+          for disk in vm.disks() if disk.image is not None and disk.cow]
+    d = defer.gatherResults(dl, consumeErrors=True)
+    d.addErrback(lambda fail: fail.value.subFailure
+                 if fail.check(defer.FirstError) else fail)
+    return d
 
 
 def is_virtualmachine(brick):
@@ -0,0 +1,198 @@
+# -*- test-case-name: virtualbricks.tests.test_watchdog -*-
+# Virtualbricks - a vde/qemu gui written in python and GTK/Glade.
+# Copyright (C) 2018 Virtualbricks team
+
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+"""Detect the stalls of the reactor.
+
+A heartbeat scheduled on the reactor measures how late every tick is and
+collects the lag in a L{Histogram}. A helper thread checks the heartbeat: if
+the reactor does not tick for more than C{threshold} seconds, the helper
+captures the stack of the main thread, that is the code that is blocking the
+reactor. The stall is logged when the reactor is running again.
+"""
+
+import bisect
+import sys
+import threading
+import time
+import traceback
+
+from virtualbricks import log
+
+
+__all__ = ["Histogram", "Watchdog", "capture_stack"]
+
+logger = log.Logger()
+stall_detected = log.Event("Reactor blocked for {duration:.3f}s\n{stack}")
+
+# Upper bounds of the histogram buckets, in seconds.
+BUCKETS = (0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1.0, 2.0,
+           5.0)
+INTERVAL = 0.1
+THRESHOLD = 0.5
+
+
+def capture_stack(thread_id):
+    """Return the formatted stack of a running thread or C{None}."""
+
+    frame = sys._current_frames().get(thread_id)
+    if frame is None:
+        return None
+    return "".join(traceback.format_stack(frame))
+
+
+class Histogram:
+    """Count the samples in fixed buckets, see L{BUCKETS}."""
+
+    def __init__(self, bounds=BUCKETS):
+        self.bounds = tuple(bounds)
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, value):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+
+    def reset(self):
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def mean(self):
+        return self.total / self.count if self.count else 0.0
+
+    def percentile(self, p):
+        """Return the upper bound of the bucket that contains the C{p}-th
+        percentile, C{max} for the last bucket."""
+
+        if not self.count:
+            return 0.0
+        rank = p / 100.0 * self.count
+        seen = 0
+        for bound, count in zip(self.bounds, self.counts):
+            seen += count
+            if seen >= rank:
+                return min(bound, self.max)
+        return self.max
+
+    def buckets(self):
+        """Return a list of C{(upper bound, count)}, the last bound is
+        C{None}."""
+
+        return list(zip(self.bounds + (None, ), self.counts))
+
+
+class Watchdog:
+
+    _call = None
+    _thread = None
+
+    def __init__(self, threshold=THRESHOLD, interval=INTERVAL, clock=None,
+                 timer=time.time):
+        if clock is None:
+            from twisted.internet import reactor as clock
+        self.threshold = threshold
+        self.interval = interval
+        self.clock = clock
+        self.timer = timer
+        self.histogram = Histogram()
+        self.stalls = 0
+        self._lock = threading.Lock()
+        self._stopping = threading.Event()
+        self._beat = 0
+        self._last_beat = None
+        self._captured = None
+        self._main_thread = None
+
+    def start(self):
+        """Start the heartbeat and the helper thread.
+
+        Must be called from the thread that runs the reactor.
+        """
+
+        if self._call is not None:
+            return
+        self._main_thread = threading.current_thread().ident
+        self._last_beat = self.timer()
+        self._call = self.clock.callLater(self.interval, self._tick,
+                                          self._last_beat + self.interval)
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self._watch,
+                                        name="virtualbricks-watchdog")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        if self._call is not None:
+            if self._call.active():
+                self._call.cancel()
+            self._call = None
+        if self._thread is not None:
+            self._stopping.set()
+            self._thread.join()
+            self._thread = None
+
+    def is_running(self):
+        return self._call is not None
+
+    def _tick(self, expected):
+        now = self.timer()
+        lag = max(now - expected, 0.0)
+        self.histogram.add(lag)
+        with self._lock:
+            beat = self._beat
+            captured, self._captured = self._captured, None
+            self._beat += 1
+            self._last_beat = now
+        if lag >= self.threshold:
+            self.stalls += 1
+            if captured is not None and captured[0] == beat:
+                stack = captured[1]
+            else:
+                stack = "(stack not captured)"
+            logger.warn(stall_detected, duration=lag, stack=stack)
+        self._call = self.clock.callLater(self.interval, self._tick,
+                                          now + self.interval)
+
+    def _watch(self):
+        while not self._stopping.wait(self.threshold / 2):
+            self.check()
+
+    def check(self):
+        """Capture the stack of the main thread if the reactor is blocked.
+
+        Called by the helper thread, the stack is captured at most once for
+        every heartbeat.
+        """
+
+        with self._lock:
+            beat, last_beat = self._beat, self._last_beat
+            if self._captured is not None and self._captured[0] == beat:
+                return
+        if self.timer() - last_beat < self.interval + self.threshold:
+            return
+        stack = capture_stack(self._main_thread)
+        if stack is not None:
+            with self._lock:
+                if self._beat == beat:
+                    self._captured = (beat, stack)
@@ -18,7 +18,9 @@
 
 import re
 
-from virtualbricks import bricks
+from twisted.internet import defer
+
+from virtualbricks import bricks, readiness
 from virtualbricks._spawn import abspath_vde
 
 if False:  # pyflakes
@@ -86,9 +88,17 @@ class NetemuConfig(bricks.Config):
     }
 
 
+def _gather(*results):
+    d = defer.gatherResults([r for r in results
+                             if isinstance(r, defer.Deferred)],
+                            consumeErrors=True)
+    return d.addErrback(lambda f: f.value.subFailure if
+                        f.check(defer.FirstError) else f)
+
+
 class WFProcessProtocol(bricks.VDEProcessProtocol):
 
-    prompt = re.compile(r"^VDEwf\$ ", re.M)
+    prompt = re.compile(br"^VDEwf\$ ", re.M)
 
 
 class Netemu(Wire):
@@ -142,6 +152,14 @@ class Netemu(Wire):
     def prog(self):
         return "vde-netemu"
 
+    def probe_ready(self):
+        """Netemu is ready when its management console answers with the
+        prompt."""
+
+        console = self.console()
+        return readiness.poll(lambda: readiness.prompt_answers(
+            console, self.process_protocol.prompt))
+
     def set(self, attrs):
         self._set(attrs, "chanbufsizesymm", "chanbufsize", "chanbufsizer")
         self._set(attrs, "delaysymm", "delay", "delayr")
@@ -160,56 +178,56 @@ class Netemu(Wire):
 
     def cbset_chanbufsize(self, value):
         if self.config["chanbufsizesymm"]:
-            self.send("chanbufsize {0}\n".format(value))
+            return self.send("chanbufsize {0}\n".format(value))
         else:
-            self.send("chanbufsize LR {0}\n".format(value))
+            return self.send("chanbufsize LR {0}\n".format(value))
 
     def cbset_chanbufsizer(self, value):
         if not self.config["chanbufsizesymm"]:
-            self.send("chanbufsize RL {0}\n".format(value))
+            return self.send("chanbufsize RL {0}\n".format(value))
 
     def cbset_chanbufsizesymm(self, value):
-        self.cbset_chanbufsize(self.config["chanbufsize"])
-        self.cbset_chanbufsizer(self.config["chanbufsizer"])
+        return _gather(self.cbset_chanbufsize(self.config["chanbufsize"]),
+                       self.cbset_chanbufsizer(self.config["chanbufsizer"]))
 
     def cbset_delay(self, value):
         if self.config["delaysymm"]:
-            self.send("delay {0}\n".format(value))
+            return self.send("delay {0}\n".format(value))
         else:
-            self.send("delay LR {0}\n".format(value))
+            return self.send("delay LR {0}\n".format(value))
 
     def cbset_delayr(self, value):
         if not self.config["delaysymm"]:
-            self.send("delay RL {0}\n".format(value))
+            return self.send("delay RL {0}\n".format(value))
 
     def cbset_delaysymm(self, value):
-        self.cbset_delay(self.config["delay"])
-        self.cbset_delayr(self.config["delayr"])
+        return _gather(self.cbset_delay(self.config["delay"]),
+                       self.cbset_delayr(self.config["delayr"]))
 
     def cbset_loss(self, value):
         if self.config["losssymm"]:
-            self.send("loss {0}\n".format(value))
+            return self.send("loss {0}\n".format(value))
         else:
-            self.send("loss LR {0}\n".format(value))
+            return self.send("loss LR {0}\n".format(value))
 
     def cbset_lossr(self, value):
         if not self.config["losssymm"]:
-            self.send("loss RL {0}\n".format(value))
+            return self.send("loss RL {0}\n".format(value))
 
     def cbset_losssymm(self, value):
-        self.cbset_loss(self.config["loss"])
-        self.cbset_lossr(self.config["lossr"])
+        return _gather(self.cbset_loss(self.config["loss"]),
+                       self.cbset_lossr(self.config["lossr"]))
 
     def cbset_bandwidth(self, value):
         if self.config["bandwidthsymm"]:
-            self.send("bandwidth {0}\n".format(value))
+            return self.send("bandwidth {0}\n".format(value))
         else:
-            self.send("bandwidth LR {0}\n".format(value))
+            return self.send("bandwidth LR {0}\n".format(value))
 
     def cbset_bandwidthr(self, value):
         if not self.config["bandwidthsymm"]:
-            self.send("bandwidth RL {0}\n".format(value))
+            return self.send("bandwidth RL {0}\n".format(value))
 
     def cbset_bandwidthsymm(self, value):
-        self.cbset_bandwidth(self.config["bandwidth"])
-        self.cbset_bandwidthr(self.config["bandwidthr"])
+        return _gather(self.cbset_bandwidth(self.config["bandwidth"]),
+                       self.cbset_bandwidthr(self.config["bandwidthr"]))